@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Generate a synthetic mtm library: a database with tagged files and a small folder on disk
+
+The database holds `file_count` files spread over `folder_count` folders. Each file has 1 to
+`max_tags_by_file` tags, drawn with a Zipf distribution (a few tags are on most files, most tags
+are rare). Tags are split between `collection_count` collections.
+
+Filesystem operations are measured on `disk_file_count` real (empty) files created under
+`<root>/disk`: they are all tagged with `disk_tag`, others tags of the database never match a file
+on disk.
+"""
+import argparse
+from itertools import accumulate
+from pathlib import Path
+import random
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mtm import App, iter_batches, BATCH_SIZE # noqa: E402
+
+DISK_TAG = "disk_files"
+
+
+def generate_library(db_path, root, file_count, folder_count=None, tag_count=64, collection_count=4,
+		max_tags_by_file=4, zipf_exponent=1.1, disk_file_count=2000, seed=0):
+	"""Create the database `db_path` (must not exist) and the disk folder under `root`"""
+	rng = random.Random(seed)
+	root = Path(root).resolve()
+	folder_count = folder_count or max(1, file_count // 200)
+
+	app = App(db_path=str(db_path))
+	for collection_position in range(collection_count):
+		app.create_new_collection(f"collection {collection_position}")
+	for tag_position in range(tag_count):
+		app.create_new_tag(f"tag {tag_position:03d}", f"collection {tag_position % collection_count}")
+	app.create_new_tag(DISK_TAG)
+	app.db_connection.commit()
+
+	# Folders: <root>/library/<group>/<folder>, 20 folders by group
+	folder_ids = [app._get_folder_id(root / "library" / f"group{position // 20:04d}" / f"folder{position:06d}", create=True)
+		for position in range(folder_count)]
+	app.cursor.execute("SELECT tag_id FROM tag WHERE slug != ? ORDER BY slug;", (DISK_TAG,))
+	tag_ids = [row[0] for row in app.cursor.fetchall()]
+	cumulative_weights = list(accumulate(1 / rank ** zipf_exponent for rank in range(1, tag_count + 1)))
+
+	def _filetag_rows():
+		for file_position in range(file_count):
+			folder_id = folder_ids[file_position % folder_count]
+			filename = f"file{file_position:08d}.mkv"
+			file_tags = set(rng.choices(tag_ids, cum_weights=cumulative_weights, k=rng.randint(1, max_tags_by_file)))
+			for tag_id in file_tags:
+				yield (folder_id, filename, tag_id)
+
+	for batch in iter_batches(_filetag_rows(), BATCH_SIZE * 10):
+		app.cursor.executemany("INSERT INTO filetag(folder_id, filename, tag_id) VALUES(?, ?, ?) ON CONFLICT DO NOTHING;", batch)
+	app.db_connection.commit()
+
+	disk_folder = root / "disk"
+	disk_folder.mkdir(parents=True, exist_ok=True)
+	for file_position in range(disk_file_count):
+		(disk_folder / f"disk{file_position:06d}.txt").touch()
+	app.tag_all_files_from_folder(DISK_TAG, disk_folder)
+	app.db_connection.commit()
+	app.cursor.execute("ANALYZE;")
+	app.quit()
+	return disk_folder
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("db_path")
+	parser.add_argument("root", help="Folder of the files on disk, also used as prefix of the synthetic folders")
+	parser.add_argument("--files", type=int, default=10000)
+	parser.add_argument("--folders", type=int, default=None)
+	parser.add_argument("--tags", type=int, default=64)
+	parser.add_argument("--collections", type=int, default=4)
+	parser.add_argument("--zipf", type=float, default=1.1)
+	parser.add_argument("--disk-files", type=int, default=2000)
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+	if Path(args.db_path).exists():
+		parser.error(f"{args.db_path} already exists")
+	generate_library(args.db_path, args.root, args.files, folder_count=args.folders, tag_count=args.tags,
+		collection_count=args.collections, zipf_exponent=args.zipf, disk_file_count=args.disk_files, seed=args.seed)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Time the core App operations on synthetic libraries and write the results as JSON
+
+Libraries are generated once by size (see generate_library.py) into the work folder and copied
+before each size is measured, so write operations do not change the next measures.
+
+    ./benchmarks/run_benchmarks.py --sizes 10000 100000 --output results.json
+    ./benchmarks/run_benchmarks.py --sizes 10000 100000 --compare results.json
+"""
+import argparse
+from datetime import datetime, timezone
+import json
+from pathlib import Path
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from generate_library import generate_library, DISK_TAG # noqa: E402
+from mtm import App # noqa: E402
+
+MAX_SEARCH_TAGS = 8
+TAGS_FOR_FILE_LOOKUPS = 100 # By run of the get_all_tags_for_file benchmark
+
+
+def get_commit():
+	try:
+		result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent)
+		return result.stdout.strip() or None
+	except OSError:
+		return None
+
+
+def get_library(work_folder, file_count, seed) -> (Path, Path):
+	"""Return (database path, disk folder) of a fresh copy of the library of `file_count` files"""
+	library_folder = work_folder / f"library-{file_count}-{seed}"
+	pristine_db = library_folder / "pristine.db"
+	if not pristine_db.exists():
+		print(f"Generating library of {file_count} files...", file=sys.stderr)
+		library_folder.mkdir(parents=True, exist_ok=True)
+		generate_library(pristine_db, library_folder, file_count, seed=seed)
+	db_path = library_folder / "benchmark.db"
+	for suffix in ("", "-wal", "-shm", ".tagidx"):
+		Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+	shutil.copy(pristine_db, db_path)
+	return db_path, library_folder / "disk"
+
+
+def measure(function, repeat, setup=None, teardown=None) -> [float]:
+	durations = []
+	for run in range(repeat):
+		if setup is not None:
+			setup(run)
+		start_time = time.perf_counter()
+		function(run)
+		durations.append(time.perf_counter() - start_time)
+		if teardown is not None:
+			teardown(run)
+	return durations
+
+
+def run_size(work_folder, file_count, repeat, seed) -> [dict]:
+	db_path, disk_folder = get_library(work_folder, file_count, seed)
+	app = App(db_path=str(db_path))
+	rng = random.Random(seed)
+	results = []
+
+	def _add_result(operation, durations, **parameters):
+		results.append({
+			"files": file_count,
+			"operation": operation,
+			"parameters": parameters,
+			"median": statistics.median(durations),
+			"min": min(durations),
+			"runs": durations,
+		})
+		print(f"{file_count:>9} {operation:<30} {json.dumps(parameters):<20} {statistics.median(durations) * 1000:10.2f} ms", file=sys.stderr)
+
+	# Most used tags first: searches with more tags are more selective
+	app.cursor.execute("SELECT t.slug FROM filetag ft JOIN tag t USING(tag_id) GROUP BY ft.tag_id ORDER BY count() DESC;")
+	popular_tags = [row[0] for row in app.cursor.fetchall() if row[0] != DISK_TAG]
+	for tag_count in range(1, MAX_SEARCH_TAGS + 1):
+		durations = measure(lambda run: app.get_all_files_for_tags(popular_tags[:tag_count]), repeat)
+		_add_result("get_all_files_for_tags", durations, tags=tag_count)
+
+	app.cursor.execute("SELECT f.folderpath, ft.filename FROM filetag ft JOIN folder f USING(folder_id) ORDER BY random() LIMIT ?;",
+		(TAGS_FOR_FILE_LOOKUPS,))
+	file_paths = [str(Path(folderpath, filename)) for folderpath, filename in app.cursor.fetchall()]
+	rng.shuffle(file_paths)
+
+	def _get_tags_for_files(run):
+		for file_path in file_paths:
+			app.get_all_tags_for_file(file_path)
+
+	_add_result("get_all_tags_for_file", measure(_get_tags_for_files, repeat), lookups=len(file_paths))
+	_add_result("get_untagged_file_for_folder", measure(lambda run: app.get_untagged_file_for_folder(disk_folder), repeat))
+
+	def _create_tag(run):
+		app.create_new_tag(f"benchmark tag {run}")
+		app.db_connection.commit()
+
+	def _tag_folder(run):
+		app.tag_all_files_from_folder(f"benchmark tag {run}", disk_folder)
+		app.db_connection.commit()
+
+	_add_result("tag_all_files_from_folder", measure(_tag_folder, repeat, setup=_create_tag))
+
+	copy_destination = db_path.parent / "copy_destination"
+
+	def _create_destination(run):
+		shutil.rmtree(copy_destination, ignore_errors=True)
+		copy_destination.mkdir()
+
+	_add_result("copy_tag_files", measure(lambda run: app.copy_tag_files(DISK_TAG, copy_destination), repeat, setup=_create_destination,
+		teardown=lambda run: shutil.rmtree(copy_destination, ignore_errors=True)))
+	app.quit()
+	return results
+
+
+def compare(previous_report, report, threshold) -> int:
+	"""Print the median ratios new/previous, return the count of regressions above `threshold`"""
+	previous_results = {(r["files"], r["operation"], json.dumps(r["parameters"], sort_keys=True)): r for r in previous_report["results"]}
+	regression_count = 0
+	print(f"Compared with {previous_report['metadata'].get('commit')} (ratio = new median / previous median)")
+	for result in report["results"]:
+		previous = previous_results.get((result["files"], result["operation"], json.dumps(result["parameters"], sort_keys=True)))
+		if previous is None:
+			continue
+		ratio = result["median"] / previous["median"] if previous["median"] else float("inf")
+		is_regression = ratio > threshold
+		regression_count += is_regression
+		print(f"{result['files']:>9} {result['operation']:<30} {json.dumps(result['parameters']):<20} {ratio:6.2f}{'  REGRESSION' if is_regression else ''}")
+	return regression_count
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="Library sizes (files)")
+	parser.add_argument("--repeat", type=int, default=5, help="Runs by operation, the median is reported")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--work-folder", type=Path, default=Path(__file__).parent / "work", help="Generated libraries (kept between runs)")
+	parser.add_argument("--output", type=Path, help="JSON report path (default: stdout)")
+	parser.add_argument("--compare", type=Path, help="Previous JSON report to compare with")
+	parser.add_argument("--threshold", type=float, default=1.2, help="Ratio above which a slower operation is a regression")
+	args = parser.parse_args()
+
+	report = {
+		"metadata": {
+			"commit": get_commit(),
+			"date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+			"python": platform.python_version(),
+			"sqlite": sqlite3.sqlite_version,
+			"platform": platform.platform(),
+			"repeat": args.repeat,
+			"seed": args.seed,
+		},
+		"results": [],
+	}
+	for file_count in args.sizes:
+		report["results"] += run_size(args.work_folder.resolve(), file_count, args.repeat, args.seed)
+
+	if args.output is not None:
+		args.output.write_text(json.dumps(report, indent=2))
+	elif args.compare is None:
+		print(json.dumps(report, indent=2))
+	if args.compare is not None:
+		regression_count = compare(json.loads(args.compare.read_text()), report, args.threshold)
+		sys.exit(1 if regression_count else 0)
+
+
+if __name__ == "__main__":
+	main()
@@ -1,40 +1,157 @@
 #!/usr/bin/env python3
+from array import array
+from collections import OrderedDict
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from fnmatch import fnmatch
+from functools import partial, reduce
+from itertools import chain, groupby, islice
+import configparser
+import cProfile
+import csv
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import io
+import json
 import os
+import re
+import select
+import signal
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+import zlib
 from pathlib import Path
 import sqlite3
-from sys import argv
+from sys import argv, byteorder, stderr, stdin, stdout
+import shlex
 import shutil
+import time
 
 DATABASE_PATH = os.environ.get("MTM_DATABASE", "tag_manager.db")
+SOCKET_PATH = os.environ.get("MTM_SOCKET") # Used by `serve` and, when a server runs, by the CLI; `<database>.sock` if unset
+METRICS_PATH = os.environ.get("MTM_METRICS") # NDJSON file receiving the metrics of each command, not collected if unset
+BATCH_SIZE = 5000 # Rows written by `executemany` call for bulk operations
+FINGERPRINT_SAMPLE_SIZE = 65536 # Bytes hashed at the start and at the end of a file for its partial hash
+CACHE_SIZE = 1024 # Entries of each lookup cache of AppCache
+SNAPSHOT_CACHE_SIZE = 4096 # Folder listings kept by the snapshot cache
+SNAPSHOT_RACY_DELAY = 2_000_000_000 # ns, listings of folders changed more recently are not cached (coarse mtime resolution)
+WATCH_DEBOUNCE = 0.5 # Seconds without event before the changes of the watched folders are written
+WATCH_MAX_DELAY = 5 # Seconds, changes are written even if events keep coming
+WATCH_POLL_INTERVAL = 2 # Seconds between two listings of the watched folders, when inotify is not available
 
-APP_HELP = """
-create/delete tag <tag_name> [<collection_name>]
-create/delete collection <collection_name>
-show tags/collection
-set collection <collection_name> tag <tag_name>
-unset collection <collection_name> tag <tag_name>
-show collection <collection_name> tags
-set file <file_path> tag <tag_name>
-unset file <file_path> tag <tag_name>
-show tag <tag_name> files [<folder_path>]
-show file <file_path> tags 
-show folders
-search file with <tag_name> [<tag_name>, ...]
-search file with-id <tag_name> [<tag_name>, ...]
-link folder <folder_path> collection <collection_name> [default-tag <tag_name>]
-show linked-folders
-search untagged-files <folder_path>
-set folder <folder_path> tag <tag_name> [<word_in_name>]
-
-set file <file_path> tag -i  (interactive script mode, <tag_name> is asked after)
-set folder <folder_path> tag -i (interactive script mode, <tag_name> is asked after)
-set folder <folder_path> files tag -i (interactive mode, <tag_name> is asked for each file)
-
-copy tag <tag_name> files <destination_path>
-move tag <tag_name> files <destination_path>
-check tag <tag_name> files contains-word <word>
+APP_OPTIONS_HELP = """Folder scan options (set folder, search untagged-files, relink, watch):
+  --recursive  --max-depth <depth>  --exclude <glob>  --filetype <extension>  --ignore-filetype <extension>
+
+Output option (any command): --format json|ndjson|tsv|paths0
+  (results written to stdout as they are read, messages to stderr; paths0: NUL-terminated file paths for `xargs -0`)
+Profiling (any command): --profile <file_path>  (cProfile statistics of the command, read with `python -m pstats`)
+  MTM_METRICS=<file_path>: one NDJSON line by command with its parse/sql/filesystem/commit/output durations,
+  SQL statements (triggers included), rows read and changed, and slowest statements
 """
 
+APP_FLAG_OPTIONS = ("--recursive", "--atomic", "--continue-on-error", "--merge")
+APP_VALUE_OPTIONS = ("--max-depth", "--exclude", "--filetype", "--ignore-filetype", "--transaction-size", "--workers", "--poll-interval",
+	"--format", "--profile")
+OUTPUT_FORMATS = ("json", "ndjson", "tsv", "paths0") # --format: results streamed to stdout, messages to stderr
+TSV_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"}) # Values of --format tsv keep one row by line
+BATCH_EXCLUDED_COMMANDS = ("batch", "serve", "watch", "vacuum", "copy", "move", "import") # Commands managing their own transactions
+
+
+# SQLITE PROFILES: pragmas set on connection, chosen with MTM_SQLITE_PROFILE or the [sqlite] section
+# of the `<database>.ini` file (`profile = ...` and/or one line by pragma)
+SQLITE_PROFILES = {
+	"performance": { # Readers (GUI) do not block writers (CLI), commits wait for checkpoints only
+		"journal_mode": "WAL",
+		"synchronous": "NORMAL",
+		"mmap_size": 268435456,
+		"cache_size": -65536, # KiB
+		"temp_store": "MEMORY",
+		"busy_timeout": 5000, # ms
+	},
+	"safe": { # SQLite defaults: rollback journal, fsync on each commit
+		"journal_mode": "DELETE",
+		"synchronous": "FULL",
+		"mmap_size": 0,
+		"cache_size": -2000,
+		"temp_store": "DEFAULT",
+		"busy_timeout": 5000,
+	},
+}
+SQLITE_PRAGMA_VALUES = {
+	"journal_mode": ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"),
+	"synchronous": ("OFF", "NORMAL", "FULL", "EXTRA"),
+	"temp_store": ("DEFAULT", "FILE", "MEMORY"),
+	"mmap_size": int,
+	"cache_size": int,
+	"busy_timeout": int,
+}
+
+# Hot queries: always executed with the same SQL text, so the connection re-uses their prepared statement
+QUERIES = {
+	"collection_id": "SELECT collection_id FROM collection WHERE slug = ?;",
+	"tag_id": "SELECT tag_id FROM tag WHERE slug = ?;",
+	"insert_tag": "INSERT OR IGNORE INTO tag(slug, tag_name) VALUES(?, ?);",
+	"insert_folder": "INSERT OR IGNORE INTO folder(folderpath) VALUES(?);",
+	"folder_id": "SELECT folder_id FROM folder WHERE folderpath = ?;",
+	"insert_filetag": "INSERT INTO filetag(folder_id, filename, tag_id) VALUES(?, ?, ?) ON CONFLICT DO NOTHING;",
+	"delete_filetag": """DELETE FROM filetag WHERE tag_id = (SELECT tag_id FROM tag WHERE slug = ?)
+		AND folder_id = (SELECT folder_id FROM folder WHERE folderpath = ?) AND filename = ?;""",
+	"files_for_tag": """SELECT f.folderpath, ft.filename FROM filetag ft JOIN folder f USING(folder_id)
+		WHERE ft.tag_id = (SELECT tag_id FROM tag WHERE slug = ?);""",
+	"files_for_tag_in_folder": """SELECT f.folderpath, ft.filename FROM filetag ft JOIN folder f USING(folder_id)
+		WHERE ft.tag_id = (SELECT tag_id FROM tag WHERE slug = ?) AND f.folderpath = ?;""",
+	"tags_for_file": """SELECT t.slug FROM filetag ft JOIN tag t USING(tag_id)
+		WHERE ft.folder_id = (SELECT folder_id FROM folder WHERE folderpath = ?) AND ft.filename = ?;""",
+	"folder_filenames": "SELECT filename FROM filetag WHERE folder_id = (SELECT folder_id FROM folder WHERE folderpath = ?);",
+	"filetag_generation": "SELECT value FROM mtm_meta WHERE key = 'filetag_generation';",
+	"index_meta": "SELECT key, value FROM mtm_meta WHERE key IN ('database_uid', 'filetag_generation');",
+}
+# Folder paths are materialized paths: the sub-folders of a folder are one range scan of the folderpath index,
+# CROSS JOIN keeps this scan as outer loop (files are then indexed lookups by folder)
+SUBTREE_CONDITION = "(f.folderpath = ? OR (f.folderpath >= ? AND f.folderpath < ?))"
+QUERIES.update({
+	"files_for_tag_under": f"""SELECT f.folderpath, ft.filename FROM folder f CROSS JOIN filetag ft ON ft.folder_id = f.folder_id
+		WHERE ft.tag_id = (SELECT tag_id FROM tag WHERE slug = ?) AND {SUBTREE_CONDITION} ORDER BY f.folderpath, ft.filename;""",
+	"tag_counts_under": f"""SELECT t.slug, count() FROM folder f JOIN filetag ft ON ft.folder_id = f.folder_id JOIN tag t USING(tag_id)
+		WHERE {SUBTREE_CONDITION} GROUP BY t.tag_id ORDER BY t.slug;""",
+	"tagged_folders_under": f"""SELECT folderpath FROM folder f WHERE {SUBTREE_CONDITION}
+		AND EXISTS (SELECT 1 FROM taggedfile tf WHERE tf.folder_id = f.folder_id) ORDER BY folderpath;""",
+})
+STATEMENT_CACHE_SIZE = 256 # Hot queries plus the variable ones (searches) without evicting each other
+
+
+def get_socket_path(database_path=DATABASE_PATH):
+	return SOCKET_PATH or f"{database_path}.sock"
+
+
+def load_sqlite_profile(database_path=DATABASE_PATH) -> dict:
+	"""Return the pragmas of the configured profile, overridden by the pragmas of the config file"""
+	config = configparser.ConfigParser()
+	config.read(Path(database_path).with_suffix(".ini"))
+	section = config["sqlite"] if config.has_section("sqlite") else {}
+	profile_name = os.environ.get("MTM_SQLITE_PROFILE", section.get("profile", "performance"))
+	if profile_name not in SQLITE_PROFILES:
+		raise ValueError(f"Unknown SQLite profile {profile_name}, use one of: {', '.join(SQLITE_PROFILES)}")
+
+	pragmas = dict(SQLITE_PROFILES[profile_name])
+	for pragma, allowed_values in SQLITE_PRAGMA_VALUES.items():
+		if pragma not in section:
+			continue
+		value = section[pragma].strip()
+		if allowed_values is int:
+			pragmas[pragma] = int(value)
+		elif value.upper() in allowed_values:
+			pragmas[pragma] = value.upper()
+		else:
+			raise ValueError(f"Invalid value {value} for {pragma}, use one of: {', '.join(allowed_values)}")
+	return pragmas
+
 
 def create_id_from_label(item_name):
 	"""Return the lower-case spaceless string of `item_name`"""
@@ -42,101 +159,1198 @@ def create_id_from_label(item_name):
 	return result.replace(" ", "_")
 
 
+def iter_batches(iterable, size):
+	"""Yield lists of `size` items (the last one can be shorter) read lazily from `iterable`"""
+	iterator = iter(iterable)
+	while batch := list(islice(iterator, size)):
+		yield batch
+
+
+def normalize_folder_path(folder_path):
+	"""Return `folder_path` as stored in database: no trailing or duplicated separator"""
+	return str(Path(folder_path))
+
+
+def iter_nul_separated(binary_file, chunk_size=65536):
+	"""Yield the NUL-separated paths of `binary_file` (as written by `find -print0`), read by chunks"""
+	rest = b""
+	while chunk := binary_file.read(chunk_size):
+		*paths, rest = (rest + chunk).split(b"\0")
+		yield from (os.fsdecode(path) for path in paths if path)
+	if rest.strip(b"\n"):
+		yield os.fsdecode(rest.strip(b"\n"))
+
+
+def get_subtree_bounds(folder_path) -> (str, str, str):
+	"""Return (folderpath, first, end) of a folder tree: its sub-folders sort in [first, end) (see SUBTREE_CONDITION)"""
+	folderpath = normalize_folder_path(folder_path)
+	subtree_start = folderpath if folderpath.endswith("/") else folderpath + "/"
+	return folderpath, subtree_start, subtree_start[:-1] + "0" # "0" is the character after "/"
+
+
+# SEARCH EXPRESSION: `holidays AND ( brussels OR paris ) AND NOT vo` is parsed into nested tuples
+# ("AND", (("TAG", "holidays"), ("OR", (("TAG", "brussels"), ("TAG", "paris"))), ("NOT", ("TAG", "vo"))))
+QUERY_OPERATORS = ("AND", "OR", "NOT", "(", ")")
+
+
+def parse_tag_query(words, is_id=False, is_tag=None):
+	"""Parse search words into an expression tree, operators are upper-case, AND is implicit between tags
+
+	Each word is one token: a word is an operator or a parenthesis only when it is exactly one, so tag
+	names can hold spaces and parentheses (`"my tag"`, `"a(b)"`). Such a word is a syntax error when
+	`is_tag(tag_id)` is false: `"holidays AND (brussels OR paris)"` quoted as one word is not a tag.
+	"""
+	tokens = [word for word in words if word.strip()]
+	position = 0
+
+	def _peek():
+		return tokens[position] if position < len(tokens) else None
+
+	def _take():
+		nonlocal position
+		position += 1
+		return tokens[position - 1]
+
+	def _combine(operator, children):
+		flat_children = []
+		for child in children:
+			flat_children.extend(child[1] if child[0] == operator else (child,))
+		return flat_children[0] if len(flat_children) == 1 else (operator, tuple(flat_children))
+
+	def _parse_or():
+		children = [_parse_and()]
+		while _peek() == "OR":
+			_take()
+			children.append(_parse_and())
+		return _combine("OR", children)
+
+	def _parse_and():
+		children = [_parse_not()]
+		while _peek() is not None and _peek() not in ("OR", ")"):
+			if _peek() == "AND":
+				_take()
+			children.append(_parse_not())
+		return _combine("AND", children)
+
+	def _parse_not():
+		token = _peek()
+		if token is None or token in ("AND", "OR", ")"):
+			raise ValueError(f"Invalid search expression, tag expected at: {' '.join(tokens[position:]) or 'end'}")
+		_take()
+		if token == "NOT":
+			return ("NOT", _parse_not())
+		if token == "(":
+			node = _parse_or()
+			if _peek() != ")":
+				raise ValueError("Invalid search expression, missing `)`")
+			_take()
+			return node
+		tag_id = token if is_id else create_id_from_label(token)
+		if is_tag is not None and re.search(r"[\s()]", token) and not is_tag(tag_id):
+			raise ValueError(f"Invalid search expression, no tag `{token}`: operators and parentheses must be separate words")
+		return ("TAG", tag_id)
+
+	expression = _parse_or()
+	if position < len(tokens):
+		raise ValueError(f"Invalid search expression, unexpected `{tokens[position]}`")
+	return expression
+
+
+def parse_name_pattern(pattern) -> (str, str):
+	"""Return (FTS phrase or None, LIKE pattern) matching filenames with `pattern`, case-insensitive
+
+	`*` and `?` are wildcards matching the whole name, a pattern without wildcard matches any part of
+	the name. The trigram index can only look up plain strings of 3 characters or more.
+	"""
+	like_pattern = re.sub(r"([%_\\])", r"\\\1", pattern).replace("*", "%").replace("?", "_")
+	if "*" in pattern or "?" in pattern:
+		return None, like_pattern
+	phrase = '"' + pattern.replace('"', '""') + '"' if len(pattern) >= 3 else None
+	return phrase, f"%{like_pattern}%"
+
+
+def get_query_tags(expression):
+	"""Return the set of tag ids used by a parsed search expression"""
+	if expression[0] == "TAG":
+		return {expression[1]}
+	if expression[0] == "NOT":
+		return get_query_tags(expression[1])
+	return set().union(*[get_query_tags(child) for child in expression[1]])
+
+
+# METRICS: timers and SQL counters of a command, enabled by MTM_METRICS (NDJSON file appended by command)
+class CommandMetrics:
+	"""Durations by phase (parse, sql, filesystem, commit, output) and SQL counters of one command"""
+	PHASES = ("parse", "sql", "filesystem", "commit", "output")
+	TOP_STATEMENTS = 5 # Slowest statements written in the record
+
+	def __init__(self, command):
+		self.command = command
+		self.start_time = time.perf_counter()
+		self.durations = dict.fromkeys(self.PHASES, 0.0)
+		self.statement_count, self.rows_read = 0, 0
+		self.statements = {} # SQL text: [executions, seconds]
+		self.lock = threading.Lock() # Filesystem work can run in worker threads
+
+	@contextmanager
+	def phase(self, phase_name):
+		start_time = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add_duration(phase_name, time.perf_counter() - start_time)
+
+	def add_duration(self, phase_name, duration):
+		with self.lock:
+			self.durations[phase_name] += duration
+
+	def add_query(self, sql, duration, fetched_rows=None):
+		"""Count an execution of `sql`, or a fetch of its rows if `fetched_rows` is set"""
+		self.add_duration("sql", duration)
+		statement = self.statements.setdefault(sql, [0, 0.0])
+		if fetched_rows is None:
+			statement[0] += 1
+		else:
+			self.rows_read += fetched_rows
+		statement[1] += duration
+
+	def on_statement(self, sql):
+		"""SQLite trace callback: called for each statement run, trigger statements included"""
+		self.statement_count += 1
+
+	def get_record(self, changed_rows, error=None) -> dict:
+		duration = time.perf_counter() - self.start_time
+		slowest = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:self.TOP_STATEMENTS]
+		return {
+			"time": round(time.time(), 3),
+			"command": self.command,
+			"duration": round(duration, 6),
+			"phases": {name: round(value, 6) for name, value in self.durations.items()},
+			"other": round(max(0.0, duration - sum(self.durations.values())), 6),
+			"statements": self.statement_count,
+			"rows_read": self.rows_read,
+			"rows_changed": changed_rows,
+			"slowest_statements": [{"sql": " ".join(sql.split()), "executions": count, "seconds": round(seconds, 6)} for sql, (count, seconds) in slowest],
+			"error": error,
+		}
+
+
+class MetricsCursor(sqlite3.Cursor):
+	"""Cursor timing its statements and counting fetched rows when its connection collects metrics"""
+	sql = "" # Statement of the last execute, fetch durations are added to it
+
+	def execute(self, sql, parameters=()):
+		self.sql = sql
+		return self._timed(super().execute, sql, parameters)
+
+	def executemany(self, sql, seq_of_parameters):
+		self.sql = sql
+		return self._timed(super().executemany, sql, seq_of_parameters)
+
+	def fetchone(self):
+		return self._timed(super().fetchone, count_rows=lambda row: row is not None)
+
+	def fetchmany(self, size=None):
+		return self._timed(super().fetchmany, self.arraysize if size is None else size, count_rows=len)
+
+	def fetchall(self):
+		return self._timed(super().fetchall, count_rows=len)
+
+	def __next__(self): # `for row in cursor`, used by the streamed results
+		return self._timed(super().__next__, count_rows=lambda row: 1)
+
+	def _timed(self, function, *args, count_rows=None):
+		metrics = self.connection.metrics
+		if metrics is None:
+			return function(*args)
+		start_time = time.perf_counter()
+		result = function(*args)
+		metrics.add_query(self.sql, time.perf_counter() - start_time, None if count_rows is None else count_rows(result))
+		return result
+
+
+class MetricsConnection(sqlite3.Connection):
+	metrics = None # CommandMetrics of the running command, if collected
+
+	def cursor(self, factory=MetricsCursor):
+		return super().cursor(factory)
+
+
 class FilesystemReader:
-	def __init__(self, ignored_filetypes=None):
+	def __init__(self, ignored_filetypes=None, max_workers=None, snapshot_cache_size=0):
 		self.ignored_filetypes = ignored_filetypes
+		self.max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4) # Scan is I/O bound
+		# Optional listings cache: {folder path: (mtime, entries)}, a folder is listed again only when its mtime changes
+		self.snapshot_cache_size = snapshot_cache_size
+		self.snapshots = OrderedDict()
+		self.snapshots_lock = threading.Lock()
+		self.snapshot_hits, self.snapshot_misses = 0, 0
+		self.metrics = None # CommandMetrics receiving the time spent in filesystem calls
 
-	def get_files(self, path, filetypes=None, ignored=None, search_word=None) -> dict:
+	def _timed(self, function, *args):
+		if self.metrics is None:
+			return function(*args)
+		with self.metrics.phase("filesystem"):
+			return function(*args)
+
+	def get_files(self, path, filetypes=None, ignored=None, search_word=None, **scan_options) -> dict:
 		result = {}
-		folderpath = Path(path)
-
-		search_words = []
-		if search_word is not None:
-			search_words = set([search_word, search_word.upper(), search_word.lower(), search_word.title()])
-
-		for item in folderpath.glob("*"):
-			if not item.name.startswith("."): # Skip hidden folders
-				if len(search_words) > 0:
-					for search in search_words:
-						if search in item.name:
-							result[str(item.absolute())] = (item.name, not item.is_file())
-							break
-				else:
-					result[str(item.absolute())] = (item.name, not item.is_file())
+
+		search_word = search_word.casefold() if search_word is not None else None
+		for folderpath, name, is_folder in self.scan(path, filetypes=filetypes, ignored=ignored, **scan_options):
+			if search_word is None or search_word in name.casefold():
+				result[os.path.abspath(os.path.join(folderpath, name))] = (name, is_folder)
 
 		return result
 
+	def scan(self, path, filetypes=None, ignored=None, recursive=False, max_depth=None, exclude=None):
+		"""Yield (folderpath, name, is_folder) for entries of `path`, hidden entries are skipped
+
+		Type information comes from `os.scandir` entries (no extra stat). In recursive mode, sub-folders
+		(up to `max_depth` levels, symlinks are not followed) are read in a thread pool and entries are
+		yielded as soon as a folder is read. `filetypes`/`ignored` are file extensions, `exclude` are glob
+		patterns matched against the name and the path relative to `path`.
+		"""
+		root = normalize_folder_path(path)
+		scan_filter = self.get_scan_filter(root, filetypes, ignored, recursive, max_depth, exclude)
+		entries, subfolders = self._scan_folder(root, 0, scan_filter)
+		yield from entries
+		if not subfolders:
+			return
+
+		executor = ThreadPoolExecutor(max_workers=self.max_workers)
+		try:
+			pending = {executor.submit(self._scan_folder, folderpath, depth, scan_filter) for folderpath, depth in subfolders}
+			while pending:
+				done, pending = wait(pending, return_when=FIRST_COMPLETED)
+				for future in done:
+					entries, subfolders = future.result()
+					yield from entries
+					pending.update(executor.submit(self._scan_folder, folderpath, depth, scan_filter) for folderpath, depth in subfolders)
+		finally:
+			executor.shutdown(wait=False, cancel_futures=True)
+
+	def get_scan_filter(self, root, filetypes=None, ignored=None, recursive=False, max_depth=None, exclude=None) -> dict:
+		return {
+			"root": root,
+			"filetypes": None if not filetypes else {t.lower().lstrip(".") for t in filetypes},
+			"ignored": {t.lower().lstrip(".") for t in (ignored or []) + (self.ignored_filetypes or [])},
+			"exclude": exclude or [],
+			"recursive": recursive,
+			"max_depth": max_depth,
+		}
+
+	def is_entry_scanned(self, folderpath, name, is_folder, scan_filter) -> bool:
+		"""Return True if the entry passes the filters of the scan: not hidden, not excluded, expected file type"""
+		if name.startswith("."): # Skip hidden files and folders
+			return False
+		if scan_filter["exclude"]:
+			relative_path = os.path.relpath(os.path.join(folderpath, name), scan_filter["root"])
+			if any(fnmatch(name, p) or fnmatch(relative_path, p) for p in scan_filter["exclude"]):
+				return False
+		if is_folder or (not scan_filter["ignored"] and scan_filter["filetypes"] is None):
+			return True
+		extension = os.path.splitext(name)[1][1:].lower()
+		return extension not in scan_filter["ignored"] and (scan_filter["filetypes"] is None or extension in scan_filter["filetypes"])
+
+	def list_folder(self, folderpath) -> [(str, bool, bool)]:
+		"""Return (name, is_folder, is_real_folder) of the entries of `folderpath`, symlinks to folders are not real folders"""
+		return self._timed(self._read_folder, folderpath)
+
+	def _read_folder(self, folderpath):
+		if not self.snapshot_cache_size:
+			with os.scandir(folderpath) as folder_entries:
+				return [(entry.name, not entry.is_file(), entry.is_dir(follow_symlinks=False)) for entry in folder_entries]
+
+		mtime_ns = os.stat(folderpath).st_mtime_ns # Changes when an entry is added, removed or renamed
+		with self.snapshots_lock:
+			snapshot = self.snapshots.get(folderpath)
+			if snapshot is not None and snapshot[0] == mtime_ns:
+				self.snapshots.move_to_end(folderpath)
+				self.snapshot_hits += 1
+				return snapshot[1]
+			self.snapshot_misses += 1
+		with os.scandir(folderpath) as folder_entries:
+			entries = [(entry.name, not entry.is_file(), entry.is_dir(follow_symlinks=False)) for entry in folder_entries]
+		if time.time_ns() - mtime_ns > SNAPSHOT_RACY_DELAY: # Else a change in the same mtime tick could be missed
+			with self.snapshots_lock:
+				self.snapshots[folderpath] = (mtime_ns, entries)
+				self.snapshots.move_to_end(folderpath)
+				if len(self.snapshots) > self.snapshot_cache_size:
+					self.snapshots.popitem(last=False)
+		return entries
+
+	def _scan_folder(self, folderpath, depth, scan_filter):
+		entries, subfolders = [], []
+		try:
+			for name, is_folder, is_real_folder in self.list_folder(folderpath):
+				if not self.is_entry_scanned(folderpath, name, is_folder, scan_filter):
+					continue
+				if is_folder:
+					max_depth = scan_filter["max_depth"]
+					if scan_filter["recursive"] and (max_depth is None or depth < max_depth) and is_real_folder:
+						subfolders.append((os.path.join(folderpath, name), depth + 1))
+				entries.append((folderpath, name, is_folder))
+		except OSError:
+			pass # Unreadable or removed folder: nothing to list
+		return entries, subfolders
+
 	def copy_files(self, file_paths:[Path], destination:Path):
-		for current_path in file_paths:
-			shutil.copy(current_path, destination)
+		for _, error in self.transfer_files(file_paths, destination):
+			if error is not None:
+				raise error
 
 	def move_files(self, file_paths:[Path], destination:Path):
-		for current_path in file_paths:
-			shutil.move(current_path, destination)
+		for _, error in self.transfer_files(file_paths, destination, move=True):
+			if error is not None:
+				raise error
 
+	def transfer_files(self, file_paths:[Path], destination:Path, move=False, workers=None):
+		"""Copy/move files into `destination` in a worker pool, yield (source path, error or None) when done"""
+		executor = ThreadPoolExecutor(max_workers=workers or get_storage_workers(destination))
+		try:
+			futures = {executor.submit(self._timed, self.transfer_file, path, destination, move): path for path in file_paths}
+			for future in as_completed(futures):
+				yield futures[future], future.exception()
+		finally: # Stopped early (error, cancellation): files not started yet are not transferred
+			executor.shutdown(wait=True, cancel_futures=True)
+
+	def transfer_file(self, source_path, destination, move=False):
+		"""Copy/move `source_path` into the `destination` folder
+
+		A move inside one filesystem is a rename. Copies are written to a temporary name then
+		renamed, so an interrupted copy never leaves a truncated file under the final name.
+		"""
+		source_path = str(source_path)
+		target_path = os.path.join(destination, os.path.basename(source_path))
+		if move:
+			try:
+				self._rename_no_replace(source_path, target_path)
+				return
+			except OSError as e:
+				if e.errno != errno.EXDEV: # Not the same filesystem: copy then delete
+					raise
+
+		if os.path.isdir(source_path):
+			shutil.copytree(source_path, target_path, dirs_exist_ok=True)
+			if move:
+				shutil.rmtree(source_path)
+			return
+		partial_fd, partial_path = tempfile.mkstemp(prefix=f".{os.path.basename(source_path)}.", suffix=".mtm-part", dir=destination)
+		os.close(partial_fd) # Unique name: workers never write the same temporary file
+		try:
+			self._copy_file_content(source_path, partial_path, destination)
+			shutil.copymode(source_path, partial_path)
+			if move:
+				self._rename_no_replace(partial_path, target_path)
+			else:
+				os.replace(partial_path, target_path)
+		except BaseException:
+			Path(partial_path).unlink(missing_ok=True)
+			raise
+		if move:
+			os.unlink(source_path)
+
+	def _rename_no_replace(self, source_path, target_path):
+		"""Rename, raise FileExistsError if `target_path` exists: a hard link fails on an existing path, unlike a rename"""
+		try:
+			os.link(source_path, target_path, follow_symlinks=False)
+		except OSError as e:
+			if e.errno not in (errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EMLINK): # Folders, filesystems without hard links
+				raise
+			if os.path.lexists(target_path):
+				raise FileExistsError(errno.EEXIST, "Destination path already exists", target_path) from None
+			os.rename(source_path, target_path)
+			return
+		os.unlink(source_path)
+
+	def _copy_file_content(self, source_path, target_path, destination):
+		"""Copy in kernel space: copy_file_range on the same device (can share blocks), else sendfile"""
+		with open(source_path, "rb") as source_file, open(target_path, "wb") as target_file:
+			source_fd, target_fd = source_file.fileno(), target_file.fileno()
+			size = os.fstat(source_fd).st_size
+			copied_size = 0
+			try:
+				same_device = os.fstat(source_fd).st_dev == os.stat(destination).st_dev
+				if same_device and hasattr(os, "copy_file_range"):
+					while copied_size < size:
+						chunk_size = os.copy_file_range(source_fd, target_fd, size - copied_size)
+						if chunk_size == 0:
+							break
+						copied_size += chunk_size
+				elif hasattr(os, "sendfile"):
+					while copied_size < size:
+						chunk_size = os.sendfile(target_fd, source_fd, copied_size, size - copied_size)
+						if chunk_size == 0:
+							break
+						copied_size += chunk_size
+			except OSError as e:
+				if copied_size > 0 or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP):
+					raise
+			if copied_size < size: # Not supported, or file growing while copied
+				source_file.seek(copied_size)
+				target_file.seek(copied_size)
+				shutil.copyfileobj(source_file, target_file)
+
+
+def get_storage_workers(path) -> int:
+	"""Return a count of parallel transfers fitting the storage of `path`: few on spinning disks"""
+	try:
+		device = os.stat(path).st_dev
+		block_device = Path(f"/sys/dev/block/{os.major(device)}:{os.minor(device)}")
+		rotational_path = block_device / "queue" / "rotational"
+		if not rotational_path.exists(): # Partition: the queue belongs to its disk
+			rotational_path = block_device / ".." / "queue" / "rotational"
+		return 2 if rotational_path.read_text().strip() == "1" else 8
+	except (OSError, ValueError):
+		return 4
+
+
+def compute_fingerprint(file_path, full=False):
+	"""Return (size, mtime_ns, partial hash, full hash) of a file, None if it can not be read
+
+	The partial hash covers the size, the first and the last bytes of the file. The full hash is only
+	computed if `full` is set, or if the partial hash already read the whole file.
+	"""
+	try:
+		with open(file_path, "rb") as file:
+			stat = os.fstat(file.fileno())
+			partial_hash = hashlib.blake2b(str(stat.st_size).encode(), digest_size=16)
+			partial_hash.update(file.read(FINGERPRINT_SAMPLE_SIZE))
+			if stat.st_size <= 2 * FINGERPRINT_SAMPLE_SIZE:
+				partial_hash.update(file.read())
+				return stat.st_size, stat.st_mtime_ns, partial_hash.digest(), partial_hash.digest()
+			file.seek(-FINGERPRINT_SAMPLE_SIZE, os.SEEK_END)
+			partial_hash.update(file.read())
+			if not full:
+				return stat.st_size, stat.st_mtime_ns, partial_hash.digest(), None
+			file.seek(0)
+			return stat.st_size, stat.st_mtime_ns, partial_hash.digest(), hashlib.file_digest(file, lambda: hashlib.blake2b(digest_size=16)).digest()
+	except OSError:
+		return None
+
+
+# EXPORT FORMATS: the database is exported as a stream of records (dicts), in order: collections, tags, folders,
+# linked folders then files with their tags. Records reference each other by the ids of the exported database.
+EXPORT_FIELDS = ("type", "id", "slug", "name", "path", "collection_id", "default_tag_id", "folder_id", "filename", "tag_ids", "version")
+EXPORT_INT_FIELDS = ("id", "collection_id", "default_tag_id", "folder_id", "version")
+EXPORT_VERSION = 1
+BINARY_EXPORT_MAGIC = b"MTMB\x01"
+BINARY_FRAME = struct.Struct("<cI") # kind (C: JSON catalog records, F: files), compressed payload size
+BINARY_FILES_HEADER = struct.Struct("<II") # file count, tag count
+
+
+def get_export_format(file_path) -> str:
+	suffix = Path(file_path).suffix.lower()
+	return {".csv": "csv", ".mtmb": "binary"}.get(suffix, "ndjson")
+
+
+def write_export_records(records, export_file, export_format):
+	"""Write `records` to the binary file `export_file` as NDJSON, CSV or the binary format"""
+	if export_format == "binary":
+		_write_binary_records(records, export_file)
+		return
+	text_file = io.TextIOWrapper(export_file, encoding="utf-8", newline="")
+	if export_format == "csv":
+		writer = csv.DictWriter(text_file, EXPORT_FIELDS)
+		writer.writeheader()
+		for record in records:
+			if "tag_ids" in record:
+				record = dict(record, tag_ids=" ".join(map(str, record["tag_ids"])))
+			writer.writerow(record)
+	else:
+		for record in records:
+			text_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+	text_file.flush()
+	text_file.detach()
+
+
+def _write_binary_records(records, export_file):
+	"""Catalog records are written as JSON frames, files by frames of columns (folder ids, tag counts, tag ids, names)"""
+	def _write_frame(kind, data):
+		payload = zlib.compress(data)
+		export_file.write(BINARY_FRAME.pack(kind, len(payload)) + payload)
+
+	export_file.write(BINARY_EXPORT_MAGIC)
+	for is_file, group in groupby(records, key=lambda record: record["type"] == "file"):
+		for chunk in iter_batches(group, BATCH_SIZE * 10):
+			if not is_file:
+				_write_frame(b"C", json.dumps(chunk, ensure_ascii=False).encode())
+				continue
+			columns = [array("i", (r["folder_id"] for r in chunk)), array("I", (len(r["tag_ids"]) for r in chunk)),
+				array("i", (tag_id for r in chunk for tag_id in r["tag_ids"]))]
+			if byteorder == "big":
+				for column in columns:
+					column.byteswap()
+			names = "\0".join(r["filename"] for r in chunk).encode()
+			_write_frame(b"F", BINARY_FILES_HEADER.pack(len(chunk), len(columns[2])) + b"".join(c.tobytes() for c in columns) + names)
 
-class App:
+
+def read_export_records(import_file):
+	"""Yield the records of the binary file `import_file`, the format is detected from its first bytes"""
+	head = import_file.peek(len(BINARY_EXPORT_MAGIC))[:len(BINARY_EXPORT_MAGIC)]
+	if head == BINARY_EXPORT_MAGIC:
+		yield from _read_binary_records(import_file)
+		return
+	text_file = io.TextIOWrapper(import_file, encoding="utf-8", newline="")
+	if head.startswith(b"type,"):
+		for row in csv.DictReader(text_file):
+			record = {field: value for field, value in row.items() if value != ""}
+			for field in EXPORT_INT_FIELDS:
+				if field in record:
+					record[field] = int(record[field])
+			if record["type"] == "file":
+				record["tag_ids"] = [int(tag_id) for tag_id in row["tag_ids"].split()]
+			yield record
+	else:
+		for line in text_file:
+			if line.strip():
+				yield json.loads(line)
+
+
+def _read_binary_records(import_file):
+	import_file.read(len(BINARY_EXPORT_MAGIC))
+	while frame_header := import_file.read(BINARY_FRAME.size):
+		kind, size = BINARY_FRAME.unpack(frame_header)
+		data = zlib.decompress(import_file.read(size))
+		if kind == b"C":
+			yield from json.loads(data)
+			continue
+		file_count, tag_count = BINARY_FILES_HEADER.unpack_from(data)
+		columns, position = [], BINARY_FILES_HEADER.size
+		for typecode, count in (("i", file_count), ("I", file_count), ("i", tag_count)):
+			column = array(typecode)
+			column.frombytes(data[position:position + count * column.itemsize])
+			if byteorder == "big":
+				column.byteswap()
+			columns.append(column)
+			position += count * column.itemsize
+		folder_ids, tag_counts, tag_ids = columns
+		names = data[position:].decode().split("\0")
+		tag_position = 0
+		for folder_id, tag_count, filename in zip(folder_ids, tag_counts, names):
+			yield {"type": "file", "folder_id": folder_id, "filename": filename, "tag_ids": list(tag_ids[tag_position:tag_position + tag_count])}
+			tag_position += tag_count
+
+
+# WATCH: folder events are (kind, path, is_folder, extra) with kind: created, deleted, moved (extra is the new
+# path), moved_from/moved_to (extra is the inotify cookie pairing both halves of a move) or overflow (events lost)
+class InotifyWatcher:
+	"""Events of watched folders from Linux inotify (through ctypes)"""
+	IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+	IN_Q_OVERFLOW, IN_IGNORED, IN_ONLYDIR, IN_DONT_FOLLOW, IN_ISDIR = 0x4000, 0x8000, 0x1000000, 0x2000000, 0x40000000
+	EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, name size
 
 	def __init__(self):
+		self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+		self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify is not available")
+		self.folders = {} # watch descriptor: folder path
+
+	def add_folder(self, folder_path):
+		mask = self.IN_CREATE | self.IN_DELETE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_ONLYDIR | self.IN_DONT_FOLLOW
+		wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder_path), mask)
+		if wd < 0:
+			raise OSError(ctypes.get_errno(), f"Can not watch {folder_path}")
+		self.folders[wd] = folder_path
+
+	def rename_folder(self, folder_path, new_folder_path):
+		"""Follow a moved folder: watches stay on the folder, only their paths change"""
+		for wd, watched_path in self.folders.items():
+			if watched_path == folder_path or watched_path.startswith(folder_path + os.sep):
+				self.folders[wd] = new_folder_path + watched_path[len(folder_path):]
+
+	def remove_folder(self, folder_path):
+		for wd, watched_path in list(self.folders.items()):
+			if watched_path == folder_path or watched_path.startswith(folder_path + os.sep):
+				self.libc.inotify_rm_watch(self.fd, wd)
+				del self.folders[wd]
+
+	def read_events(self, timeout=None) -> list:
+		"""Return the events received before `timeout` seconds (wait for events if None)"""
+		if not select.select([self.fd], [], [], timeout)[0]:
+			return []
+		try:
+			buffer = os.read(self.fd, 65536)
+		except BlockingIOError:
+			return []
+		events, offset = [], 0
+		while offset < len(buffer):
+			wd, mask, cookie, name_size = self.EVENT_HEADER.unpack_from(buffer, offset)
+			name = os.fsdecode(buffer[offset + self.EVENT_HEADER.size:offset + self.EVENT_HEADER.size + name_size].rstrip(b"\0"))
+			offset += self.EVENT_HEADER.size + name_size
+			if mask & self.IN_Q_OVERFLOW:
+				events.append(("overflow", None, False, None))
+			elif mask & self.IN_IGNORED: # Watched folder deleted or unmounted
+				self.folders.pop(wd, None)
+			elif wd in self.folders and name:
+				kind = next(kind for flag, kind in ((self.IN_CREATE, "created"), (self.IN_DELETE, "deleted"),
+					(self.IN_MOVED_FROM, "moved_from"), (self.IN_MOVED_TO, "moved_to")) if mask & flag)
+				events.append((kind, os.path.join(self.folders[wd], name), bool(mask & self.IN_ISDIR), cookie))
+		return events
+
+	def close(self):
+		os.close(self.fd)
+
+
+class PollingWatcher:
+	"""Events of watched folders found by comparing their listings, moves are recognized by inode"""
+	def __init__(self, interval=WATCH_POLL_INTERVAL):
+		self.interval = interval
+		self.folders = {} # folder path: {name: (inode, is_folder)}
+
+	def _list_folder(self, folder_path):
+		try:
+			with os.scandir(folder_path) as entries:
+				return {entry.name: (entry.inode(), entry.is_dir(follow_symlinks=False)) for entry in entries}
+		except OSError:
+			return {}
+
+	def add_folder(self, folder_path):
+		self.folders[folder_path] = self._list_folder(folder_path)
+
+	def rename_folder(self, folder_path, new_folder_path):
+		for watched_path in list(self.folders):
+			if watched_path == folder_path or watched_path.startswith(folder_path + os.sep):
+				self.folders[new_folder_path + watched_path[len(folder_path):]] = self.folders.pop(watched_path)
+
+	def remove_folder(self, folder_path):
+		for watched_path in list(self.folders):
+			if watched_path == folder_path or watched_path.startswith(folder_path + os.sep):
+				del self.folders[watched_path]
+
+	def read_events(self, timeout=None) -> list:
+		time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+		created, deleted = {}, {}
+		for folder_path, entries in list(self.folders.items()):
+			if not os.path.isdir(folder_path): # Moved or deleted: reported by the listing of its parent
+				continue
+			current_entries = self.folders[folder_path] = self._list_folder(folder_path)
+			for name, (inode, is_folder) in current_entries.items():
+				if entries.get(name) != (inode, is_folder):
+					created[inode] = (os.path.join(folder_path, name), is_folder)
+			for name, (inode, is_folder) in entries.items():
+				if current_entries.get(name) != (inode, is_folder):
+					deleted[inode] = (os.path.join(folder_path, name), is_folder)
+		events = []
+		for inode, (path, is_folder) in deleted.items():
+			if inode in created:
+				events.append(("moved", path, is_folder, created.pop(inode)[0]))
+			else:
+				events.append(("deleted", path, is_folder, None))
+		return events + [("created", path, is_folder, None) for path, is_folder in created.values()]
+
+	def close(self):
+		pass
+
+
+def pair_moved_events(events):
+	"""Replace the moved_from/moved_to halves of a move by one moved event, unpaired halves are deletes/creates"""
+	moved_to_paths = {cookie: path for kind, path, _, cookie in events if kind == "moved_to"}
+	moved_from_cookies = {cookie for kind, _, _, cookie in events if kind == "moved_from"}
+	for kind, path, is_folder, extra in events:
+		if kind == "moved_from":
+			yield ("moved", path, is_folder, moved_to_paths[extra]) if extra in moved_to_paths else ("deleted", path, is_folder, None)
+		elif kind == "moved_to":
+			if extra not in moved_from_cookies: # Moved from a folder not watched
+				yield ("created", path, is_folder, None)
+		else:
+			yield kind, path, is_folder, extra
+
+
+# CACHE: results of the frequent lookups, for long-running processes (GUI, server)
+class AppCache:
+	"""Bounded LRU caches of lookup results: catalog (collections, tags, tagged folders), tag -> files and file -> tags
+
+	App write methods invalidate what they change. Commits of other connections (e.g. the CLI while the GUI
+	runs) are detected with `PRAGMA data_version`, which only changes for them, and clear all caches.
+	"""
+	CACHE_NAMES = ("catalog", "files_by_tag", "tags_by_file")
+
+	def __init__(self, db_connection, max_size=CACHE_SIZE):
+		self.cursor = db_connection.cursor()
+		self.max_size = max_size
+		self.data_version = None
+		self.caches = {name: OrderedDict() for name in self.CACHE_NAMES}
+		self.hits = dict.fromkeys(self.CACHE_NAMES, 0)
+		self.misses = dict.fromkeys(self.CACHE_NAMES, 0)
+
+	def get(self, cache_name, key, load):
+		"""Return the cached value of `key`, loaded with `load()` if not cached"""
+		self.cursor.execute("PRAGMA data_version;")
+		data_version = self.cursor.fetchone()[0]
+		if data_version != self.data_version:
+			self.clear()
+			self.data_version = data_version
+
+		cache = self.caches[cache_name]
+		if key in cache:
+			self.hits[cache_name] += 1
+			cache.move_to_end(key)
+			return cache[key]
+		self.misses[cache_name] += 1
+		value = cache[key] = load()
+		if len(cache) > self.max_size:
+			cache.popitem(last=False)
+		return value
+
+	def invalidate(self, cache_name, key=None):
+		"""Forget `key` of a cache, or the whole cache if `key` is None"""
+		if key is None:
+			self.caches[cache_name].clear()
+		else:
+			self.caches[cache_name].pop(key, None)
+
+	def clear(self):
+		for cache in self.caches.values():
+			cache.clear()
+
+	def get_stats(self) -> [(str, int, int, int)]:
+		return [(name, self.hits[name], self.misses[name], len(self.caches[name])) for name in self.CACHE_NAMES]
+
+
+# TAG INDEX: optional in-memory index, one compressed bitmap of file ordinals by tag
+ARRAY_CONTAINER_MAX = 4096 # Above this count, a 65536-values chunk is stored as a bitset
+BITSET_BYTES = 8192
+BYTE_BITS = tuple(tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256))
+
+
+def _container_to_bitset(container) -> int:
+	if isinstance(container, int):
+		return container
+	bits = bytearray(BITSET_BYTES)
+	for value in container:
+		bits[value >> 3] |= 1 << (value & 7)
+	return int.from_bytes(bits, "little")
+
+
+def _bitset_to_values(bitset) -> [int]:
+	data = bitset.to_bytes(BITSET_BYTES, "little")
+	return [position << 3 | bit for position, byte in enumerate(data) if byte for bit in BYTE_BITS[byte]]
+
+
+def _copy_container(container):
+	return container if isinstance(container, int) else array("H", container)
+
+
+def _optimize_container(container):
+	"""Return the smallest representation of a chunk: sorted array, bitset or None when empty"""
+	if isinstance(container, int):
+		count = container.bit_count()
+		if count == 0:
+			return None
+		return array("H", _bitset_to_values(container)) if count <= ARRAY_CONTAINER_MAX else container
+	if len(container) == 0:
+		return None
+	return _container_to_bitset(container) if len(container) > ARRAY_CONTAINER_MAX else container
+
+
+def _container_filter(values, container, keep_members):
+	"""Return `values` (array) present in `container` (or absent if not `keep_members`)"""
+	if isinstance(container, int):
+		data = container.to_bytes(BITSET_BYTES, "little")
+		return array("H", [v for v in values if bool(data[v >> 3] >> (v & 7) & 1) == keep_members])
+	members = set(container)
+	return array("H", [v for v in values if (v in members) == keep_members])
+
+
+class TagBitmap:
+	"""Roaring-style compressed bitmap: values are split in 65536-values chunks stored as sorted arrays or int bitsets"""
+	__slots__ = ("containers",)
+
+	def __init__(self, containers=None):
+		self.containers = containers if containers is not None else {}
+
+	@classmethod
+	def from_sorted(cls, values):
+		containers = {}
+		for high, chunk_values in groupby(values, key=lambda v: v >> 16):
+			container = _optimize_container(array("H", [v & 0xFFFF for v in chunk_values]))
+			if container is not None:
+				containers[high] = container
+		return cls(containers)
+
+	def __contains__(self, value):
+		container = self.containers.get(value >> 16)
+		if container is None:
+			return False
+		if isinstance(container, int):
+			return bool(container >> (value & 0xFFFF) & 1)
+		position = bisect_left(container, value & 0xFFFF)
+		return position < len(container) and container[position] == value & 0xFFFF
+
+	def __len__(self):
+		return sum(c.bit_count() if isinstance(c, int) else len(c) for c in self.containers.values())
+
+	def __iter__(self):
+		for high in sorted(self.containers):
+			container = self.containers[high]
+			values = _bitset_to_values(container) if isinstance(container, int) else container
+			for low in values:
+				yield high << 16 | low
+
+	def add(self, value):
+		high, low = value >> 16, value & 0xFFFF
+		container = self.containers.get(high, array("H"))
+		if isinstance(container, int):
+			container |= 1 << low
+		else:
+			position = bisect_left(container, low)
+			if position < len(container) and container[position] == low:
+				return
+			container.insert(position, low)
+		self.containers[high] = _optimize_container(container)
+
+	def discard(self, value):
+		high, low = value >> 16, value & 0xFFFF
+		container = self.containers.get(high)
+		if container is None:
+			return
+		if isinstance(container, int):
+			container &= ~(1 << low)
+		else:
+			position = bisect_left(container, low)
+			if position < len(container) and container[position] == low:
+				del container[position]
+		container = _optimize_container(container)
+		if container is None:
+			del self.containers[high]
+		else:
+			self.containers[high] = container
+
+	def __and__(self, other):
+		containers = {}
+		for high in self.containers.keys() & other.containers.keys():
+			a, b = self.containers[high], other.containers[high]
+			if isinstance(a, int) and isinstance(b, int):
+				container = _optimize_container(a & b)
+			elif isinstance(a, int):
+				container = _optimize_container(_container_filter(b, a, True))
+			else:
+				container = _optimize_container(_container_filter(a, b, True))
+			if container is not None:
+				containers[high] = container
+		return TagBitmap(containers)
+
+	def __or__(self, other):
+		containers = {high: _copy_container(a) for high, a in self.containers.items()} # add() and discard() change arrays in place
+		for high, b in other.containers.items():
+			a = containers.get(high)
+			if a is None:
+				containers[high] = _copy_container(b)
+			elif isinstance(a, int) or isinstance(b, int):
+				containers[high] = _container_to_bitset(a) | _container_to_bitset(b)
+			else:
+				containers[high] = _optimize_container(array("H", sorted(set(a).union(b))))
+		return TagBitmap(containers)
+
+	def __sub__(self, other):
+		containers = {}
+		for high, a in self.containers.items():
+			b = other.containers.get(high)
+			if b is None:
+				container = _copy_container(a)
+			elif isinstance(a, int):
+				container = _optimize_container(a & ~_container_to_bitset(b))
+			else:
+				container = _optimize_container(_container_filter(a, b, False))
+			if container is not None:
+				containers[high] = container
+		return TagBitmap(containers)
+
+	def to_json(self):
+		return {str(high): (f"{c:x}" if isinstance(c, int) else c.tolist()) for high, c in self.containers.items()}
+
+	@classmethod
+	def from_json(cls, data):
+		return cls({int(high): (int(c, 16) if isinstance(c, str) else array("H", c)) for high, c in data.items()})
+
+
+class TagIndex:
+	"""Bitmaps of files by tag slug, kept in sync with the `filetag_generation` counter of the database
+
+	Files are numbered with dense ordinals. The index is saved into a sidecar file next to the database
+	and is rebuilt from the database when the sidecar generation does not match anymore.
+	"""
+
+	def __init__(self, sidecar_path):
+		self.sidecar_path = Path(sidecar_path)
+		self.database_uid = None
+		self.generation = None
+		self.files = [] # ordinal -> (folderpath, filename)
+		self.ordinals = {} # (folderpath, filename) -> ordinal
+		self.bitmaps = {} # tag slug -> TagBitmap
+		self.all_files = TagBitmap()
+		self.pending = [] # (is_added, tag slug, (folderpath, filename), changed rows) not committed yet
+		self.pending_reloads = [] # (tag slugs, changed rows) of bulk writes not committed yet, their tags are read back
+		self.is_dirty = False
+
+	def load(self):
+		try:
+			data = json.loads(zlib.decompress(self.sidecar_path.read_bytes()))
+		except (OSError, ValueError, zlib.error):
+			return False
+		self.database_uid, self.generation = data["database_uid"], data["generation"]
+		self.files = [tuple(f) for f in data["files"]]
+		self.ordinals = {f: ordinal for ordinal, f in enumerate(self.files)}
+		self.bitmaps = {slug: TagBitmap.from_json(b) for slug, b in data["bitmaps"].items()}
+		self.all_files = TagBitmap.from_json(data["all_files"])
+		self.is_dirty = False
+		return True
+
+	def save(self):
+		if not self.is_dirty:
+			return
+		data = {
+			"database_uid": self.database_uid,
+			"generation": self.generation,
+			"files": self.files,
+			"bitmaps": {slug: b.to_json() for slug, b in self.bitmaps.items()},
+			"all_files": self.all_files.to_json(),
+		}
+		temporary_path = self.sidecar_path.with_name(self.sidecar_path.name + ".tmp")
+		temporary_path.write_bytes(zlib.compress(json.dumps(data, separators=(",", ":")).encode()))
+		temporary_path.replace(self.sidecar_path)
+		self.is_dirty = False
+
+	def rebuild(self, cursor, database_uid, generation):
+		cursor.execute("""SELECT f.folderpath, ft.filename, t.slug FROM filetag ft JOIN folder f USING(folder_id)
+			JOIN tag t USING(tag_id) ORDER BY ft.folder_id, ft.filename;""")
+		self.files, self.ordinals = [], {}
+		ordinals_by_tag = {}
+		for folderpath, filename, slug in cursor:
+			key = (folderpath, filename)
+			ordinal = self.ordinals.get(key)
+			if ordinal is None:
+				ordinal = self.ordinals[key] = len(self.files)
+				self.files.append(key)
+			tag_ordinals = ordinals_by_tag.setdefault(slug, [])
+			if not tag_ordinals or tag_ordinals[-1] != ordinal:
+				tag_ordinals.append(ordinal)
+		self.bitmaps = {slug: TagBitmap.from_sorted(ordinals) for slug, ordinals in ordinals_by_tag.items()}
+		self.all_files = TagBitmap.from_sorted(range(len(self.files)))
+		self.database_uid, self.generation = database_uid, generation
+		self.pending, self.pending_reloads = [], []
+		self.is_dirty = True
+
+	def apply_pending(self, generation, cursor):
+		"""Apply the committed changes, or drop the index if other writes happened meanwhile"""
+		pending, self.pending = self.pending, []
+		reloads, self.pending_reloads = self.pending_reloads, []
+		changed_rows = sum(p[3] for p in pending) + sum(r[1] for r in reloads)
+		if self.generation is None or self.generation + changed_rows != generation:
+			self.generation = None # rebuilt on next search
+			return
+		for is_added, slug, key, changed_rows in pending:
+			if changed_rows == 0:
+				continue
+			if is_added:
+				ordinal = self.ordinals.get(key)
+				if ordinal is None:
+					ordinal = self.ordinals[key] = len(self.files)
+					self.files.append(key)
+				self.bitmaps.setdefault(slug, TagBitmap()).add(ordinal)
+				self.all_files.add(ordinal)
+			elif key in self.ordinals:
+				ordinal = self.ordinals[key]
+				self.bitmaps.get(slug, TagBitmap()).discard(ordinal)
+				if not any(ordinal in bitmap for bitmap in self.bitmaps.values()):
+					self.all_files.discard(ordinal)
+		for slug in {slug for slugs, _ in reloads for slug in slugs}:
+			self._reload_tag(cursor, slug)
+		self.generation = generation
+		self.is_dirty = True
+
+	def _reload_tag(self, cursor, slug):
+		"""Read back the files of one tag from the database, after a bulk write"""
+		cursor.execute("""SELECT f.folderpath, ft.filename FROM filetag ft JOIN folder f USING(folder_id)
+			JOIN tag t USING(tag_id) WHERE t.slug = ?;""", (slug,))
+		ordinals = set()
+		for key in cursor:
+			ordinal = self.ordinals.get(key)
+			if ordinal is None:
+				ordinal = self.ordinals[key] = len(self.files)
+				self.files.append(key)
+			ordinals.add(ordinal)
+		bitmap = TagBitmap.from_sorted(sorted(ordinals))
+		for ordinal in self.bitmaps.pop(slug, TagBitmap()) - bitmap:
+			if not any(ordinal in other for other in self.bitmaps.values()):
+				self.all_files.discard(ordinal)
+		if ordinals:
+			self.bitmaps[slug] = bitmap
+			self.all_files = self.all_files | bitmap
+
+	def search(self, expression, scope_tags=None) -> TagBitmap:
+		"""Evaluate a parsed search expression, `scope_tags` restricts results to files with one of these tags"""
+		empty = TagBitmap()
+
+		def _evaluate(node):
+			if node[0] == "TAG":
+				return self.bitmaps.get(node[1], empty)
+			if node[0] == "NOT":
+				return self.all_files - _evaluate(node[1])
+			if node[0] == "OR":
+				return reduce(lambda a, b: a | b, [_evaluate(child) for child in node[1]])
+			positives = sorted([_evaluate(child) for child in node[1] if child[0] != "NOT"], key=len)
+			result = reduce(lambda a, b: a & b, positives) if positives else self.all_files
+			for child in node[1]:
+				if child[0] == "NOT":
+					result = result - _evaluate(child[1])
+			return result
+
+		result = _evaluate(expression)
+		if scope_tags is not None:
+			result = result & reduce(lambda a, b: a | b, [self.bitmaps.get(slug, empty) for slug in scope_tags], empty)
+		return result
+
+
+class App:
+
+	def __init__(self, use_tag_index=False, db_path=None, use_snapshot_cache=False, use_cache=False):
 		self.should_commit = False
 		self.data = []
 		self.info = ""
-		self.fs_reader = FilesystemReader()
+		self.options = {}
+		self.stream_results = False # Set by `--format`: listing commands return iterators instead of lists
+		self.metrics = None # CommandMetrics of the running command, when MTM_METRICS is set
+		self.on_progress = None # Callback receiving progress messages of long operations
+		self.fs_reader = FilesystemReader(snapshot_cache_size=SNAPSHOT_CACHE_SIZE if use_snapshot_cache else 0)
 
-		path_to_db = Path(DATABASE_PATH)
-		db_exist = path_to_db.exists()
-		self.db_connection = sqlite3.connect(path_to_db)
+		self.db_path = db_path or DATABASE_PATH
+		self.db_connection = sqlite3.connect(Path(self.db_path), cached_statements=STATEMENT_CACHE_SIZE,
+			factory=sqlite3.Connection if METRICS_PATH is None else MetricsConnection) # Timed cursors only when metrics are collected
 		self.cursor = self.db_connection.cursor() # Connect to db, create file if not exists
-		if not db_exist:
-			self._app_create_db()
+		for pragma, value in load_sqlite_profile(self.db_path).items():
+			self.cursor.execute(f"PRAGMA {pragma} = {value};")
+		self.cursor.execute("PRAGMA foreign_keys = ON;")
+		self.cache = AppCache(self.db_connection) if use_cache else None
+		self.has_filename_index = None
+		self._app_migrate_db()
+
+		# Optional in-memory bitmap index used by searches, saved next to the database
+		self.tag_index = TagIndex(f"{self.db_path}.tagidx") if use_tag_index else None
+		if self.tag_index is not None:
+			self.tag_index.load()
+
+	# CACHE
+	def _cached(self, cache_name, key, load):
+		return load() if self.cache is None else self.cache.get(cache_name, key, load)
+
+	def _invalidate_cache(self, cache_name, key=None):
+		if self.cache is not None:
+			self.cache.invalidate(cache_name, key)
+
+	def _fetch_all(self, query, params=()):
+		self.cursor.execute(query, params)
+		return self.cursor.fetchall()
+
+	def _iter_pages(self, query, params=(), page_size=BATCH_SIZE):
+		"""Yield the rows of `query` by pages, read with a dedicated cursor so other commands can run between two pages"""
+		cursor = self.db_connection.cursor()
+		try:
+			cursor.execute(query, params)
+			while page := cursor.fetchmany(page_size):
+				yield page
+		finally:
+			cursor.close()
+
+	def _fetch_results(self, query, params=()):
+		"""Rows of a listing command: read when printed with `--format`, so memory does not grow with the result"""
+		if self.stream_results:
+			return chain.from_iterable(self._iter_pages(query, params))
+		return self._fetch_all(query, params)
+
+	def get_cache_stats(self):
+		if self.cache is None:
+			self.info = "Cache not used by this process"
+			return
+		self.data = self.cache.get_stats()
+
+	# IDS: resolve user labels to the integer keys of the database
+	def _get_collection_id(self, collection_name):
+		self.cursor.execute(QUERIES["collection_id"], (create_id_from_label(collection_name),))
+		row = self.cursor.fetchone()
+		if row is None:
+			raise ValueError(f"Collection {collection_name} not found")
+		return row[0]
+
+	def _get_tag_id(self, tag_name, create=False):
+		"""Return the id of `tag_name`, with `create` a tag never created is added without collection (tagging commands)"""
+		if create:
+			self.cursor.execute(QUERIES["insert_tag"], (create_id_from_label(tag_name), tag_name))
+			if self.cursor.rowcount:
+				self._invalidate_cache("catalog")
+		self.cursor.execute(QUERIES["tag_id"], (create_id_from_label(tag_name),))
+		row = self.cursor.fetchone()
+		if row is None:
+			raise ValueError(f"Tag {tag_name} not found")
+		return row[0]
+
+	def _get_folder_id(self, folder_path, create=False):
+		"""Return the id of `folder_path`, None if unknown and `create` is not set"""
+		folderpath = normalize_folder_path(folder_path)
+		if create:
+			self.cursor.execute(QUERIES["insert_folder"], (folderpath,))
+		self.cursor.execute(QUERIES["folder_id"], (folderpath,))
+		row = self.cursor.fetchone()
+		return None if row is None else row[0]
 
 	# COLLECTION: a way to group tags, tag can be created without collection
 	def create_new_collection(self, collection_name):
 		collection_id = create_id_from_label(collection_name)
-		self.cursor.execute("INSERT INTO collection VALUES(?, ?);", (collection_id,collection_name,))
+		self.cursor.execute("INSERT INTO collection(slug, collection_name) VALUES(?, ?);", (collection_id,collection_name,))
 		self.should_commit = True
+		self._invalidate_cache("catalog")
 		self.info = f"New collection {collection_name} created"
 
 	def get_all_collections(self):
-		self.cursor.execute("SELECT collection_id, collection_name FROM collection ORDER BY collection_id;")
-		self.data = self.cursor.fetchall()
+		self.data = self._cached("catalog", "collections", lambda: self._fetch_all("SELECT slug, collection_name FROM collection ORDER BY slug;"))
 
 	def delete_collection(self, collection_name):
-		self.cursor.execute("DELETE FROM collection WHERE collection_name = ?;", (collection_name,))
+		self.cursor.execute("DELETE FROM collection WHERE slug = ?;", (create_id_from_label(collection_name),))
 		self.should_commit = True
+		self._invalidate_cache("catalog")
 		self.info = f"Collection {collection_name} deleted"
 
 	# COLLECTION-TAG : One tag can have only one collection
 	def assign_tag_to_collection(self, tag_name, collection_name):
-		self.cursor.execute("UPDATE tag SET collection_id = ? WHERE tag_name = ?;", (create_id_from_label(collection_name), tag_name,))
+		params = (self._get_collection_id(collection_name), create_id_from_label(tag_name),)
+		self.cursor.execute("UPDATE tag SET collection_id = ? WHERE slug = ?;", params)
 		self.should_commit = True
+		self._invalidate_cache("catalog")
 
 	def remove_tag_from_collection(self, tag_name, collection_name):
-		self.cursor.execute("UPDATE tag SET collection_id = '' WHERE tag_name = ?;", (tag_name,))
+		self.cursor.execute("UPDATE tag SET collection_id = NULL WHERE slug = ?;", (create_id_from_label(tag_name),))
 		self.should_commit = True
+		self._invalidate_cache("catalog")
 
 	def get_all_tags_for_collection(self, collection_name):
 		params = (create_id_from_label(collection_name),)
-		self.cursor.execute("SELECT tag_id, tag_name FROM tag WHERE collection_id = ?;", params)
-		self.data = self.cursor.fetchall()
+		self.data = self._cached("catalog", ("collection_tags", params[0]), lambda: self._fetch_all(
+			"SELECT t.slug, t.tag_name FROM tag t JOIN collection c USING(collection_id) WHERE c.slug = ? ORDER BY t.slug;", params))
 
 	# TAG
 	def create_new_tag(self, tag_name, collection_name=None):
 		tag_id = create_id_from_label(tag_name)
-		collection_id = None if not collection_name else create_id_from_label(collection_name)
+		collection_id = None if not collection_name else self._get_collection_id(collection_name)
 
-		self.cursor.execute("INSERT INTO tag VALUES(?, ?, ?);", (tag_id, tag_name, collection_id,))
+		self.cursor.execute("INSERT INTO tag(slug, tag_name, collection_id) VALUES(?, ?, ?);", (tag_id, tag_name, collection_id,))
 		self.should_commit = True
+		self._invalidate_cache("catalog")
 		self.info = f"New tag {tag_name} created"
 
 	def get_all_tags(self):
-		self.cursor.execute("SELECT tag_id, tag_name, collection_id FROM tag ORDER BY tag_id;")
-		self.data = self.cursor.fetchall()
+		self.data = self._cached("catalog", "tags", lambda: self._fetch_all(
+			"SELECT t.slug, t.tag_name, c.slug FROM tag t LEFT JOIN collection c USING(collection_id) ORDER BY t.slug;"))
 
 	def delete_tag(self, tag_name):
 		tag_id = create_id_from_label(tag_name)
-		self.cursor.execute("DELETE FROM tag WHERE tag_id = ?;", (tag_id,) )
+		self.cursor.execute("DELETE FROM tag WHERE slug = ?;", (tag_id,) ) # filetag rows are deleted by cascade
 		self.should_commit = True
+		for cache_name in ("catalog", "tags_by_file"):
+			self._invalidate_cache(cache_name)
+		self._invalidate_cache("files_by_tag", tag_id)
 		self.info = f"Tag {tag_name} deleted"
 
 	# TAG-FILE
@@ -145,12 +1359,15 @@ class App:
 		return (str(p.parent), p.name)
 
 	def assign_tag_to_file(self, file_path, tag_name):
-		tag_id = create_id_from_label(tag_name)
+		tag_id = self._get_tag_id(tag_name, create=True)
 		folder_path, filename, = self._split_path(file_path)
-		params = (folder_path, filename, tag_id,)
-		self.cursor.execute("INSERT INTO filetag VALUES(?, ?, ?);", params)
+		params = (self._get_folder_id(folder_path, create=True), filename, tag_id,)
+		self.cursor.execute(QUERIES["insert_filetag"], params)
 		self.should_commit = True
-		self.info = f"File {folder_path} {filename} tagged"
+		self.info = f"File {folder_path} {filename} tagged" if self.cursor.rowcount else f"File {folder_path} {filename} already tagged"
+		if self.tag_index is not None:
+			self.tag_index.pending.append((True, create_id_from_label(tag_name), (folder_path, filename), self.cursor.rowcount))
+		self._invalidate_file_tag_caches(create_id_from_label(tag_name), folder_path, filename)
 
 	def assign_tag_to_file_interractive(self, file_path):
 		tag_name_input = input("Enter tag for this file:")
@@ -160,275 +1377,1708 @@ class App:
 	def remove_tag_from_file(self, file_path, tag_name):
 		tag_id = create_id_from_label(tag_name)
 		folder_path, filename = self._split_path(file_path)
-		params = (tag_id, filename, folder_path,)
-		self.cursor.execute("DELETE FROM filetag WHERE tag_id = ? AND filename = ? AND folderpath = ? ;", params)
+		params = (tag_id, normalize_folder_path(folder_path), filename,)
+		self.cursor.execute(QUERIES["delete_filetag"], params)
 		self.should_commit = True
+		if self.tag_index is not None:
+			self.tag_index.pending.append((False, tag_id, (normalize_folder_path(folder_path), filename), self.cursor.rowcount))
+		self._invalidate_file_tag_caches(tag_id, folder_path, filename)
 
-	def get_all_files_for_tags(self, tag_names, is_id=False):
-		if not is_id:
-			params = tuple([create_id_from_label(name) for name in tag_names])
-		else:
-			params = tuple(tag_names) # in this case this is not names but ids
-		tag_count = len(params)
-		query_condition = " OR tag_id = ? " * tag_count
-		query = f"SELECT folderpath, filename FROM filetag WHERE 1 == 1 {query_condition} GROUP BY folderpath, filename HAVING count() = {tag_count};"
-		self.cursor.execute(query, params)
-		self.data = self.cursor.fetchall()
+	def assign_tags(self, file_paths, tag_names):
+		"""Tag every file of `file_paths` with every tag of `tag_names`, ids are resolved once and rows written by batches"""
+		tag_ids = [self._get_tag_id(tag_name, create=True) for tag_name in tag_names]
+		file_keys = self._iter_file_keys(file_paths, create=True)
+		row_count = self._insert_filetag_rows((folder_id, filename, tag_id) for folder_id, filename in file_keys for tag_id in tag_ids)
+		self.info = f"{row_count} file tags added"
+
+	def remove_tags(self, file_paths, tag_names):
+		"""Remove every tag of `tag_names` from every file of `file_paths`, by batches"""
+		tag_ids = [self._get_tag_id(tag_name) for tag_name in tag_names]
+		file_keys = ((folder_id, filename) for folder_id, filename in self._iter_file_keys(file_paths) if folder_id is not None)
+		generation = self._get_filetag_generation()
+		row_count = 0
+		for batch in iter_batches(((tag_id, folder_id, filename) for folder_id, filename in file_keys for tag_id in tag_ids), BATCH_SIZE):
+			self.cursor.executemany("DELETE FROM filetag WHERE tag_id = ? AND folder_id = ? AND filename = ?;", batch)
+			row_count += self.cursor.rowcount
+		self._reload_tags_at_commit(tag_ids, generation)
+		self.should_commit = True
+		self._invalidate_file_caches()
+		self.info = f"{row_count} file tags removed"
+
+	def _iter_file_keys(self, file_paths, create=False):
+		"""Yield (folder_id, filename) of `file_paths`, each folder is looked up once (folder_id is None if unknown)"""
+		folder_ids = {}
+		for file_path in file_paths:
+			folder_path, filename = self._split_path(file_path)
+			if folder_path not in folder_ids:
+				folder_ids[folder_path] = self._get_folder_id(folder_path, create=create)
+			yield folder_ids[folder_path], filename
+
+	def _invalidate_file_tag_caches(self, tag_id, folder_path, filename):
+		self._invalidate_cache("files_by_tag", tag_id)
+		self._invalidate_cache("tags_by_file", (normalize_folder_path(folder_path), filename))
+		self._invalidate_cache("catalog", "tagged_folders")
+
+	def _invalidate_file_caches(self):
+		"""Forget the cached files and tagged folders, after a bulk change of file tags"""
+		for cache_name in ("files_by_tag", "tags_by_file"):
+			self._invalidate_cache(cache_name)
+		self._invalidate_cache("catalog", "tagged_folders")
+
+	def _parse_tag_query(self, words, is_id=False):
+		return parse_tag_query(words, is_id=is_id, is_tag=lambda tag_id: self._fetch_all(QUERIES["tag_id"], (tag_id,)) != [])
+
+	def get_all_files_for_tags(self, tag_names, is_id=False, collection_name=None, folder_path=None, name_pattern=None):
+		"""Search files matching a tag expression and/or a name pattern, optionally scoped to a collection or a folder tree"""
+		expression = self._parse_tag_query(tag_names, is_id=is_id) if tag_names or name_pattern is None else None
+		if self.tag_index is not None and name_pattern is None:
+			self._search_tag_index(expression, collection_name, folder_path)
+			return
+		self.data = self._fetch_results(*self._get_files_query(expression, collection_name, folder_path, name_pattern))
+
+	def iter_files_for_tags(self, tag_names, collection_name=None, folder_path=None, page_size=1000, name_pattern=None):
+		"""Yield the files of a search by pages of (folderpath, filename), rows are read when a page is asked
+
+		Pages are read with a dedicated cursor, so other commands can run between two pages.
+		"""
+		expression = self._parse_tag_query(tag_names) if tag_names or name_pattern is None else None
+		if self.tag_index is not None and name_pattern is None:
+			self._search_tag_index(expression, collection_name, folder_path)
+			files, self.data = self.data, []
+			for position in range(0, len(files), page_size):
+				yield files[position:position + page_size]
+			return
+		yield from self._iter_pages(*self._get_files_query(expression, collection_name, folder_path, name_pattern), page_size=page_size)
+
+	def _get_files_query(self, expression, collection_name=None, folder_path=None, name_pattern=None) -> (str, list):
+		query, params = self._plan_tag_query(expression) if expression is not None else ("", [])
+		if name_pattern is not None:
+			name_query, name_params = self._get_name_query(name_pattern)
+			query, params = (f"{query} INTERSECT {name_query}" if query else name_query), params + name_params
+
+		scope_conditions = []
+		if collection_name is not None:
+			scope_conditions.append("""EXISTS (SELECT 1 FROM filetag s JOIN tag st USING(tag_id)
+				WHERE st.collection_id = ? AND s.folder_id = r.folder_id AND s.filename = r.filename)""")
+			params.append(self._get_collection_id(collection_name))
+		if folder_path is not None:
+			scope_conditions.append(SUBTREE_CONDITION)
+			params.extend(get_subtree_bounds(folder_path))
+		where = "WHERE " + " AND ".join(scope_conditions) if scope_conditions else ""
+
+		return f"""SELECT DISTINCT f.folderpath, r.filename FROM ({query}) r JOIN folder f USING(folder_id)
+			{where} ORDER BY f.folderpath, r.filename;""", params
+
+	def _plan_tag_query(self, expression) -> (str, list):
+		"""Translate a search expression into one SQL query returning (folder_id, filename) rows
+
+		Tags are read through the filetag_tag_index. An AND starts from its most selective operand,
+		the other tags are checked with indexed EXISTS lookups and sub-expressions with INTERSECT/EXCEPT.
+		"""
+		slugs = list(get_query_tags(expression))
+		self.cursor.execute(f"SELECT slug, tag_id FROM tag WHERE slug IN ({', '.join('?' * len(slugs))});", slugs)
+		tag_ids = dict(self.cursor.fetchall()) # unknown tags stay None and match nothing
+		file_counts = self._get_tag_file_counts(tag_ids.values())
+		all_files = "SELECT folder_id, filename FROM filetag"
+
+		def _estimate(node):
+			if node[0] == "TAG":
+				return file_counts.get(tag_ids.get(node[1]), 0)
+			if node[0] == "OR":
+				return sum(_estimate(child) for child in node[1])
+			if node[0] == "AND":
+				return min((_estimate(child) for child in node[1] if child[0] != "NOT"), default=float("inf"))
+			return float("inf")
+
+		def _compile(node):
+			if node[0] == "TAG":
+				return "SELECT folder_id, filename FROM filetag WHERE tag_id = ?", [tag_ids.get(node[1])]
+			if node[0] == "NOT":
+				query, params = _compile(node[1])
+				return f"{all_files} EXCEPT SELECT * FROM ({query})", params
+			if node[0] == "OR":
+				queries, params = [], []
+				for child in node[1]:
+					query, child_params = _compile(child)
+					queries.append(f"SELECT * FROM ({query})")
+					params += child_params
+				return " UNION ".join(queries), params
+
+			positives = sorted([child for child in node[1] if child[0] != "NOT"], key=_estimate)
+			negatives = [child[1] for child in node[1] if child[0] == "NOT"]
+			if positives:
+				driver_query, params = _compile(positives.pop(0))
+			else:
+				driver_query, params = all_files, []
+			query = f"SELECT d.folder_id, d.filename FROM ({driver_query}) d WHERE 1"
+			compounds, compound_params = [], []
+			for is_negative, children in ((False, positives), (True, negatives)):
+				for child in children:
+					if child[0] == "TAG":
+						lookup = "NOT EXISTS" if is_negative else "EXISTS"
+						query += f" AND {lookup} (SELECT 1 FROM filetag p WHERE p.tag_id = ? AND p.folder_id = d.folder_id AND p.filename = d.filename)"
+						params.append(tag_ids.get(child[1]))
+					else:
+						child_query, child_params = _compile(child)
+						compounds.append(("EXCEPT" if is_negative else "INTERSECT") + f" SELECT * FROM ({child_query})")
+						compound_params += child_params
+			return " ".join([query] + compounds), params + compound_params
+
+		return _compile(expression)
+
+	def _get_name_query(self, name_pattern) -> (str, list):
+		"""Translate a name pattern into one SQL query returning the (folder_id, filename) of matching tagged files"""
+		phrase, like_pattern = parse_name_pattern(name_pattern)
+		if phrase is not None and self._has_filename_index():
+			return """SELECT tf.folder_id, tf.filename FROM filename_fts JOIN taggedfile tf ON tf.file_id = filename_fts.rowid
+				WHERE filename_fts MATCH ?""", [phrase]
+		return "SELECT folder_id, filename FROM taggedfile WHERE filename LIKE ? ESCAPE '\\'", [like_pattern]
+
+	def _has_filename_index(self) -> bool:
+		"""The trigram index is missing when SQLite was built without FTS5, searches then scan the filenames"""
+		if self.has_filename_index is None:
+			self.cursor.execute("SELECT count() FROM sqlite_master WHERE name = 'filename_fts';")
+			self.has_filename_index = self.cursor.fetchone()[0] > 0
+		return self.has_filename_index
+
+	def _get_tag_file_counts(self, tag_ids) -> dict:
+		tag_ids = [tag_id for tag_id in tag_ids if tag_id is not None]
+		self.cursor.execute(f"SELECT tag_id, file_count FROM tagstat WHERE tag_id IN ({', '.join('?' * len(tag_ids))});", tag_ids)
+		return dict(self.cursor.fetchall())
 
-	def get_all_files_for_tag(self, tag_name, folder_path_filter=None):
+	def _search_tag_index(self, expression, collection_name=None, folder_path=None):
+		scope_tags = None
+		if collection_name is not None:
+			self.get_all_tags_for_collection(collection_name)
+			scope_tags = [slug for slug, _ in self.data]
+		tag_index = self._get_tag_index()
+		files = [tag_index.files[ordinal] for ordinal in tag_index.search(expression, scope_tags=scope_tags)]
+		if folder_path is not None:
+			folderpath, subtree_start, _ = get_subtree_bounds(folder_path)
+			files = [f for f in files if f[0] == folderpath or f[0].startswith(subtree_start)]
+		self.data = sorted(files)
+
+	def _get_tag_index(self) -> TagIndex:
+		"""Return the bitmap index, rebuilt first if the database changed since it was built"""
+		self.cursor.execute(QUERIES["index_meta"])
+		meta = dict(self.cursor.fetchall())
+		if self.tag_index.database_uid != meta["database_uid"] or self.tag_index.generation != meta["filetag_generation"]:
+			self.tag_index.rebuild(self.cursor, meta["database_uid"], meta["filetag_generation"])
+		return self.tag_index
+
+	def get_all_files_for_tag(self, tag_name, folder_path_filter=None, subtree_path=None):
+		"""Files of a tag, only those of `folder_path_filter`, or only those anywhere under `subtree_path`"""
 		tag_id = create_id_from_label(tag_name)
-		params = (tag_id,)
-		query = "SELECT folderpath, filename FROM filetag WHERE tag_id = ?"
-		if folder_path_filter:
-			query += " AND folderpath = ?"
-			params = (tag_id, folder_path_filter.rstrip("/"),)
-		query += ";"
-		self.cursor.execute(query, params)
-		self.data = self.cursor.fetchall()
+		if subtree_path:
+			self.data = self._fetch_results(QUERIES["files_for_tag_under"], (tag_id, *get_subtree_bounds(subtree_path),))
+		elif folder_path_filter:
+			self.data = self._fetch_results(QUERIES["files_for_tag_in_folder"], (tag_id, normalize_folder_path(folder_path_filter),))
+		elif self.stream_results and self.cache is None and self.tag_index is None:
+			self.data = self._fetch_results(QUERIES["files_for_tag"], (tag_id,))
+		else:
+			self.data = self._cached("files_by_tag", tag_id, lambda: self._load_files_for_tag(tag_id))
+
+	def _load_files_for_tag(self, tag_id):
+		if self.tag_index is not None:
+			self._search_tag_index(("TAG", tag_id))
+			return self.data
+		return self._fetch_all(QUERIES["files_for_tag"], (tag_id,))
 
 	def get_all_tags_for_file(self, file_path):
 		folder_path, filename, = self._split_path(file_path)
 		params = (folder_path, filename,) 
-		self.cursor.execute("SELECT tag_id FROM filetag WHERE folderpath = ? AND filename = ?;", params)
-		data = self.cursor.fetchall()
-		self.data = [tag[0] for tag in data] # Remove tuples and send clear list of tag ids
+		self.data = self._cached("tags_by_file", params, lambda: [tag[0] for tag in self._fetch_all(QUERIES["tags_for_file"], params)]) # Remove tuples and send clear list of tag ids
 
-	def get_folders_with_tagged_content(self):
-		self.cursor.execute("SELECT folderpath FROM filetag GROUP BY folderpath;")
-		self.data = self.cursor.fetchall()
+	def get_folders_with_tagged_content(self, subtree_path=None):
+		if subtree_path:
+			self.data = self._fetch_all(QUERIES["tagged_folders_under"], get_subtree_bounds(subtree_path))
+			return
+		query = "SELECT folderpath FROM folder f WHERE EXISTS (SELECT 1 FROM filetag ft WHERE ft.folder_id = f.folder_id) ORDER BY folderpath;"
+		self.data = self._cached("catalog", "tagged_folders", lambda: self._fetch_all(query))
+
+	def get_tagged_folder_tree(self, subtree_path=None):
+		"""Topmost tagged folders (under `subtree_path`) with the count of tagged folders of their tree, themselves included"""
+		self.get_folders_with_tagged_content(subtree_path)
+		roots = {}
+		for folderpath, in self.data: # Sorted: a folder comes before its sub-folders
+			parent = folderpath
+			while parent not in roots and os.path.dirname(parent) != parent:
+				parent = os.path.dirname(parent)
+			if parent in roots:
+				roots[parent] += 1
+			else:
+				roots[folderpath] = 1
+		self.data = list(roots.items())
+
+	def get_tag_counts_for_folder(self, folder_path):
+		"""Count of files by tag, for the files anywhere under `folder_path`"""
+		self.data = self._fetch_all(QUERIES["tag_counts_under"], get_subtree_bounds(folder_path))
+
+	# FACETS: counts read from the tagstat/tagpair summary tables, maintained by the filetag triggers
+	def get_tag_counts(self, collection_name=None):
+		"""Tags (of a collection) with their count of files"""
+		query = "SELECT t.slug, t.tag_name, coalesce(ts.file_count, 0) FROM tag t LEFT JOIN tagstat ts USING(tag_id)"
+		if collection_name is None:
+			self.data = self._fetch_all(f"{query} ORDER BY t.slug;")
+		else:
+			self.data = self._fetch_all(f"{query} WHERE t.collection_id = ? ORDER BY t.slug;", (self._get_collection_id(collection_name),))
+
+	def get_collection_counts(self):
+		"""Collections with their count of tags and of file tags (a file with two tags of a collection counts twice)"""
+		self.data = self._fetch_all("""SELECT c.slug, count(t.tag_id), coalesce(sum(ts.file_count), 0) FROM collection c
+			LEFT JOIN tag t USING(collection_id) LEFT JOIN tagstat ts USING(tag_id) GROUP BY c.collection_id ORDER BY c.slug;""")
+
+	def get_refine_counts(self, tag_names):
+		"""Other tags of the files matching a search, with the count of files left if they are added to it
+
+		A single tag is read from tagpair, other searches count the tags of their result files.
+		"""
+		expression = self._parse_tag_query(tag_names)
+		if expression[0] == "TAG":
+			self.data = self._fetch_all("""SELECT t.slug, tp.file_count FROM tagpair tp JOIN tag t ON t.tag_id = tp.other_tag_id
+				WHERE tp.tag_id = (SELECT tag_id FROM tag WHERE slug = ?) AND tp.file_count > 0 ORDER BY t.slug;""", (expression[1],))
+			return
+		query, params = self._plan_tag_query(expression)
+		slugs = list(get_query_tags(expression))
+		self.data = self._fetch_all(f"""SELECT t.slug, count() FROM ({query}) r JOIN filetag ft ON ft.folder_id = r.folder_id AND ft.filename = r.filename
+			JOIN tag t USING(tag_id) WHERE t.slug NOT IN ({', '.join('?' * len(slugs))}) GROUP BY ft.tag_id ORDER BY t.slug;""", params + slugs)
+
+	def _rebuild_tag_stats(self):
+		"""Count again the summary tables, after a bulk load done without their triggers"""
+		self.cursor.execute("DELETE FROM tagstat;")
+		self.cursor.execute("INSERT INTO tagstat(tag_id, file_count) SELECT tag_id, count() FROM filetag GROUP BY tag_id;")
+		self.cursor.execute("DELETE FROM tagpair;")
+		self.cursor.execute("""INSERT INTO tagpair(tag_id, other_tag_id, file_count) SELECT a.tag_id, b.tag_id, count() FROM filetag a
+			JOIN filetag b ON b.folder_id = a.folder_id AND b.filename = a.filename AND b.tag_id != a.tag_id GROUP BY a.tag_id, b.tag_id;""")
 
 	# TAG Operations
-	def move_tag_files(self, tag_name, destination):
-		self.get_all_files_for_tag(tag_name=tag_name)
-		filepaths = [Path(p, fn) for p, fn in self.data]
-		self.fs_reader.move_files(file_paths=filepaths, destination=destination)
+	def move_tag_files(self, tag_name, destination, workers=None):
+		self._transfer_tag_files(tag_name, destination, move=True, workers=workers)
+
+	def copy_tag_files(self, tag_name, destination, workers=None):
+		self._transfer_tag_files(tag_name, destination, move=False, workers=workers)
+
+	def _transfer_tag_files(self, tag_name, destination, move, workers=None):
+		"""Copy/move the files of a tag, following a journal so an interrupted transfer can be resumed
 
-	def copy_tag_files(self, tag_name, destination):
-		self.get_all_files_for_tag(tag_name=tag_name)
-		filepaths = [Path(p, fn) for p, fn in self.data]
-		self.fs_reader.copy_files(file_paths=filepaths, destination=destination)
+		The journal lists the files of the transfer, completed files are marked by chunks. For moves,
+		the file tags are rewritten to the destination folder in the same transaction as the chunk.
+		"""
+		if not os.path.isdir(destination):
+			raise ValueError(f"Destination folder {destination} not found")
+		tag_id = self._get_tag_id(tag_name)
+		transfer_key = f"{'move' if move else 'copy'} {create_id_from_label(tag_name)} {normalize_folder_path(destination)}"
+		destination_folder_id = self._get_folder_id(os.path.abspath(destination), create=True) if move else None
+
+		self.cursor.execute("SELECT count() FROM transferjournal WHERE transfer_key = ?;", (transfer_key,))
+		if self.cursor.fetchone()[0] == 0:
+			self.cursor.execute("""INSERT INTO transferjournal(transfer_key, folder_id, filename)
+				SELECT ?, folder_id, filename FROM filetag WHERE tag_id = ?;""", (transfer_key, tag_id,))
+		self._app_commit()
+		self.cursor.execute("""SELECT tj.folder_id, f.folderpath, tj.filename FROM transferjournal tj JOIN folder f USING(folder_id)
+			WHERE tj.transfer_key = ? AND tj.is_done = 0;""", (transfer_key,))
+		files_by_path = {os.path.join(folderpath, filename): (folder_id, filename) for folder_id, folderpath, filename in self.cursor.fetchall()}
+
+		# Files with the same name would be written to the same destination path, none of them is transferred
+		errors = []
+		paths_by_name = {}
+		for source_path in files_by_path:
+			paths_by_name.setdefault(os.path.basename(source_path), []).append(source_path)
+		for filename, source_paths in paths_by_name.items():
+			if len(source_paths) > 1:
+				for source_path in source_paths:
+					del files_by_path[source_path]
+					errors.append((source_path, f"{len(source_paths)} files named {filename} would have the same destination path"))
+
+		done_files = []
+		done_count = 0
+		last_commit_time = time.monotonic()
+		for source_path, error in self.fs_reader.transfer_files(files_by_path.keys(), destination, move=move, workers=workers):
+			target_path = os.path.join(destination, os.path.basename(source_path))
+			if error is not None and move and not os.path.lexists(source_path) and os.path.lexists(target_path):
+				error = None # Moved before an interruption, the journal was not updated
+			if error is not None:
+				errors.append((source_path, str(error)))
+				continue
+			done_files.append(files_by_path[source_path])
+			if len(done_files) >= BATCH_SIZE or time.monotonic() - last_commit_time > 1:
+				done_count += self._mark_transferred(transfer_key, done_files, destination_folder_id)
+				done_files, last_commit_time = [], time.monotonic()
+				self._app_progress(f"{done_count}/{len(files_by_path)} files {'moved' if move else 'copied'}")
+		done_count += self._mark_transferred(transfer_key, done_files, destination_folder_id)
+
+		if not errors:
+			self.cursor.execute("DELETE FROM transferjournal WHERE transfer_key = ?;", (transfer_key,))
+			self._app_commit()
+		self.data = errors
+		resume_message = ", run the command again to retry failed files" if errors else ""
+		self.info = f"{done_count} files {'moved' if move else 'copied'}, {len(errors)} errors{resume_message}"
+
+	def _mark_transferred(self, transfer_key, done_files, destination_folder_id):
+		"""Commit a chunk of transferred files: journal and, for moves, their tags (all tags, not only the copied one)"""
+		self.cursor.executemany("UPDATE transferjournal SET is_done = 1 WHERE transfer_key = ? AND folder_id = ? AND filename = ?;",
+			[(transfer_key, folder_id, filename) for folder_id, filename in done_files])
+		if destination_folder_id is not None:
+			self._move_file_rows([((folder_id, filename), (destination_folder_id, filename)) for folder_id, filename in done_files])
+		self._app_commit()
+		return len(done_files)
 
 	def check_tag_files_contains_word(self, tag_name, word):
-		self.get_all_files_for_tag(tag_name=tag_name)
-		files_without_word = list(filter(lambda a: word not in a[1], self.data))
-		self.data = files_without_word
+		"""List the files of a tag whose name does not contain `word` (literal, case-sensitive)"""
+		self.cursor.execute("""SELECT f.folderpath, ft.filename FROM filetag ft JOIN folder f USING(folder_id)
+			WHERE ft.tag_id = ? AND instr(ft.filename, ?) = 0 ORDER BY f.folderpath, ft.filename;""", (self._get_tag_id(tag_name), word))
+		self.data = self.cursor.fetchall()
 
 	# FOLDER
 	def link_folder(self, folder_path, collection_name, default_tag=None):
-		collection_id = create_id_from_label(collection_name)
-		default_tag_id = None if default_tag is None else create_id_from_label(default_tag)
+		collection_id = self._get_collection_id(collection_name)
+		default_tag_id = None if default_tag is None else self._get_tag_id(default_tag)
+		folder_id = self._get_folder_id(folder_path, create=True)
 
-		self.cursor.execute("INSERT INTO linkedfolder VALUES(?, ?, ?);", (folder_path, collection_id, default_tag_id,))
+		self.cursor.execute("INSERT INTO linkedfolder(folder_id, collection_id, default_tag_id) VALUES(?, ?, ?);", (folder_id, collection_id, default_tag_id,))
 		self.should_commit = True
 		self.info = f"Folder {folder_path} linked to collection"
 
 	def get_linked_folders(self):
-		self.cursor.execute("SELECT folderpath, collection_id, default_tag_id FROM linkedfolder;")
+		query = """SELECT f.folderpath, c.slug, t.slug FROM linkedfolder lf
+			JOIN folder f USING(folder_id) JOIN collection c USING(collection_id)
+			LEFT JOIN tag t ON t.tag_id = lf.default_tag_id;"""
+		self.cursor.execute(query)
 		self.data = self.cursor.fetchall()
 
-	def tag_all_files_from_folder(self, tag_name, folder_path, filetype_filter=None):
-		tag_id = create_id_from_label(tag_name)
+	# FOLDER pipelines: scanned entries -> filters -> batched writes, memory does not grow with folder size
+	def _iter_scanned_files(self, folder_path, filetype_filter=None, **scan_options):
+		"""Yield (folder_id, name) of scanned entries, sub-folders walked in recursive mode are skipped"""
+		folder_ids = {}
+		for folderpath, name, is_folder in self.fs_reader.scan(path=folder_path, filetypes=filetype_filter, **scan_options):
+			if is_folder and scan_options.get("recursive"):
+				continue
+			if folderpath not in folder_ids:
+				folder_ids = {folderpath: self._get_folder_id(folderpath, create=True)} # entries come grouped by folder
+			yield folder_ids[folderpath], name
 
-		docs = self.fs_reader.get_files(path=folder_path, filetypes=None)
-		cursor_data = []
-		for doc_path, doc_infos in docs.items():
-			cursor_data.append((str(folder_path), doc_infos[0], tag_id,))
-		self.cursor.executemany("INSERT INTO filetag VALUES(?, ?, ?);", cursor_data)
+	def _insert_filetag_rows(self, rows):
+		"""Insert (folder_id, filename, tag_id) rows by batches, in the current transaction
+
+		Existing rows are skipped, so running the same bulk operation twice changes nothing.
+		"""
+		generation = self._get_filetag_generation()
+		row_count, inserted_count, tag_ids = 0, 0, set()
+		for batch in iter_batches(rows, BATCH_SIZE):
+			self.cursor.executemany(QUERIES["insert_filetag"], batch)
+			row_count += len(batch)
+			inserted_count += self.cursor.rowcount
+			if self.tag_index is not None:
+				tag_ids.update(tag_id for _, _, tag_id in batch)
+			self._app_progress(f"{row_count} files read, {inserted_count} newly tagged")
+		self._reload_tags_at_commit(tag_ids, generation)
 		self.should_commit = True
+		self._invalidate_file_caches()
+		return inserted_count
+
+	def _get_filetag_generation(self):
+		self.cursor.execute(QUERIES["filetag_generation"])
+		return self.cursor.fetchone()[0]
+
+	def _reload_tags_at_commit(self, tag_ids, generation):
+		"""Have the tag index read back the files of `tag_ids` at commit, `generation` being read before the bulk write"""
+		if self.tag_index is None:
+			return
+		tag_ids = list(tag_ids)
+		self.cursor.execute(f"SELECT slug FROM tag WHERE tag_id IN ({', '.join('?' * len(tag_ids))});", tag_ids)
+		slugs = [slug for slug, in self.cursor.fetchall()]
+		self.tag_index.pending_reloads.append((slugs, self._get_filetag_generation() - generation))
+
+	def tag_all_files_from_folder(self, tag_name, folder_path, filetype_filter=None, **scan_options):
+		self.assign_tags_to_folder([tag_name], folder_path, filetype_filter, **scan_options)
+
+	def assign_tags_to_folder(self, tag_names, folder_path, filetype_filter=None, **scan_options):
+		"""Tag the files of a folder with every tag of `tag_names`, in one scan"""
+		tag_ids = [self._get_tag_id(tag_name, create=True) for tag_name in tag_names]
+		docs = self._iter_scanned_files(folder_path, filetype_filter, **scan_options)
+		row_count = self._insert_filetag_rows((folder_id, name, tag_id,) for folder_id, name in docs for tag_id in tag_ids)
+		self.info = f"{row_count} file tags added" if len(tag_ids) > 1 else f"{row_count} files newly tagged"
 
 	def tag_all_files_from_folder_interractive(self, folder_path):
 		tag_name_input = input("Enter tag for the files of this folder: ")
 		tag_name = tag_name_input.strip(" ")
 		self.tag_all_files_from_folder(tag_name, folder_path)
 	
-	def tag_all_files_containing_word(self, tag_name, folder_path, word_filter):
-		tag_id = create_id_from_label(tag_name)
-		
-		docs = self.fs_reader.get_files(path=folder_path, search_word=word_filter)
-		cursor_data = []
-		for doc_path, doc_infos in docs.items():
-			cursor_data.append((str(folder_path), doc_infos[0], tag_id,))
-		self.cursor.executemany("INSERT INTO filetag VALUES(?, ?, ?)", cursor_data)
-		self.should_commit = True
-
-	def get_untagged_file_for_folder(self, folder_path, filetype_filter=None) -> [str]:
-		docs_in_fs = self.fs_reader.get_files(path=folder_path, filetypes=filetype_filter)
-		path = Path(folder_path)
-		tagged_docs = []
-		self.cursor.execute("SELECT filename FROM filetag WHERE folderpath = ?", (str(path),))
-		for filename in self.cursor.fetchall():
-			tagged_docs.append(filename[0])
+	def tag_all_files_containing_word(self, tag_name, folder_path, word_filter, filetype_filter=None, **scan_options):
+		tag_id = self._get_tag_id(tag_name, create=True)
+		search_word = word_filter.casefold()
+		docs = self._iter_scanned_files(folder_path, filetype_filter, **scan_options)
+		matching_docs = ((folder_id, name) for folder_id, name in docs if search_word in name.casefold())
+		row_count = self._insert_filetag_rows((folder_id, name, tag_id,) for folder_id, name in matching_docs)
+		self.info = f"{row_count} files newly tagged"
 
+	def get_untagged_file_for_folder(self, folder_path, filetype_filter=None, **scan_options) -> [str]:
+		"""List untagged names of `folder_path`, paths relative to `folder_path` in recursive mode"""
+		root = normalize_folder_path(folder_path)
+		docs_in_fs = self.fs_reader.scan(path=folder_path, filetypes=filetype_filter, **scan_options)
+		skip_folders = scan_options.get("recursive")
 		untagged_files = []
 
-		for fs_item, fs_infos in docs_in_fs.items():
-			if fs_infos[0] not in tagged_docs:
-				untagged_files.append(fs_infos[0])
+		for fs_folderpath, folder_docs in groupby(docs_in_fs, key=lambda doc: doc[0]): # entries come grouped by folder
+			self.cursor.execute(QUERIES["folder_filenames"], (fs_folderpath,))
+			tagged_docs = {filename for filename, in self.cursor}
+			prefix = "" if fs_folderpath == root else os.path.relpath(fs_folderpath, root) + os.sep
+			untagged_files += [prefix + name for _, name, is_folder in folder_docs if name not in tagged_docs and not (is_folder and skip_folders)]
 
 		self.data = untagged_files
 
 	def tag_folder_files_interractive(self, folder_path):
-		fs_files = self.fs_reader.get_files(path=folder_path)
-		cursor_data = []
-		for _, file_infos in fs_files.items():
-			print(f"Set tag for {file_infos[0]}:")
-			input_tag_name = input(" Tag_name (or SKIP / END): ")
-			input_tag = input_tag_name.strip(" ")
-			if input_tag.upper() == "SKIP":
-				pass
-			elif input_tag.upper() == "END":
-				break
-			else:
-				tag_id = create_id_from_label(input_tag)
-				cursor_data.append((str(folder_path), file_infos[0], tag_id,))
+		def _ask_file_tags():
+			for folder_id, name in self._iter_scanned_files(folder_path):
+				print(f"Set tag for {name}:")
+				input_tag_name = input(" Tag_name (or SKIP / END): ")
+				input_tag = input_tag_name.strip(" ")
+				if input_tag.upper() == "SKIP":
+					pass
+				elif input_tag.upper() == "END":
+					break
+				else:
+					try:
+						yield (folder_id, name, self._get_tag_id(input_tag, create=True),)
+					except ValueError as e:
+						print(f" {e}, file skipped")
+
+		self._insert_filetag_rows(_ask_file_tags())
+
+
+	# IDENTITY: files are found back by content fingerprint (size, partial hash, full hash on collisions)
+	def _move_file_rows(self, moves):
+		"""Move the tags and the fingerprint of files: `moves` are ((folder_id, filename), (new folder_id, new filename))"""
+		rows = [(new_folder_id, new_filename, folder_id, filename) for (folder_id, filename), (new_folder_id, new_filename) in moves]
+		generation = self._get_filetag_generation()
+		tag_ids = set()
+		if self.tag_index is not None:
+			for old_key, _ in moves:
+				self.cursor.execute("SELECT tag_id FROM filetag WHERE folder_id = ? AND filename = ?;", old_key)
+				tag_ids.update(tag_id for tag_id, in self.cursor)
+		self.cursor.executemany("UPDATE OR IGNORE filetag SET folder_id = ?, filename = ? WHERE folder_id = ? AND filename = ?;", rows)
+		self.cursor.executemany("DELETE FROM filetag WHERE folder_id = ? AND filename = ?;", [old for old, _ in moves]) # Tags already on the new file
+		self.cursor.executemany("UPDATE OR IGNORE filefingerprint SET folder_id = ?, filename = ? WHERE folder_id = ? AND filename = ?;", rows)
+		self.cursor.executemany("DELETE FROM filefingerprint WHERE folder_id = ? AND filename = ?;", [old for old, _ in moves])
+		self._reload_tags_at_commit(tag_ids, generation)
+		self.should_commit = True
+		self._invalidate_file_caches()
+
+	def _fingerprint_files(self, files, full=False):
+		"""Hash `files` ((folder_id, filename), file path) in a process pool, store and yield (key, fingerprint)"""
+		files = list(files)
+		with ProcessPoolExecutor() as executor:
+			mapper = executor.map if len(files) > 16 else map # Small runs do not pay the pool start
+			fingerprints = mapper(compute_fingerprint, [path for _, path in files], [full] * len(files), **({"chunksize": 16} if len(files) > 16 else {}))
+			for batch in iter_batches(zip((key for key, _ in files), fingerprints), BATCH_SIZE):
+				batch = [(key, fingerprint) for key, fingerprint in batch if fingerprint is not None]
+				self.cursor.executemany("INSERT OR REPLACE INTO filefingerprint VALUES(?, ?, ?, ?, ?, ?);",
+					[key + fingerprint for key, fingerprint in batch])
+				self._app_progress(f"{len(batch)} files hashed")
+				yield from batch
+		self.should_commit = True
+
+	def _update_tagged_fingerprints(self):
+		"""Hash the tagged files changed since their last fingerprint, return {key: fingerprint} of missing files"""
+		self.cursor.execute("""SELECT ft.folder_id, ft.filename, f.folderpath, fp.size, fp.mtime_ns, fp.partial_hash, fp.full_hash
+			FROM filetag ft JOIN folder f USING(folder_id) LEFT JOIN filefingerprint fp USING(folder_id, filename)
+			GROUP BY ft.folder_id, ft.filename;""")
+		missing_files, changed_files = {}, []
+		for folder_id, filename, folderpath, *fingerprint in self.cursor.fetchall():
+			file_path = os.path.join(folderpath, filename)
+			try:
+				stat = os.stat(file_path)
+			except FileNotFoundError:
+				missing_files[(folder_id, filename)] = None if fingerprint[0] is None else tuple(fingerprint)
+				continue
+			except OSError:
+				continue
+			if (stat.st_size, stat.st_mtime_ns) != tuple(fingerprint[:2]):
+				changed_files.append(((folder_id, filename), file_path))
+		for _ in self._fingerprint_files(changed_files):
+			pass
+
+		# Collisions: files sharing size and partial hash get a full hash, while they can still be read
+		self.cursor.execute("""SELECT fp.folder_id, fp.filename, f.folderpath FROM filefingerprint fp JOIN folder f USING(folder_id)
+			WHERE fp.full_hash IS NULL AND (fp.size, fp.partial_hash) IN (SELECT size, partial_hash FROM filefingerprint
+			GROUP BY size, partial_hash HAVING count() > 1);""")
+		colliding_files = [((folder_id, filename), os.path.join(folderpath, filename)) for folder_id, filename, folderpath in self.cursor.fetchall()
+			if (folder_id, filename) not in missing_files]
+		for _ in self._fingerprint_files(colliding_files, full=True):
+			pass
+		return missing_files
+
+	def _find_moved_files(self, missing_fingerprints, scan_options):
+		"""Return (missing key, found key) of the untagged files of the linked folders matching a missing file, and the keys of the compared files"""
+		missing_by_hash = {}
+		for key, (size, _, partial_hash, full_hash) in missing_fingerprints.items():
+			missing_by_hash.setdefault((size, partial_hash), []).append((key, full_hash))
+		missing_sizes = {size for size, _ in missing_by_hash}
+
+		self.cursor.execute("SELECT DISTINCT f.folderpath FROM linkedfolder lf JOIN folder f USING(folder_id) ORDER BY f.folderpath;")
+		root_folders = []
+		for (folderpath,) in self.cursor.fetchall():
+			if not root_folders or os.path.commonpath([root_folders[-1], folderpath]) != root_folders[-1]: # Skip linked sub-folders
+				root_folders.append(folderpath)
+
+		self.cursor.execute("SELECT folder_id, filename, size, mtime_ns, partial_hash FROM filefingerprint;")
+		known_fingerprints = {(folder_id, filename): fingerprint for folder_id, filename, *fingerprint in self.cursor.fetchall()}
+		candidates, files_to_hash, folder_paths = [], [], {}
+		for root_folder in root_folders:
+			for folder_id, filename in self._iter_scanned_files(root_folder, **dict(scan_options, recursive=True)):
+				if (folder_id, filename) in missing_fingerprints:
+					continue
+				if folder_id not in folder_paths:
+					folder_paths[folder_id] = self._get_folder_path(folder_id)
+				file_path = os.path.join(folder_paths[folder_id], filename)
+				try:
+					stat = os.stat(file_path)
+				except OSError:
+					continue
+				if stat.st_size not in missing_sizes:
+					continue
+				known_fingerprint = known_fingerprints.get((folder_id, filename))
+				if known_fingerprint is not None and tuple(known_fingerprint[:2]) == (stat.st_size, stat.st_mtime_ns):
+					candidates.append(((folder_id, filename), (known_fingerprint[0], known_fingerprint[2])))
+				else:
+					files_to_hash.append(((folder_id, filename), file_path))
+		candidates += [(key, (fingerprint[0], fingerprint[2])) for key, fingerprint in self._fingerprint_files(files_to_hash)]
+
+		candidates_by_hash = {}
+		for key, fingerprint in candidates:
+			if fingerprint in missing_by_hash and not self._is_file_tagged(key): # Tagged files have their own identity
+				candidates_by_hash.setdefault(fingerprint, []).append(key)
+		moves = []
+		for fingerprint, candidate_keys in candidates_by_hash.items():
+			missing_files = missing_by_hash[fingerprint]
+			if len(candidate_keys) == 1 and len(missing_files) == 1 and missing_files[0][1] is None:
+				moves.append((missing_files[0][0], candidate_keys[0]))
+				continue
+			# Collision: only full hashes known for the missing files can tell the files apart
+			full_hashes = {}
+			candidate_paths = [(key, os.path.join(folder_paths[key[0]], key[1])) for key in candidate_keys]
+			for key, fingerprint in self._fingerprint_files(candidate_paths, full=True):
+				full_hashes.setdefault(fingerprint[3], []).append(key)
+			for missing_key, full_hash in missing_files:
+				if full_hash is not None and len(full_hashes.get(full_hash, [])) == 1:
+					moves.append((missing_key, full_hashes.pop(full_hash)[0]))
+		return moves, {key for key, _ in candidates}
+
+	def _is_file_tagged(self, key):
+		self.cursor.execute("SELECT 1 FROM filetag WHERE folder_id = ? AND filename = ? LIMIT 1;", key)
+		return self.cursor.fetchone() is not None
+
+	def _get_folder_path(self, folder_id):
+		self.cursor.execute("SELECT folderpath FROM folder WHERE folder_id = ?;", (folder_id,))
+		return self.cursor.fetchone()[0]
+
+	def relink_files(self, **scan_options):
+		"""Fingerprint the tagged files, then give the tags of the missing ones to the same files found in the linked folders"""
+		missing_files = self._update_tagged_fingerprints()
+		missing_fingerprints = {key: fingerprint for key, fingerprint in missing_files.items() if fingerprint is not None}
+		moves, compared_keys = self._find_moved_files(missing_fingerprints, scan_options) if missing_fingerprints else ([], set())
+		self._move_file_rows(moves)
+
+		# Fingerprints of untagged files are only kept while they can spare hashing the same candidates again
+		self.cursor.execute("""SELECT folder_id, filename FROM filefingerprint fp WHERE NOT EXISTS
+			(SELECT 1 FROM filetag ft WHERE ft.folder_id = fp.folder_id AND ft.filename = fp.filename);""")
+		self.cursor.executemany("DELETE FROM filefingerprint WHERE folder_id = ? AND filename = ?;",
+			[key for key in self.cursor.fetchall() if key not in compared_keys])
+		self.data = [(os.path.join(self._get_folder_path(old[0]), old[1]), os.path.join(self._get_folder_path(new[0]), new[1]))
+			for old, new in moves]
+		self.info = (f"{len(moves)} files relinked, {len(missing_files) - len(moves)} missing files not found"
+			f" ({len(missing_files) - len(missing_fingerprints)} without fingerprint)")
+
+	# WATCH: linked folders changes are applied as they happen
+	def _get_watch_root(self, watch, folderpath):
+		"""Return the linked folder watching the entries of `folderpath`, None if they are not watched"""
+		for root, scan_filter in watch["scan_filters"].items():
+			if folderpath == root:
+				return root
+			if scan_filter["recursive"] and folderpath.startswith(root + os.sep):
+				depth = folderpath[len(root):].count(os.sep)
+				if scan_filter["max_depth"] is None or depth <= scan_filter["max_depth"]:
+					return root
+		return None
 
-		self.cursor.executemany("INSERT INTO filetag VALUES(?, ?, ?);", cursor_data)
+	def _watch_folder(self, watch, root, folder_path):
+		"""Watch `folder_path` (and its sub-folders in recursive mode), return its scanned files"""
+		scan_filter = watch["scan_filters"][root]
+		watch["watcher"].add_folder(folder_path)
+		entries = []
+		for folderpath, name, is_folder in self.fs_reader.scan(folder_path, filetypes=scan_filter["filetypes"],
+				ignored=list(scan_filter["ignored"]), recursive=scan_filter["recursive"], exclude=scan_filter["exclude"]):
+			path = os.path.join(folderpath, name)
+			if is_folder and scan_filter["recursive"]:
+				if self._get_watch_root(watch, path) == root:
+					watch["watcher"].add_folder(path)
+			elif self._get_watch_root(watch, folderpath) == root:
+				entries.append(path)
+		return entries
+
+	def _tag_watched_entries(self, watch, root, paths):
+		rows = ((self._get_folder_id(os.path.dirname(path), create=True), os.path.basename(path), tag_id)
+			for path in paths for tag_id in watch["default_tags"][root])
+		return self._insert_filetag_rows(rows)
+
+	def _tag_new_entry(self, watch, path, is_folder):
+		"""Give the default tags of its linked folder to a new file, return the count of new file tags"""
+		root = self._get_watch_root(watch, os.path.dirname(path))
+		scan_filter = watch["scan_filters"].get(root)
+		if root is None or not self.fs_reader.is_entry_scanned(os.path.dirname(path), os.path.basename(path), is_folder, scan_filter):
+			return 0
+		paths = self._watch_folder(watch, root, path) if is_folder and scan_filter["recursive"] else [path]
+		return self._tag_watched_entries(watch, root, paths)
+
+	def _delete_file_rows(self, path, is_folder):
+		"""Delete the tags and the fingerprint of a deleted file, and of the files of a deleted folder"""
+		folder_id = self._get_folder_id(os.path.dirname(path))
+		generation = self._get_filetag_generation()
+		tag_ids = set()
+		if self.tag_index is not None:
+			self.cursor.execute("""SELECT DISTINCT ft.tag_id FROM filetag ft JOIN folder f USING(folder_id) WHERE (ft.folder_id = ? AND ft.filename = ?)
+				OR (? AND (f.folderpath = ? OR substr(f.folderpath, 1, ?) = ?));""",
+				(folder_id, os.path.basename(path), is_folder, path, len(path) + 1, path + os.sep))
+			tag_ids.update(tag_id for tag_id, in self.cursor)
+		for table in ("filetag", "filefingerprint"):
+			self.cursor.execute(f"DELETE FROM {table} WHERE folder_id = ? AND filename = ?;", (folder_id, os.path.basename(path)))
+			if is_folder:
+				self.cursor.execute(f"""DELETE FROM {table} WHERE folder_id IN (SELECT folder_id FROM folder
+					WHERE folderpath = ? OR substr(folderpath, 1, ?) = ?);""", (path, len(path) + 1, path + os.sep))
+		self._reload_tags_at_commit(tag_ids, generation)
 		self.should_commit = True
+		self._invalidate_file_caches()
+
+	def _move_folder_rows(self, folder_path, new_folder_path):
+		"""Give the rows of a moved folder and of its sub-folders to their new paths"""
+		generation = self._get_filetag_generation()
+		self.cursor.execute("SELECT folder_id, folderpath FROM folder WHERE folderpath = ? OR substr(folderpath, 1, ?) = ?;",
+			(folder_path, len(folder_path) + 1, folder_path + os.sep))
+		folders = self.cursor.fetchall()
+		tag_ids = set()
+		if self.tag_index is not None:
+			for folder_id, _ in folders:
+				self.cursor.execute("SELECT DISTINCT tag_id FROM filetag WHERE folder_id = ?;", (folder_id,))
+				tag_ids.update(tag_id for tag_id, in self.cursor)
+		for folder_id, folderpath in folders:
+			new_folderpath = new_folder_path + folderpath[len(folder_path):]
+			new_folder_id = self._get_folder_id(new_folderpath)
+			if new_folder_id is None:
+				self.cursor.execute("UPDATE folder SET folderpath = ? WHERE folder_id = ?;", (new_folderpath, folder_id))
+				continue
+			for table in ("filetag", "filefingerprint"): # Path already known: rows are merged into it
+				self.cursor.execute(f"UPDATE OR IGNORE {table} SET folder_id = ? WHERE folder_id = ?;", (new_folder_id, folder_id))
+				self.cursor.execute(f"DELETE FROM {table} WHERE folder_id = ?;", (folder_id,))
+		self.cursor.execute("UPDATE mtm_meta SET value = value + 1 WHERE key = 'filetag_generation';") # File paths changed
+		self._reload_tags_at_commit(tag_ids, generation)
+		self.should_commit = True
+		self._invalidate_file_caches()
+
+	def _apply_folder_events(self, watch, events):
+		"""Apply events to the database, in order, return counts of (tagged, moved, deleted) files"""
+		tagged_count, moved_count, deleted_count = 0, 0, 0
+		for kind, path, is_folder, extra in pair_moved_events(events):
+			if kind == "overflow": # Events lost: new files are found by a scan
+				tagged_count += sum(self._tag_watched_entries(watch, root, self._watch_folder(watch, root, root)) for root in watch["default_tags"])
+			elif kind == "created":
+				tagged_count += self._tag_new_entry(watch, path, is_folder)
+			elif kind == "deleted":
+				self._delete_file_rows(path, is_folder)
+				watch["watcher"].remove_folder(path)
+				deleted_count += 1
+			elif kind == "moved":
+				old_root, new_root = self._get_watch_root(watch, os.path.dirname(path)), self._get_watch_root(watch, os.path.dirname(extra))
+				self._move_file_rows([((self._get_folder_id(os.path.dirname(path)), os.path.basename(path)),
+					(self._get_folder_id(os.path.dirname(extra), create=True), os.path.basename(extra)))])
+				if is_folder:
+					self._move_folder_rows(path, extra)
+					watch["watcher"].rename_folder(path, extra)
+				moved_count += 1
+				new_tag_ids = watch["default_tags"].get(new_root, set()) - watch["default_tags"].get(old_root, set())
+				if new_tag_ids and not is_folder: # Moved to another linked folder
+					tagged_count += self._insert_filetag_rows([(self._get_folder_id(os.path.dirname(extra)), os.path.basename(extra), tag_id)
+						for tag_id in new_tag_ids])
+		return tagged_count, moved_count, deleted_count
 
+	def watch_linked_folders(self, poll_interval=None, filetype_filter=None, **scan_options):
+		"""Keep the database in sync with the linked folders until stopped: default tags on new files, moves and deletes"""
+		self.cursor.execute("SELECT f.folderpath, lf.default_tag_id FROM linkedfolder lf JOIN folder f USING(folder_id);")
+		default_tags = {}
+		for folderpath, tag_id in self.cursor.fetchall():
+			default_tags.setdefault(folderpath, set()).update([] if tag_id is None else [tag_id])
+		if not default_tags:
+			raise ValueError("No linked folder to watch, see `link folder`")
+
+		watcher = None
+		if poll_interval is None:
+			try:
+				watcher = InotifyWatcher()
+			except (OSError, AttributeError): # Not Linux, or no more inotify instance
+				pass
+		watch = {
+			"watcher": watcher or PollingWatcher(poll_interval or WATCH_POLL_INTERVAL),
+			"default_tags": default_tags,
+			"scan_filters": {root: self.fs_reader.get_scan_filter(root, filetype_filter, **scan_options) for root in default_tags},
+		}
+		tagged_count = sum(self._tag_watched_entries(watch, root, self._watch_folder(watch, root, root)) for root in default_tags)
+		self._app_commit() # Files added while not watching
+		signal.signal(signal.SIGTERM, lambda signum, frame: exit())
+		print(f"Watching {len(watch['watcher'].folders)} folders with {type(watch['watcher']).__name__}, {tagged_count} files tagged (Ctrl+C to stop)")
+		try:
+			while True:
+				events = watch["watcher"].read_events()
+				first_event_time = time.monotonic()
+				while events and time.monotonic() - first_event_time < WATCH_MAX_DELAY:
+					new_events = watch["watcher"].read_events(WATCH_DEBOUNCE)
+					if not new_events:
+						break
+					events += new_events
+				if not events:
+					continue
+				tagged_count, moved_count, deleted_count = self._apply_folder_events(watch, events)
+				self._app_commit()
+				self._app_progress(f"{tagged_count} files tagged, {moved_count} moved, {deleted_count} deleted")
+		except KeyboardInterrupt:
+			pass
+		finally:
+			watch["watcher"].close()
+
+	# EXPORT/IMPORT: whole database as a stream of records, see EXPORT FORMATS
+	def export_database(self, file_path):
+		"""Write collections, tags, linked folders and tagged files to `file_path`, format chosen by extension"""
+		with open(file_path, "wb") as export_file:
+			write_export_records(self._iter_export_records(), export_file, get_export_format(file_path))
+		self.info = f"Database exported to {file_path}"
+
+	def _iter_export_records(self):
+		yield {"type": "mtm", "version": EXPORT_VERSION}
+		cursor = self.db_connection.cursor() # Rows are read while records are written
+		try:
+			for collection_id, slug, name in cursor.execute("SELECT collection_id, slug, collection_name FROM collection ORDER BY collection_id;"):
+				yield {"type": "collection", "id": collection_id, "slug": slug, "name": name}
+			for tag_id, slug, name, collection_id in cursor.execute("SELECT tag_id, slug, tag_name, collection_id FROM tag ORDER BY tag_id;"):
+				yield {"type": "tag", "id": tag_id, "slug": slug, "name": name, "collection_id": collection_id}
+			for folder_id, folderpath in cursor.execute("SELECT folder_id, folderpath FROM folder ORDER BY folder_id;"):
+				yield {"type": "folder", "id": folder_id, "path": folderpath}
+			for folder_id, collection_id, default_tag_id in cursor.execute("SELECT folder_id, collection_id, default_tag_id FROM linkedfolder;"):
+				yield {"type": "linkedfolder", "folder_id": folder_id, "collection_id": collection_id, "default_tag_id": default_tag_id}
+			cursor.execute("SELECT folder_id, filename, group_concat(tag_id) FROM filetag GROUP BY folder_id, filename;")
+			file_count = 0
+			while rows := cursor.fetchmany(BATCH_SIZE):
+				for folder_id, filename, tag_ids in rows:
+					yield {"type": "file", "folder_id": folder_id, "filename": filename, "tag_ids": [int(tag_id) for tag_id in tag_ids.split(",")]}
+				file_count += len(rows)
+				self._app_progress(f"{file_count} files exported")
+		finally:
+			cursor.close()
+
+	def import_database(self, file_path, merge=False):
+		"""Load an export (`-` for stdin), ids are remapped by slug/path
+
+		Without `merge` the database must not hold any tag yet. File tags are bulk-loaded in one
+		transaction: filetag indexes and triggers are dropped during the load and created again after,
+		the filename index is rebuilt.
+		"""
+		import_file = stdin.buffer if file_path == "-" else open(file_path, "rb")
+		try:
+			self.db_connection.commit()
+			self.cursor.execute("BEGIN;")
+			if not merge:
+				self.cursor.execute("SELECT EXISTS (SELECT 1 FROM tag) OR EXISTS (SELECT 1 FROM collection);")
+				if self.cursor.fetchone()[0]:
+					raise ValueError("The database already holds tags, use --merge to add the imported ones")
+			file_count, inserted_count = self._import_records(read_export_records(import_file), merge)
+			self._app_commit()
+		except Exception:
+			self._app_rollback()
+			raise
+		finally:
+			if import_file is not stdin.buffer:
+				import_file.close()
+		if self.cache is not None:
+			self.cache.clear()
+		self.info = f"{file_count} files imported, {inserted_count} file tags added"
 
-	# APP
-	def _app_parse_entry(self, parameters):
-		"""Read parameters and launch the corresponding action"""
-		if len(parameters) == 1:
-			if parameters[0].lower() == "help":
-				print(APP_HELP)
-		elif len(parameters) == 2:
-			if parameters[0].lower() == "show":
-				if parameters[1].lower() == "collections":
-					self.get_all_collections()
-				elif parameters[1].lower() == "tags":
-					self.get_all_tags()
-				elif parameters[1].lower() == "folders":
-					self.get_folders_with_tagged_content()
-				elif parameters[1].lower() == "linked-folders":
-					self.get_linked_folders()
-		elif len(parameters) == 3:
-			if parameters[0].lower() == "create":
-				if parameters[1].lower() == "collection":
-					self.create_new_collection(parameters[2])
-				elif parameters[1].lower() == "tag":
-					self.create_new_tag(parameters[2])
-			elif parameters[0].lower() == "delete":
-				if parameters[1].lower() == "collection":
-					self.delete_collection(parameters[2])
-				elif parameters[1].lower() == "tag":
-					self.delete_tag(parameters[2])
-			elif parameters[0].lower() == "search" and parameters[1].lower() == "untagged-files":
-				self.get_untagged_file_for_folder(parameters[2])
-		elif len(parameters) == 4:
-			if parameters[0].lower() == "create":
-				if parameters[1].lower() == "tag":
-					self.create_new_tag(parameters[2], parameters[3])
-			elif parameters[0].lower() == "show":
-				if parameters[1].lower() == "collection":
-					if parameters[3].lower() == "tags":
-						self.get_all_tags_for_collection(parameters[2])
-				elif parameters[1].lower() == "tag":
-					if parameters[3].lower() == "files":
-						self.get_all_files_for_tag(tag_name=parameters[2])
-				elif parameters[1].lower() == "file":
-					if parameters[3].lower() == "tags":
-						self.get_all_tags_for_file(file_path=parameters[2])
-			elif parameters[0].lower() == "search":
-				if parameters[1].lower() == "file" and parameters[2].lower() == "with":
-					self.get_all_files_for_tags(tag_names=[parameters[3]])
-		elif len(parameters) == 5:
-			if parameters[0].lower() == "set":
-				if parameters[1].lower() == "collection":
-					if parameters[3].lower() == "tag":
-						self.assign_tag_to_collection(tag_name=parameters[4], collection_name=parameters[2])
-				elif parameters[1].lower() == "file":
-					if parameters[3].lower() == "tag":
-						if parameters[4] == "-i":
-							self.assign_tag_to_file_interractive(file_path=parameters[2])
-						else:
-							self.assign_tag_to_file(file_path=parameters[2], tag_name=parameters[4])
-				elif parameters[1].lower() == "folder":
-					if parameters[3].lower() == "tag":
-						if parameters[4].lower() == "-i":
-							self.tag_all_files_from_folder_interractive(folder_path=parameters[2])
-						else:
-							self.tag_all_files_from_folder(tag_name=parameters[4], folder_path=parameters[2])
-			elif parameters[0].lower() == "unset":
-				if parameters[1].lower() == "collection":
-					if parameters[3].lower() == "tag":
-						self.remove_tag_from_collection(tag_name=parameters[4], collection_name=parameters[2])
-				elif parameters[1].lower() == "file":
-					if parameters[3].lower() == "tag":
-						self.remove_tag_from_file(file_path=parameters[2], tag_name=parameters[4])
-			elif parameters[0].lower() == "show":
-				if parameters[1].lower() == "tag":
-					if parameters[3].lower() == "files":
-						self.get_all_files_for_tag(tag_name=parameters[2], folder_path_filter=parameters[4])
-			elif parameters[0].lower() == "search":
-				if parameters[1].lower() == "file" and parameters[2].lower() == "with":
-					self.get_all_files_for_tags(tag_names=parameters[3:])
-			elif parameters[0].lower() == "link":
-				if parameters[1].lower() == "folder" and parameters[3].lower() == "collection":
-					self.link_folder(folder_path=parameters[2], collection_name=parameters[4])
-			elif parameters[0].lower() == "copy":
-				if parameters[1].lower() == "tag" and parameters[3].lower() == "files":
-					self.copy_tag_files(tag_name=parameters[2], destination=parameters[4])
-			elif parameters[0].lower() == "move":
-				if parameters[1].lower() == "tag" and parameters[3].lower() == "files":
-					self.move_tag_files(tag_name=parameters[2], destination=parameters[4])
-		else: # more than 5 parameters
-			if parameters[0].lower() == "link" and parameters[1].lower() == "folder" and parameters[3].lower() == "collection" and parameters[5].lower() == "default-tag":
-				self.link_folder(folder_path=parameters[2], collection_name=parameters[4], default_tag=parameters[6])
-			elif parameters[0].lower() == "set" and parameters[1].lower() == "folder" and parameters[3].lower() == "tag":
-				self.tag_all_files_containing_word(tag_name=parameters[4], folder_path=parameters[2], word_filter=parameters[5])
-			elif parameters[0].lower() == "set" and parameters[1].lower() == "folder" and parameters[3].lower() == "files" and parameters[4].lower() == "tag":
-				if parameters[5].lower() == "-i":
-					self.tag_folder_files_interractive(folder_path=parameters[2])
-			elif parameters[0].lower() == "check" and parameters[1].lower() == "tag" and parameters[3].lower() == "files" and parameters[4].lower() == "contains-word":
-				self.check_tag_files_contains_word(tag_name=parameters[2], word=parameters[5])
-			elif parameters[0].lower() == "search":
-				if parameters[1].lower() == "file" and parameters[2].lower() == "with":
-					self.get_all_files_for_tags(tag_names=parameters[3:])
-				elif parameters[1].lower() == "file" and parameters[2].lower() == "with-id":
-					self.get_all_files_for_tags(tag_names=parameters[3:], is_id=True)
+	def _import_records(self, records, merge):
+		collection_ids, tag_ids, folder_ids = {None: None}, {None: None}, {}
+		generation = self._get_filetag_generation()
+		records = iter(records)
+		header = next(records, {})
+		if header.get("type") != "mtm" or header.get("version") != EXPORT_VERSION:
+			raise ValueError("Not an mtm export, or exported by an unsupported version")
+
+		record = next(records, None)
+		while record is not None and record["type"] != "file":
+			if record["type"] == "collection":
+				self.cursor.execute("INSERT INTO collection(slug, collection_name) VALUES(?, ?) ON CONFLICT DO NOTHING;", (record["slug"], record["name"],))
+				collection_ids[record["id"]] = self._get_collection_id(record["slug"])
+			elif record["type"] == "tag":
+				self.cursor.execute("INSERT INTO tag(slug, tag_name, collection_id) VALUES(?, ?, ?) ON CONFLICT DO NOTHING;",
+					(record["slug"], record["name"], collection_ids[record.get("collection_id")],))
+				tag_ids[record["id"]] = self._get_tag_id(record["slug"])
+			elif record["type"] == "folder":
+				folder_ids[record["id"]] = self._get_folder_id(record["path"], create=True)
+			elif record["type"] == "linkedfolder":
+				self.cursor.execute("INSERT OR IGNORE INTO linkedfolder(folder_id, collection_id, default_tag_id) VALUES(?, ?, ?);",
+					(folder_ids[record["folder_id"]], collection_ids[record["collection_id"]], tag_ids[record.get("default_tag_id")],))
+			record = next(records, None)
+
+		self.cursor.execute("""SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL
+			AND ((tbl_name = 'filetag' AND type IN ('index', 'trigger')) OR (tbl_name = 'taggedfile' AND type = 'trigger'));""")
+		deferred = self.cursor.fetchall()
+		for object_type, name, _ in deferred:
+			self.cursor.execute(f"DROP {object_type} {name};")
+		self.cursor.execute("SELECT coalesce(max(rowid), 0), count() FROM filetag;")
+		last_rowid, row_count_before = self.cursor.fetchone()
+
+		file_count = 0
+		def _filetag_rows():
+			nonlocal file_count
+			for file_record in chain([record], records) if record is not None else ():
+				folder_id = folder_ids[file_record["folder_id"]]
+				for tag_id in file_record["tag_ids"]:
+					yield (folder_id, file_record["filename"], tag_ids[tag_id])
+				file_count += 1
+
+		for batch in iter_batches(_filetag_rows(), BATCH_SIZE * 10):
+			self.cursor.executemany("INSERT INTO filetag(folder_id, filename, tag_id) VALUES(?, ?, ?);", batch)
+			self._app_progress(f"{file_count} files read")
+		if merge:
+			self._delete_duplicate_file_tags() # Rows already in the database are kept
+		self._app_progress("Creating indexes")
+		self.cursor.execute("INSERT OR IGNORE INTO taggedfile(folder_id, filename) SELECT DISTINCT folder_id, filename FROM filetag WHERE rowid > ?;", (last_rowid,))
+		if self._has_filename_index():
+			self.cursor.execute("INSERT INTO filename_fts(filename_fts) VALUES('rebuild');") # Faster than one insert by new name
+		for _, _, sql in deferred:
+			self.cursor.execute(sql)
+		self._app_progress("Counting tags")
+		self._rebuild_tag_stats()
+		self.cursor.execute("UPDATE mtm_meta SET value = value + 1 WHERE key = 'filetag_generation';")
+		self._reload_tags_at_commit([tag_id for tag_id in tag_ids.values() if tag_id is not None], generation)
+		self.cursor.execute("SELECT count() FROM filetag;")
+		return file_count, self.cursor.fetchone()[0] - row_count_before
+
+	# MAINTENANCE
+	def _delete_duplicate_file_tags(self):
+		"""Keep the first row of each (tag, folder, filename), in one set-based pass"""
+		self.cursor.execute("DELETE FROM filetag WHERE rowid NOT IN (SELECT min(rowid) FROM filetag GROUP BY tag_id, folder_id, filename);")
+		self._invalidate_file_caches()
+		return self.cursor.rowcount
+
+	def vacuum_duplicates(self):
+		"""Delete duplicated file tags then rebuild the database file to give back the free pages"""
+		self.cursor.execute("PRAGMA page_size;")
+		page_size = self.cursor.fetchone()[0]
+		self.cursor.execute("PRAGMA page_count;")
+		page_count_before = self.cursor.fetchone()[0]
+
+		deleted_count = self._delete_duplicate_file_tags()
+		self._app_commit()
+		self.cursor.execute("VACUUM;")
+		self.cursor.execute("PRAGMA page_count;")
+		freed_size = (page_count_before - self.cursor.fetchone()[0]) * page_size
+		self.info = f"{deleted_count} duplicated file tags deleted, {freed_size / 1024:.0f} KiB freed"
+
+	# DATABASE: the schema is upgraded in place, one `PRAGMA user_version` step after another
+	def _app_progress(self, message):
+		if self.on_progress is not None:
+			self.on_progress(message)
+
+	def _app_tag_files(self, file_paths, tag_names, remove=False):
+		"""Run `set/unset files <paths...> tags <tags...>`, `-` as only path reads NUL-separated paths from stdin"""
+		if file_paths == ["-"]:
+			file_paths = iter_nul_separated(stdin.buffer)
+		if remove:
+			self.remove_tags(file_paths, tag_names)
+		else:
+			self.assign_tags(file_paths, tag_names)
+
+	def _app_int_option(self, option_name, default=None):
+		return int(self.options[option_name][-1]) if option_name in self.options else default
+
+	def _app_scan_options(self):
+		return {
+			"filetype_filter": self.options.get("--filetype"),
+			"ignored": self.options.get("--ignore-filetype"),
+			"exclude": self.options.get("--exclude"),
+			"recursive": self.options.get("--recursive", False),
+			"max_depth": self._app_int_option("--max-depth"),
+		}
+
+	def _app_search_files(self, words, is_id=False):
+		"""Split `search file with/named` words between the tag expression and the scope keywords"""
+		scopes = {"in-collection": None, "in-folder": None, "named": None}
+		expression_words = []
+		position = 0
+		while position < len(words):
+			if words[position].lower() in scopes and position + 1 < len(words):
+				scopes[words[position].lower()] = words[position + 1]
+				position += 2
+			else:
+				expression_words.append(words[position])
+				position += 1
+		if expression_words[:1] == ["with"] and scopes["named"] is not None: # search file named <pattern> with <tags>
+			expression_words = expression_words[1:]
+		self.get_all_files_for_tags(tag_names=expression_words, is_id=is_id, collection_name=scopes["in-collection"],
+			folder_path=scopes["in-folder"], name_pattern=scopes["named"])
+
+	def _app_migrate_db(self):
+		migrations = (
+			self._app_create_db, # v1: normalized schema, imports tables of the untyped legacy schema
+			self._app_create_generation_counter, # v2: filetag changes counter, used to know if an index is stale
+			self._app_create_filetag_unique_index, # v3: one row by (tag, folder, filename), duplicates are deleted
+			self._app_create_transfer_journal, # v4: files of the running copy/move operations
+			self._app_create_file_fingerprint, # v5: content fingerprints, used to find moved files back
+			self._app_create_filename_index, # v6: tagged files with a trigram index of their names
+			self._app_create_covering_file_index, # v7: tag ids in the files index, tag counts of a folder tree read only the index
+			self._app_create_tag_stats, # v8: file counts by tag and by pair of tags, kept up to date by triggers
+		)
+		self.cursor.execute("PRAGMA user_version;")
+		current_version = self.cursor.fetchone()[0]
+		for version, migration in enumerate(migrations[current_version:], current_version + 1):
+			self.cursor.execute("BEGIN;")
+			try:
+				migration()
+				self.cursor.execute(f"PRAGMA user_version = {version};")
+				self.db_connection.commit()
+			except Exception:
+				self.db_connection.rollback()
+				raise
 
 	def _app_create_db(self):
-		self.cursor.execute("CREATE TABLE collection(collection_id, collection_name);")
-		self.cursor.execute("CREATE TABLE tag(tag_id, tag_name, collection_id);")
-		self.cursor.execute("CREATE TABLE filetag(folderpath, filename, tag_id);")
-		self.cursor.execute("CREATE TABLE linkedfolder(folderpath, collection_id, default_tag_id);")
-		self.db_connection.commit()
+		self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table';")
+		legacy_tables = {row[0] for row in self.cursor.fetchall()} & {"collection", "tag", "filetag", "linkedfolder"}
+		for table_name in legacy_tables:
+			self.cursor.execute(f"ALTER TABLE {table_name} RENAME TO legacy_{table_name};")
+
+		self.cursor.execute("CREATE TABLE collection(collection_id INTEGER PRIMARY KEY, slug TEXT NOT NULL UNIQUE, collection_name TEXT NOT NULL);")
+		self.cursor.execute("""CREATE TABLE tag(tag_id INTEGER PRIMARY KEY, slug TEXT NOT NULL UNIQUE, tag_name TEXT NOT NULL,
+			collection_id INTEGER REFERENCES collection(collection_id) ON DELETE SET NULL);""")
+		self.cursor.execute("CREATE TABLE folder(folder_id INTEGER PRIMARY KEY, folderpath TEXT NOT NULL UNIQUE);")
+		self.cursor.execute("""CREATE TABLE filetag(folder_id INTEGER NOT NULL REFERENCES folder(folder_id), filename TEXT NOT NULL,
+			tag_id INTEGER NOT NULL REFERENCES tag(tag_id) ON DELETE CASCADE);""")
+		self.cursor.execute("CREATE INDEX filetag_tag_index ON filetag(tag_id, folder_id, filename);")
+		self.cursor.execute("CREATE INDEX filetag_file_index ON filetag(folder_id, filename);")
+		self.cursor.execute("""CREATE TABLE linkedfolder(folder_id INTEGER NOT NULL REFERENCES folder(folder_id),
+			collection_id INTEGER NOT NULL REFERENCES collection(collection_id) ON DELETE CASCADE,
+			default_tag_id INTEGER REFERENCES tag(tag_id) ON DELETE SET NULL, PRIMARY KEY(folder_id, collection_id));""")
+		self.cursor.execute("CREATE INDEX tag_collection_index ON tag(collection_id);")
+
+		if len(legacy_tables) == 4:
+			self._app_import_legacy_db()
+
+	def _app_create_generation_counter(self):
+		self.cursor.execute("CREATE TABLE mtm_meta(key TEXT PRIMARY KEY, value) WITHOUT ROWID;")
+		self.cursor.execute("INSERT INTO mtm_meta VALUES('database_uid', lower(hex(randomblob(16)))), ('filetag_generation', 0);")
+		for event in ("INSERT", "UPDATE", "DELETE"):
+			self.cursor.execute(f"""CREATE TRIGGER filetag_generation_{event.lower()} AFTER {event} ON filetag
+				BEGIN UPDATE mtm_meta SET value = value + 1 WHERE key = 'filetag_generation'; END;""")
+
+	def _app_create_filetag_unique_index(self):
+		self._delete_duplicate_file_tags()
+		self.cursor.execute("DROP INDEX filetag_tag_index;")
+		self.cursor.execute("CREATE UNIQUE INDEX filetag_tag_index ON filetag(tag_id, folder_id, filename);")
+
+	def _app_create_transfer_journal(self):
+		self.cursor.execute("""CREATE TABLE transferjournal(transfer_key TEXT NOT NULL, folder_id INTEGER NOT NULL, filename TEXT NOT NULL,
+			is_done INTEGER NOT NULL DEFAULT 0, PRIMARY KEY(transfer_key, folder_id, filename)) WITHOUT ROWID;""")
+
+	def _app_create_file_fingerprint(self):
+		self.cursor.execute("""CREATE TABLE filefingerprint(folder_id INTEGER NOT NULL REFERENCES folder(folder_id), filename TEXT NOT NULL,
+			size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, partial_hash BLOB NOT NULL, full_hash BLOB,
+			PRIMARY KEY(folder_id, filename)) WITHOUT ROWID;""")
+		self.cursor.execute("CREATE INDEX filefingerprint_hash_index ON filefingerprint(size, partial_hash);")
+
+	def _app_create_filename_index(self):
+		"""One taggedfile row by tagged file, kept in sync with filetag by triggers, names indexed by trigrams"""
+		self.cursor.execute("""CREATE TABLE taggedfile(file_id INTEGER PRIMARY KEY, folder_id INTEGER NOT NULL REFERENCES folder(folder_id),
+			filename TEXT NOT NULL, UNIQUE(folder_id, filename));""")
+		self.cursor.execute("INSERT INTO taggedfile(folder_id, filename) SELECT DISTINCT folder_id, filename FROM filetag;")
+		self.cursor.execute("""CREATE TRIGGER taggedfile_insert AFTER INSERT ON filetag
+			BEGIN INSERT OR IGNORE INTO taggedfile(folder_id, filename) VALUES(new.folder_id, new.filename); END;""")
+		self.cursor.execute("""CREATE TRIGGER taggedfile_update AFTER UPDATE OF folder_id, filename ON filetag
+			BEGIN INSERT OR IGNORE INTO taggedfile(folder_id, filename) VALUES(new.folder_id, new.filename);
+			DELETE FROM taggedfile WHERE folder_id = old.folder_id AND filename = old.filename
+				AND NOT EXISTS (SELECT 1 FROM filetag WHERE folder_id = old.folder_id AND filename = old.filename); END;""")
+		self.cursor.execute("""CREATE TRIGGER taggedfile_delete AFTER DELETE ON filetag
+			BEGIN DELETE FROM taggedfile WHERE folder_id = old.folder_id AND filename = old.filename
+				AND NOT EXISTS (SELECT 1 FROM filetag WHERE folder_id = old.folder_id AND filename = old.filename); END;""")
+		try:
+			self.cursor.execute("CREATE VIRTUAL TABLE filename_fts USING fts5(filename, content='taggedfile', content_rowid='file_id', tokenize='trigram');")
+		except sqlite3.OperationalError: # SQLite without FTS5 or older than 3.34: names are searched by scanning taggedfile
+			return
+		self.cursor.execute("INSERT INTO filename_fts(filename_fts) VALUES('rebuild');")
+		self.cursor.execute("""CREATE TRIGGER filename_fts_insert AFTER INSERT ON taggedfile
+			BEGIN INSERT INTO filename_fts(rowid, filename) VALUES(new.file_id, new.filename); END;""")
+		self.cursor.execute("""CREATE TRIGGER filename_fts_delete AFTER DELETE ON taggedfile
+			BEGIN INSERT INTO filename_fts(filename_fts, rowid, filename) VALUES('delete', old.file_id, old.filename); END;""")
+
+	def _app_create_covering_file_index(self):
+		self.cursor.execute("DROP INDEX filetag_file_index;")
+		self.cursor.execute("CREATE INDEX filetag_file_index ON filetag(folder_id, filename, tag_id);")
+
+	def _app_create_tag_stats(self):
+		"""tagstat: files by tag, tagpair: files having both tags (one row in each direction), updated on each filetag change"""
+		self.cursor.execute("CREATE TABLE tagstat(tag_id INTEGER PRIMARY KEY REFERENCES tag(tag_id) ON DELETE CASCADE, file_count INTEGER NOT NULL);")
+		self.cursor.execute("""CREATE TABLE tagpair(tag_id INTEGER NOT NULL REFERENCES tag(tag_id) ON DELETE CASCADE, other_tag_id INTEGER NOT NULL,
+			file_count INTEGER NOT NULL, PRIMARY KEY(tag_id, other_tag_id)) WITHOUT ROWID;""")
+		self._rebuild_tag_stats()
+		add_file_tag = """INSERT INTO tagstat(tag_id, file_count) VALUES(new.tag_id, 1) ON CONFLICT DO UPDATE SET file_count = file_count + 1;
+			INSERT INTO tagpair(tag_id, other_tag_id, file_count)
+				SELECT new.tag_id, tag_id, 1 FROM filetag WHERE folder_id = new.folder_id AND filename = new.filename AND tag_id != new.tag_id
+				UNION ALL SELECT tag_id, new.tag_id, 1 FROM filetag WHERE folder_id = new.folder_id AND filename = new.filename AND tag_id != new.tag_id
+				ON CONFLICT DO UPDATE SET file_count = file_count + 1;"""
+		remove_file_tag = """UPDATE tagstat SET file_count = file_count - 1 WHERE tag_id = old.tag_id;
+			UPDATE tagpair SET file_count = file_count - 1 WHERE tag_id = old.tag_id
+				AND other_tag_id IN (SELECT tag_id FROM filetag WHERE folder_id = old.folder_id AND filename = old.filename AND tag_id != old.tag_id);
+			UPDATE tagpair SET file_count = file_count - 1 WHERE other_tag_id = old.tag_id
+				AND tag_id IN (SELECT tag_id FROM filetag WHERE folder_id = old.folder_id AND filename = old.filename AND tag_id != old.tag_id);"""
+		self.cursor.execute(f"CREATE TRIGGER tagstat_insert AFTER INSERT ON filetag BEGIN {add_file_tag} END;")
+		self.cursor.execute(f"CREATE TRIGGER tagstat_update AFTER UPDATE OF folder_id, filename, tag_id ON filetag BEGIN {remove_file_tag} {add_file_tag} END;")
+		self.cursor.execute(f"CREATE TRIGGER tagstat_delete AFTER DELETE ON filetag BEGIN {remove_file_tag} END;")
+
+	def _app_import_legacy_db(self):
+		"""Copy rows of the legacy tables, creating collections/tags only referenced by slug"""
+		self.db_connection.create_function("normalize_folder_path", 1, normalize_folder_path, deterministic=True)
+		queries = (
+			"INSERT OR IGNORE INTO collection(slug, collection_name) SELECT collection_id, collection_name FROM legacy_collection WHERE collection_id IS NOT NULL;",
+			"""INSERT OR IGNORE INTO collection(slug, collection_name) SELECT collection_id, collection_id FROM legacy_tag WHERE collection_id IS NOT NULL AND collection_id != ''
+				UNION SELECT collection_id, collection_id FROM legacy_linkedfolder WHERE collection_id IS NOT NULL;""",
+			"""INSERT OR IGNORE INTO tag(slug, tag_name, collection_id) SELECT lt.tag_id, coalesce(lt.tag_name, lt.tag_id), c.collection_id
+				FROM legacy_tag lt LEFT JOIN collection c ON c.slug = lt.collection_id WHERE lt.tag_id IS NOT NULL;""",
+			"""INSERT OR IGNORE INTO tag(slug, tag_name) SELECT tag_id, tag_id FROM legacy_filetag WHERE tag_id IS NOT NULL
+				UNION SELECT default_tag_id, default_tag_id FROM legacy_linkedfolder WHERE default_tag_id IS NOT NULL;""",
+			"""INSERT OR IGNORE INTO folder(folderpath) SELECT normalize_folder_path(folderpath) FROM legacy_filetag WHERE folderpath IS NOT NULL
+				UNION SELECT normalize_folder_path(folderpath) FROM legacy_linkedfolder WHERE folderpath IS NOT NULL;""",
+			"""INSERT INTO filetag(folder_id, filename, tag_id) SELECT f.folder_id, lft.filename, t.tag_id FROM legacy_filetag lft
+				JOIN folder f ON f.folderpath = normalize_folder_path(lft.folderpath) JOIN tag t ON t.slug = lft.tag_id
+				WHERE lft.filename IS NOT NULL ORDER BY t.tag_id, f.folder_id, lft.filename;""",
+			"""INSERT OR IGNORE INTO linkedfolder(folder_id, collection_id, default_tag_id) SELECT f.folder_id, c.collection_id, t.tag_id
+				FROM legacy_linkedfolder llf JOIN folder f ON f.folderpath = normalize_folder_path(llf.folderpath)
+				JOIN collection c ON c.slug = llf.collection_id LEFT JOIN tag t ON t.slug = llf.default_tag_id;""",
+		)
+		for query in queries:
+			self.cursor.execute(query)
+		for table_name in ("collection", "tag", "filetag", "linkedfolder"):
+			self.cursor.execute(f"DROP TABLE legacy_{table_name};")
 
 	def execute(self, args, print_result=True):
 		"""Can be used to directly receive command by GUI"""
 		if len(args) == 0:
 			print("Use `help`to list fonctions")
 			return
-		
-		self._app_parse_entry(args)
+		command_name = " ".join(word for word in args[:2] if not word.startswith("--"))
+		return self._app_measure(command_name, lambda: self._app_run_command(args), print_result)
+
+	def call(self, command_name, arguments=None, options=None, print_result=False):
+		"""Run a command of COMMANDS_BY_NAME with its arguments by name, without parsing a command line (GUI, server)"""
+		command = COMMANDS_BY_NAME[command_name]
+		return self._app_measure(command_name, lambda: self._app_call(command, arguments or {}, options or {}), print_result)
+
+	def _app_measure(self, command_name, run_command, print_result):
+		if METRICS_PATH is None:
+			return self._app_execute(run_command, print_result)
+
+		metrics = CommandMetrics(command_name)
+		changes_before = self.db_connection.total_changes
+		self.metrics = self.db_connection.metrics = self.fs_reader.metrics = metrics
+		self.db_connection.set_trace_callback(metrics.on_statement)
+		error = None
+		try:
+			return self._app_execute(run_command, print_result)
+		except Exception as e:
+			error = str(e)
+			raise
+		finally:
+			self.db_connection.set_trace_callback(None)
+			self.metrics = self.db_connection.metrics = self.fs_reader.metrics = None
+			write_metrics(metrics.get_record(self.db_connection.total_changes - changes_before, error))
+
+	def _app_execute(self, run_command, print_result):
+		metrics = self.metrics
+		run_command()
 		if self.should_commit:
+			with metrics.phase("commit") if metrics else nullcontext():
+				self._app_commit()
+		sql_duration = metrics.durations["sql"] if metrics else 0.0
+		with metrics.phase("output") if metrics else nullcontext():
+			if print_result and self.stream_results:
+				write_formatted_result(self.info, self.data, self.options["--format"][-1])
+			elif print_result:
+				print_command_result(self.info, self.data)
+			else:
+				result = list(self.data)
+		if metrics: # Rows streamed while printing are SQL time
+			metrics.durations["output"] -= metrics.durations["sql"] - sql_duration
+		return None if print_result else result
+
+	def _app_run_command(self, args):
+		"""Run one command line without committing"""
+		self.data, self.info = [], ""
+		metrics = self.metrics
+		with metrics.phase("parse") if metrics else nullcontext():
+			options, words = parse_command_options(args)
+			command, arguments = match_command(words)
+			arguments = get_absolute_arguments(command, arguments) # Stored paths do not depend on the folder of the command
+		self._app_call(command, arguments, options)
+
+	def _app_call(self, command, arguments, options):
+		"""Run one parsed command without committing"""
+		self.data, self.info = [], ""
+		output_format = options.get("--format", [None])[-1]
+		if output_format is not None and output_format not in OUTPUT_FORMATS:
+			raise ValueError(f"Unknown output format {output_format}, expected one of: {', '.join(OUTPUT_FORMATS)}")
+		self.options = options
+		self.stream_results = output_format is not None
+		command.handler(self, **arguments)
+
+	def _app_commit(self):
+		self.db_connection.commit()
+		if self.tag_index is not None and (self.tag_index.pending or self.tag_index.pending_reloads):
+			self.cursor.execute(QUERIES["filetag_generation"])
+			self.tag_index.apply_pending(self.cursor.fetchone()[0], self.cursor)
+
+	def _app_rollback(self):
+		self.db_connection.rollback()
+		if self.tag_index is not None:
+			self.tag_index.pending, self.tag_index.pending_reloads = [], []
+		if self.cache is not None:
+			self.cache.clear() # May hold results read in the rolled back transaction
+
+	# BATCH: commands read from a file, grouped into transactions
+	def run_batch(self, source, transaction_size=1000, atomic=False, continue_on_error=False):
+		"""Run the commands of `source` (one by line, `-` for stdin), committing every `transaction_size` commands
+
+		With `atomic`, all commands are committed at the end and an error rolls back everything.
+		Without `continue_on_error`, the batch stops at the first error. With both, all lines are run
+		to report all their errors, then everything is rolled back if one failed. A failed command
+		never leaves partial changes (each command runs in a savepoint).
+		"""
+		batch_file = stdin if source == "-" else open(source, encoding="utf-8")
+		batch_options, batch_stream_results = self.options, self.stream_results # Replaced by each command, restored for the output
+		command_count, error_count, commit_count, pending_count = 0, 0, 0, 0
+		start_time = time.perf_counter()
+		batch_data = []
+		try:
 			self.db_connection.commit()
-		if print_result:
-			if len(self.info):
-				print(self.info)
-			if len(self.data):
-				print(self.data)
-		else:
-			return list(self.data)
+			self.cursor.execute("BEGIN;")
+			for line_number, line in enumerate(batch_file, 1):
+				args = shlex.split(line, comments=True)
+				if not args:
+					continue
+				command_count += 1
+				self.cursor.execute("SAVEPOINT batch_command;")
+				try:
+					if args[0].lower() in BATCH_EXCLUDED_COMMANDS or "-i" in args:
+						raise ValueError(f"`{args[0]}` can not be used in batch")
+					self._app_run_command(args)
+					self.cursor.execute("RELEASE batch_command;")
+					batch_data.extend(self.data)
+				except Exception as e:
+					self.cursor.execute("ROLLBACK TO batch_command;")
+					self.cursor.execute("RELEASE batch_command;")
+					error_count += 1
+					print(f"Line {line_number}: {e}", file=stderr)
+					if not continue_on_error:
+						break
+					continue
+
+				pending_count += 1
+				if not atomic and pending_count >= transaction_size:
+					self._app_commit()
+					commit_count += 1
+					pending_count = 0
+					self._app_progress(f"{command_count} commands done")
+					self.cursor.execute("BEGIN;")
+			if atomic and error_count:
+				self._app_rollback()
+				pending_count = 0
+			if self.db_connection.in_transaction:
+				self._app_commit()
+				commit_count += 1 if pending_count else 0
+		finally:
+			self.options, self.stream_results = batch_options, batch_stream_results
+			if self.db_connection.in_transaction:
+				self._app_rollback()
+			if batch_file is not stdin:
+				batch_file.close()
+
+		duration = time.perf_counter() - start_time
+		rollback_message = ", all changes rolled back" if atomic and error_count else ""
+		self.data = batch_data
+		self.info = (f"{command_count} commands, {error_count} errors{rollback_message}, {commit_count} commits"
+			f" in {duration:.2f}s ({command_count / max(duration, 1e-9):.0f} commands/s)")
+
+	# SERVER: long-lived process running the commands sent by `send_command` on a Unix socket
+	def serve(self, socket_path=None):
+		socket_path = socket_path or get_socket_path(self.db_path)
+		if send_command(["show", "collections"], socket_path) is not None:
+			raise RuntimeError(f"A server is already listening on {socket_path}")
+		Path(socket_path).unlink(missing_ok=True) # Socket file left by a stopped server
+
+		if self.tag_index is None:
+			self.tag_index = TagIndex(f"{self.db_path}.tagidx") # Warm cache for searches
+			self.tag_index.load()
+		if self.cache is None:
+			self.cache = AppCache(self.db_connection)
+		self.fs_reader.snapshot_cache_size = self.fs_reader.snapshot_cache_size or SNAPSHOT_CACHE_SIZE # Repeated folder listings
+		signal.signal(signal.SIGTERM, lambda signum, frame: exit())
+		server = socketserver.UnixStreamServer(socket_path, CommandRequestHandler)
+		server.app = self
+		print(f"Listening on {socket_path} (Ctrl+C to stop)")
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			server.server_close()
+			Path(socket_path).unlink(missing_ok=True)
 
 	def quit(self):
 		try:
+			if self.tag_index is not None:
+				self.tag_index.save()
 			self.db_connection.close()
 		except Exception as e:
 			print(f"Fail to close DB: {e}")
 
 	def main(self, cli_args=None):
 		"""Run application in CLI mode: read one command and close DB"""
-		print("Minimalist Tag Manager v0.1a")
+		words = [arg.lower() for arg in cli_args or []]
+		is_formatted = "--format" in words or words[:1] == ["completion"] # Stdout is read by a program
+		print("Minimalist Tag Manager v0.1a", file=stderr if is_formatted else None)
+		self.on_progress = lambda message: print(message, file=stderr)
+		profile_path = parse_command_options(cli_args or [])[0].get("--profile", [None])[-1]
 		try:
-			self.execute(cli_args)
+			if profile_path is None:
+				self.execute(cli_args)
+			else:
+				profiler = cProfile.Profile()
+				try:
+					profiler.runcall(self.execute, cli_args)
+				finally:
+					profiler.dump_stats(profile_path)
+					print(f"Profile written to {profile_path} (python -m pstats {profile_path})", file=stderr)
 		except Exception as e:
-			print(e)
+			print(e, file=stderr if is_formatted else None)
 		finally:
 			self.quit()
 		exit()
 
 
+def parse_command_options(args):
+	"""Split `--option [<value>]` arguments from the command words"""
+	options, words = {}, []
+	position = 0
+	while position < len(args):
+		arg = args[position]
+		if arg.lower() in APP_FLAG_OPTIONS:
+			options[arg.lower()] = True
+		elif arg.lower() in APP_VALUE_OPTIONS and position + 1 < len(args):
+			options.setdefault(arg.lower(), []).append(args[position + 1])
+			position += 1
+		else:
+			words.append(arg)
+		position += 1
+	return options, words
+
+
+# COMMANDS: the CLI grammar, one entry by command, compiled once into a trie of words used to run
+# command lines in O(words), and to write `help` and the shell completion.
+# Usage: `keyword` (case-insensitive), `<value>`, `<values...>` (one or more words), `[...]` optional
+# ending part. Values are passed to the handler by name, names containing `path` are completed as files.
+class Command:
+	def __init__(self, usage, handler, note="", help_usage=None):
+		self.usage = usage
+		self.handler = handler # handler(app, **arguments)
+		self.note = note # Help text written after the usage
+		self.help_usage = help_usage or usage # When the handler reads more than the grammar (search scopes, options)
+		self.parts = parse_command_usage(usage)
+		self.name = " ".join(word for kind, word, group in self.parts if kind == "keyword" and group == 0)
+
+
+def parse_command_usage(usage) -> [(str, str, int)]:
+	"""Return the (kind, word or argument name, optional group or 0) of the words of a command usage"""
+	parts, group, group_count = [], 0, 0
+	for token in usage.split():
+		if token.startswith("["):
+			group_count += 1
+			group = group_count
+		word = token.strip("[]")
+		if word.startswith("<") and word.endswith("...>"):
+			parts.append(("values", word[1:-4], group))
+		elif word.startswith("<"):
+			parts.append(("value", word[1:-1], group))
+		else:
+			parts.append(("keyword", word.lower(), group))
+		if token.endswith("]"):
+			group = 0
+	return parts
+
+
+COMMAND_END, COMMAND_VALUE, COMMAND_VALUES, COMMAND_PATH = range(4) # Trie keys besides keywords, ints can not be typed words
+
+
+def is_path_argument(name):
+	return "path" in name
+
+
+def compile_commands(commands) -> dict:
+	"""Build the trie of `commands`: {keyword: node, COMMAND_VALUE: node, COMMAND_VALUES: node, COMMAND_END: (command, names)}
+
+	Each optional part adds one more ending, so `show folders [under <folder_path>]` ends after `folders`
+	and after `<folder_path>`.
+	"""
+	trie = {}
+	for command in commands:
+		parts = command.parts
+		first_optional = next((position for position, (_, _, group) in enumerate(parts) if group), len(parts))
+		if any(group == 0 for _, _, group in parts[first_optional:]):
+			raise ValueError(f"Optional parts must end the command `{command.usage}`")
+		ends = [first_optional] + [position for position in range(first_optional + 1, len(parts) + 1)
+			if position == len(parts) or parts[position][2] != parts[position - 1][2]]
+		for end in ends:
+			node = trie
+			for kind, word, _ in parts[:end]:
+				if kind != "keyword" and is_path_argument(word):
+					node[COMMAND_PATH] = True
+				node = node.setdefault(word if kind == "keyword" else COMMAND_VALUE if kind == "value" else COMMAND_VALUES, {})
+				if kind == "values" and is_path_argument(word):
+					node[COMMAND_PATH] = True # Following words can be more paths
+			if COMMAND_END in node:
+				raise ValueError(f"Commands `{node[COMMAND_END][0].usage}` and `{command.usage}` can not be told apart")
+			node[COMMAND_END] = (command, [word for kind, word, _ in parts[:end] if kind != "keyword"])
+	return trie
+
+
+def get_absolute_arguments(command, arguments):
+	"""Return `arguments` with absolute paths (path arguments, `in-folder` scopes of searches), `-` (stdin) is kept"""
+	def _absolute(path):
+		return path if path == "-" else os.path.abspath(path)
+
+	absolute_arguments = {}
+	for name, value in arguments.items():
+		if is_path_argument(name):
+			value = [_absolute(path) for path in value] if isinstance(value, list) else _absolute(value)
+		elif isinstance(value, list) and command.name.startswith("search file"):
+			value = [_absolute(word) if position and value[position - 1].lower() == "in-folder" else word
+				for position, word in enumerate(value)]
+		absolute_arguments[name] = value
+	return absolute_arguments
+
+
+def match_command(words) -> (Command, dict):
+	"""Return the command of the command line `words` and its arguments by name"""
+	match = _match_command_words(COMMAND_TRIE, words, [word.lower() for word in words], 0, ())
+	if match is None:
+		raise ValueError(f"Unknown command `{shlex.join(words)}`, use `help` to list commands")
+	(command, names), values = match
+	return command, dict(zip(names, values))
+
+
+def _match_command_words(node, words, keys, position, values):
+	"""Keywords are tried before values: in `show tag x files under`, `under` is read as the folder path once the keyword fails"""
+	if position == len(words):
+		return (node[COMMAND_END], values) if COMMAND_END in node else None
+	match = None
+	if keys[position] in node:
+		match = _match_command_words(node[keys[position]], words, keys, position + 1, values)
+	if match is None and COMMAND_VALUE in node:
+		match = _match_command_words(node[COMMAND_VALUE], words, keys, position + 1, values + (words[position],))
+	if match is None and COMMAND_VALUES in node: # Shortest list first, it ends before a keyword of the next node or at the end
+		next_node = node[COMMAND_VALUES]
+		for end in range(position + 1, len(words) + 1):
+			if end == len(words) and COMMAND_END in next_node or end < len(words) and keys[end] in next_node:
+				match = _match_command_words(next_node, words, keys, end, values + (words[position:end],))
+				if match is not None:
+					break
+	return match
+
+
+def get_help(command_sections) -> str:
+	sections = ["\n".join(f"{command.help_usage}{command.note}" for command in commands) for commands in command_sections]
+	return "\n" + "\n\n".join(sections + [APP_OPTIONS_HELP])
+
+
+def get_completion_script(trie, program_names=("mtm", "mtm.py", "./mtm.py")) -> str:
+	"""Bash completion of the command words (state machine of the trie), of file paths and of options"""
+	nodes = [trie]
+	transitions, value_states, loop_states, keywords, path_states = [], [], [], [], []
+	for state, node in enumerate(nodes): # Nodes are appended while they are numbered
+		node_keywords = [key for key in node if isinstance(key, str)]
+		for key in node_keywords:
+			transitions.append(f'["{state} {key}"]={len(nodes)}')
+			nodes.append(node[key])
+		for key in (COMMAND_VALUE, COMMAND_VALUES):
+			if key in node:
+				value_states.append(f"[{state}]={len(nodes)}")
+				if key == COMMAND_VALUES:
+					loop_states.append(f"[{len(nodes)}]=1")
+				nodes.append(node[key])
+				break
+		if node_keywords:
+			keywords.append(f'[{state}]="{" ".join(node_keywords)}"')
+		if node.get(COMMAND_PATH):
+			path_states.append(f"[{state}]=1")
+	options = " ".join(APP_FLAG_OPTIONS + APP_VALUE_OPTIONS)
+	return f"""# mtm bash completion: eval "$(./mtm.py completion)"
+declare -gA _mtm_next=({" ".join(transitions)})
+declare -ga _mtm_value=({" ".join(value_states)}) _mtm_loop=({" ".join(loop_states)})
+declare -ga _mtm_words=({" ".join(keywords)}) _mtm_paths=({" ".join(path_states)})
+_mtm_complete() {{
+	local state=0 word index skip=0 cur=${{COMP_WORDS[COMP_CWORD]}}
+	for ((index = 1; index < COMP_CWORD; index++)); do
+		word=${{COMP_WORDS[index],,}}
+		if ((skip)); then skip=0; continue; fi
+		case $word in
+			{"|".join(APP_VALUE_OPTIONS)}) skip=1; continue;;
+			--*) continue;;
+		esac
+		if [[ -n ${{_mtm_next["$state $word"]}} ]]; then state=${{_mtm_next["$state $word"]}}
+		elif [[ -n ${{_mtm_value[state]}} ]]; then state=${{_mtm_value[state]}}
+		elif [[ -z ${{_mtm_loop[state]}} ]]; then return
+		fi
+	done
+	if [[ $cur == --* ]]; then
+		COMPREPLY=($(compgen -W "{options}" -- "$cur"))
+		return
+	fi
+	COMPREPLY=($(compgen -W "${{_mtm_words[state]}}" -- "$cur"))
+	if [[ -n ${{_mtm_paths[state]}} ]]; then
+		compopt -o filenames
+		COMPREPLY+=($(compgen -f -- "$cur"))
+	fi
+}}
+complete -F _mtm_complete {" ".join(program_names)}"""
+
+
+COMMAND_SECTIONS = (
+	(
+		Command("create tag <tag_name> [<collection_name>]", App.create_new_tag),
+		Command("delete tag <tag_name>", App.delete_tag),
+		Command("create collection <collection_name>", App.create_new_collection),
+		Command("delete collection <collection_name>", App.delete_collection),
+		Command("show tags", App.get_all_tags),
+		Command("show collections", App.get_all_collections),
+		Command("set collection <collection_name> tag <tag_name>", App.assign_tag_to_collection),
+		Command("unset collection <collection_name> tag <tag_name>", App.remove_tag_from_collection),
+		Command("show collection <collection_name> tags", App.get_all_tags_for_collection),
+		Command("set file <file_path> tag <tag_name>", App.assign_tag_to_file),
+		Command("unset file <file_path> tag <tag_name>", App.remove_tag_from_file),
+		Command("set files <file_paths...> tags <tag_names...>", App._app_tag_files),
+		Command("unset files <file_paths...> tags <tag_names...>", partial(App._app_tag_files, remove=True),
+			note="\n  (`-` as file path reads NUL-separated paths from stdin: find . -name '*.mkv' -print0 | mtm set files - tags movies)"),
+		Command("show tag <tag_name> files [<folder_path>]",
+			lambda app, tag_name, folder_path=None: app.get_all_files_for_tag(tag_name, folder_path_filter=folder_path)),
+		Command("show tag <tag_name> files under <folder_path>",
+			lambda app, tag_name, folder_path: app.get_all_files_for_tag(tag_name, subtree_path=folder_path),
+			note="  (files of the whole folder tree)"),
+		Command("show file <file_path> tags", App.get_all_tags_for_file),
+		Command("show folders [under <folder_path>]", lambda app, folder_path=None: app.get_folders_with_tagged_content(subtree_path=folder_path)),
+		Command("show folder-tree [<folder_path>]", lambda app, folder_path=None: app.get_tagged_folder_tree(subtree_path=folder_path),
+			note="  (topmost tagged folders, with the count of tagged folders of their tree)"),
+		Command("show tags under <folder_path>", App.get_tag_counts_for_folder, note="  (count of files by tag in the folder tree)"),
+		Command("show tag-counts [<collection_name>]", App.get_tag_counts, note="  (count of files by tag)"),
+		Command("show collection-counts", App.get_collection_counts, note="  (count of tags and of file tags by collection)"),
+		Command("search facets with <tag_names...>", App.get_refine_counts,
+			note="  (other tags of the matching files, with the count of files left if added)"),
+		Command("search file with <tag_names...>", lambda app, tag_names: app._app_search_files(tag_names),
+			help_usage="search file with <tag_name> [<tag_name>, ...] [in-collection <collection_name>] [in-folder <folder_path>]"),
+		Command("search file with-id <tag_ids...>", lambda app, tag_ids: app._app_search_files(tag_ids, is_id=True),
+			help_usage="search file with-id <tag_id> [<tag_id>, ...] [in-collection <collection_name>] [in-folder <folder_path>]"),
+		Command("search file named <pattern> [<words...>]",
+			lambda app, pattern, words=(): app._app_search_files(["named", pattern, *words]),
+			help_usage="search file named <pattern> [with <tag_name> [<tag_name>, ...]] [in-collection <collection_name>] [in-folder <folder_path>]",
+			note="""
+  (tags can be combined with AND, OR, NOT and parentheses, each one a separate word (quoted in a shell):
+   holidays AND '(' brussels OR paris ')' AND NOT vo, tags separated by spaces only are combined with AND;
+   names of tagged files are matched case-insensitive, on any part of the name, or on the whole name
+   with `*`/`?` wildcards: "*.mkv")"""),
+		Command("link folder <folder_path> collection <collection_name> [default-tag <default_tag>]", App.link_folder,
+			help_usage="link folder <folder_path> collection <collection_name> [default-tag <tag_name>]"),
+		Command("show linked-folders", App.get_linked_folders),
+		Command("show cache", App.get_cache_stats, note="  (hits/misses of the lookup caches of a running server)"),
+		Command("vacuum duplicates", App.vacuum_duplicates),
+		Command("watch", lambda app: app.watch_linked_folders(poll_interval=float(app.options["--poll-interval"][-1])
+			if "--poll-interval" in app.options else None, **app._app_scan_options()),
+			help_usage="watch [--poll-interval <seconds>]", note="""  (keep the database in sync with the linked folders: default tag on new files,
+  tags follow renamed/moved files, deleted files are untagged; inotify is used unless a poll interval is set)"""),
+		Command("relink", lambda app: app.relink_files(**app._app_scan_options()),
+			note="""  (find tagged files renamed/moved under the linked folders by content, and move their tags to them;
+  tagged files are fingerprinted on each run, files not changed since the last run are not hashed again)"""),
+		Command("export <file_path>", App.export_database, note="""  (collections, tags, linked folders and tagged files; NDJSON, CSV with a .csv extension,
+  compressed columns with a .mtmb extension)"""),
+		Command("import <file_path>", lambda app, file_path: app.import_database(file_path, merge=app.options.get("--merge", False)),
+			help_usage="import <file_path|-> [--merge]",
+			note="  (load an export into an empty database, or add its tags to the current ones with --merge)"),
+		Command("serve [<socket_path>]", App.serve, note="  (keep database open and run commands sent by the CLI on a Unix socket)"),
+		Command("batch <file_path>", lambda app, file_path: app.run_batch(file_path, transaction_size=app._app_int_option("--transaction-size", 1000),
+			atomic=app.options.get("--atomic", False), continue_on_error=app.options.get("--continue-on-error", False)),
+			help_usage="batch <file_path|-> [--transaction-size <count>] [--atomic] [--continue-on-error]",
+			note="""
+  (run the commands of a file or stdin, one by line, `#` for comments; with --atomic, an error rolls back
+  all commands, with --continue-on-error too once all lines are run to report all errors)"""),
+		Command("search untagged-files <folder_path>",
+			lambda app, folder_path: app.get_untagged_file_for_folder(folder_path, **app._app_scan_options())),
+		Command("set folder <folder_path> tag <tag_name> [<word_in_name>]",
+			lambda app, folder_path, tag_name, word_in_name=None: app.tag_all_files_from_folder(tag_name, folder_path, **app._app_scan_options())
+			if word_in_name is None else app.tag_all_files_containing_word(tag_name, folder_path, word_in_name, **app._app_scan_options())),
+		Command("set folder <folder_path> tags <tag_names...>",
+			lambda app, folder_path, tag_names: app.assign_tags_to_folder(tag_names, folder_path, **app._app_scan_options())),
+	),
+	(
+		Command("set file <file_path> tag -i", App.assign_tag_to_file_interractive, note="  (interactive script mode, <tag_name> is asked after)"),
+		Command("set folder <folder_path> tag -i", App.tag_all_files_from_folder_interractive,
+			note="  (interactive script mode, <tag_name> is asked after)"),
+		Command("set folder <folder_path> files tag -i", App.tag_folder_files_interractive,
+			note="  (interactive mode, <tag_name> is asked for each file)"),
+	),
+	(
+		Command("copy tag <tag_name> files <destination_path>",
+			lambda app, tag_name, destination_path: app.copy_tag_files(tag_name, destination_path, workers=app._app_int_option("--workers")),
+			help_usage="copy tag <tag_name> files <destination_path> [--workers <count>]"),
+		Command("move tag <tag_name> files <destination_path>",
+			lambda app, tag_name, destination_path: app.move_tag_files(tag_name, destination_path, workers=app._app_int_option("--workers")),
+			help_usage="move tag <tag_name> files <destination_path> [--workers <count>]",
+			note="\n  (an interrupted copy/move is resumed by running the same command, moved files keep their tags)"),
+		Command("check tag <tag_name> files contains-word <word>", App.check_tag_files_contains_word),
+		Command("help", lambda app: print(APP_HELP)),
+		Command("completion", lambda app: print(get_completion_script(COMMAND_TRIE)),
+			note='  (bash completion of commands, options and paths: eval "$(./mtm.py completion)")'),
+	),
+)
+COMMANDS = tuple(chain.from_iterable(COMMAND_SECTIONS))
+COMMANDS_BY_NAME = {command.name: command for command in COMMANDS}
+COMMAND_TRIE = compile_commands(COMMANDS)
+APP_HELP = get_help(COMMAND_SECTIONS)
+
+
+class CommandRequestHandler(socketserver.StreamRequestHandler):
+	"""Read one JSON command by line: {"args": [...]}, answer {"info": ..., "data": [...]} or {"error": ...}
+
+	A command already parsed is sent as {"command": <COMMANDS_BY_NAME key>, "arguments": {...}, "options": {...}}.
+	Progress messages of long commands are sent before the answer as {"progress": ...} lines.
+	"""
+
+	def handle(self):
+		app = self.server.app
+		app.on_progress = lambda message: self._send({"progress": message})
+		for line in self.rfile:
+			try:
+				message = json.loads(line)
+				if "command" in message:
+					data = app.call(message["command"], message.get("arguments"), message.get("options"))
+				else:
+					data = app.execute(message["args"], print_result=False)
+				response = {"info": app.info, "data": data or []}
+			except Exception as e:
+				app._app_rollback()
+				response = {"error": str(e)}
+			self._send(response)
+		app.on_progress = None
+
+	def _send(self, message):
+		self.wfile.write(json.dumps(message).encode() + b"\n")
+
+
+def send_command(args, socket_path=None, on_progress=None):
+	"""Run `args` in the `mtm serve` process listening on `socket_path`, None if no server is listening
+
+	`args` are the words of a command line, or a parsed command {"command": ..., "arguments": ..., "options": ...}.
+	"""
+	if not hasattr(socket, "AF_UNIX"):
+		return None
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+		try:
+			client.connect(socket_path or get_socket_path())
+		except OSError:
+			return None
+		client.sendall(json.dumps(args if isinstance(args, dict) else {"args": args}).encode() + b"\n")
+		for line in client.makefile("r", encoding="utf-8"):
+			message = json.loads(line)
+			if "progress" not in message:
+				message["data"] = [tuple(row) if isinstance(row, list) else row for row in message.get("data", [])]
+				return message
+			if on_progress is not None:
+				on_progress(message["progress"])
+	return None
+
+
+def print_command_result(info, data):
+	if len(info):
+		print(info)
+	if len(data):
+		print(data)
+
+
+def write_metrics(record, metrics_path=None):
+	"""Append one metrics record to the MTM_METRICS file, a failure to write it never fails the command"""
+	try:
+		with open(metrics_path or METRICS_PATH, "a", encoding="utf-8") as metrics_file:
+			metrics_file.write(json.dumps(record) + "\n")
+	except OSError as e:
+		print(f"Fail to write metrics: {e}", file=stderr)
+
+
+def write_formatted_result(info, rows, output_format, output=None):
+	"""Write `rows` one by one as they are read, `info` goes to stderr"""
+	output = output or stdout
+	if len(info):
+		print(info, file=stderr)
+	if output_format == "json":
+		output.write("[")
+		for position, row in enumerate(rows):
+			output.write(("," if position else "") + "\n" + json.dumps(row, ensure_ascii=False))
+		output.write("\n]\n")
+	elif output_format == "ndjson":
+		for row in rows:
+			output.write(json.dumps(row, ensure_ascii=False) + "\n")
+	elif output_format == "tsv":
+		for row in rows:
+			values = row if isinstance(row, (tuple, list)) else (row,)
+			output.write("\t".join("" if value is None else str(value).translate(TSV_ESCAPES) for value in values) + "\n")
+	elif output_format == "paths0": # Files as full paths, for `xargs -0`
+		for row in rows:
+			if isinstance(row, str):
+				output.write(row + "\0")
+			elif isinstance(row, (tuple, list)) and len(row) == 2 and all(isinstance(value, str) for value in row):
+				output.write(os.path.join(*row) + "\0")
+			else:
+				raise ValueError("--format paths0 only writes lists of files, use json, ndjson or tsv for this command")
+	output.flush()
+
+
+def get_client_request(cli_args):
+	"""Parse the command line for the server, with absolute paths as the server runs in another folder"""
+	options, words = parse_command_options(cli_args)
+	try:
+		command, arguments = match_command(words)
+	except ValueError:
+		return cli_args # The server answers the error
+	return {"command": command.name, "arguments": get_absolute_arguments(command, arguments), "options": options}
+
+
+def run_client(cli_args):
+	"""Send the CLI command to a running server, return False if it must run in this process
+
+	Commands with `--format` run in this process, so their rows are streamed from the database, and
+	commands with `--profile` so the profile covers their work.
+	"""
+	if not cli_args or cli_args[0].lower() in ("help", "completion", "serve", "batch", "watch", "export", "import") or "-i" in cli_args or "-" in cli_args:
+		return False
+	if {"--format", "--profile"} & {arg.lower() for arg in cli_args}:
+		return False
+	response = send_command(get_client_request(cli_args), on_progress=lambda message: print(message, file=stderr))
+	if response is None:
+		return False
+	print("Minimalist Tag Manager v0.1a")
+	if "error" in response:
+		print(response["error"])
+	else:
+		print_command_result(response["info"], response["data"])
+	return True
+
+
 if __name__ == "__main__":
-	App().main(argv[1:])
\ No newline at end of file
+	if not run_client(argv[1:]):
+		App().main(argv[1:])
\ No newline at end of file
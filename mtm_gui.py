@@ -4,15 +4,20 @@ from tkinter import simpledialog, Menu, messagebox, filedialog
 import ttkbootstrap as ttk
 from ttkbootstrap import constants as ttkbconsts
 from functools import partial
+import queue
 import subprocess
+import threading
 from pathlib import Path
 
-from mtm import App, create_id_from_label
+from mtm import App
 
 
 MAX_ITEMS_BY_ROW = 5
 MAX_FILENAME_LEN = 36
 DEFAULT_VIEW = "VIEW_COLUMN"
+FILE_GRID_ROWS = 12 # Rows of buttons of the file grid, recycled while scrolling
+FILE_GRID_PAGE_SIZE = 1000 # Files read from the core app at once, when the grid is scrolled near the last read file
+TASK_POLL_DELAY = 50 # ms between two reads of the background task results by the Tk loop
 
 
 class RightMenuType(Enum):
@@ -22,10 +27,191 @@ class RightMenuType(Enum):
     TAG = "TAG"
 
 
+class TaskCancelled(Exception):
+    pass
+
+
+class Task:
+    def __init__(self, function, on_done=None, group=None):
+        self.function = function
+        self.on_done = on_done
+        self.group = group
+        self.is_cancelled = False
+
+
+class TaskRunner:
+    """Run core App calls in a worker thread, so long operations do not freeze the Tk loop
+
+    The worker has its own App (an SQLite connection belongs to one thread, WAL lets both connections
+    work together). Results are given to the `on_done` callbacks in the Tk thread, by polling the result
+    queue with `root.after`. A new task of a group cancels the previous tasks of the same group.
+    """
+
+    def __init__(self, root, on_progress, on_error):
+        self.root = root
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.lock = threading.Lock() # Protects running_task, so a cancellation never interrupts the next task
+        self.running_task = None
+        self.app = None
+        threading.Thread(target=self._work, daemon=True).start()
+        self.root.after(TASK_POLL_DELAY, self._poll_results)
+
+    def submit(self, function, on_done=None, group=None) -> Task:
+        """Run `function(app)` in the worker thread, then `on_done(result)` in the Tk thread"""
+        if group is not None:
+            self.cancel(group)
+        task = Task(function, on_done, group)
+        self.tasks.put(task)
+        return task
+
+    def cancel(self, group=None):
+        """Cancel the tasks of `group` (all tasks if None): waiting ones are skipped, the running one is stopped"""
+        with self.tasks.mutex:
+            waiting_tasks = list(self.tasks.queue)
+        with self.lock:
+            for task in waiting_tasks + [self.running_task]:
+                if task is not None and (group is None or task.group == group):
+                    task.is_cancelled = True
+            if self.running_task is not None and self.running_task.is_cancelled:
+                self.app.db_connection.interrupt() # SQL statement stopped now, Python loops on their next progress
+
+    def stop(self):
+        self.cancel()
+        self.tasks.put(None)
+
+    def _work(self):
+        self.app = App(use_tag_index=True, use_snapshot_cache=True, use_cache=True)
+        self.app.on_progress = self._on_app_progress
+        while (task := self.tasks.get()) is not None:
+            with self.lock:
+                if task.is_cancelled:
+                    continue
+                self.running_task = task
+            try:
+                result, error = task.function(self.app), None
+            except Exception as e:
+                self.app._app_rollback()
+                result, error = None, e
+            with self.lock:
+                self.running_task = None
+            self.results.put((task, result, error))
+        self.app.quit()
+
+    def _on_app_progress(self, message):
+        if self.running_task is not None and self.running_task.is_cancelled:
+            raise TaskCancelled("Cancelled")
+        self.results.put((None, message, None))
+
+    def _poll_results(self):
+        while True:
+            try:
+                task, result, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if task is None:
+                self.on_progress(result)
+            elif task.is_cancelled:
+                self.on_progress("Cancelled")
+            elif error is not None:
+                self.on_error(error)
+            elif task.on_done is not None:
+                task.on_done(result)
+        self.root.after(TASK_POLL_DELAY, self._poll_results)
+
+
+class FileGrid:
+    """Virtualized grid of file/folder buttons: only the visible rows have buttons, reused while scrolling
+
+    Items are (path, (name, is_folder)). After the given items, pages are asked to `read_page(on_page)` only
+    when the grid is scrolled near the last read item: showing 100k files only reads and draws the first ones.
+    """
+
+    def __init__(self, parent, on_select_file, on_select_folder, on_context_menu):
+        self.frame = ttk.Frame(parent)
+        self.on_select_file = on_select_file
+        self.on_select_folder = on_select_folder
+        self.items = []
+        self.read_page = None
+        self.is_reading = False
+        self.first_row = 0
+
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.grid(column=MAX_ITEMS_BY_ROW + 1, row=1, rowspan=FILE_GRID_ROWS, sticky=(ttkbconsts.N, ttkbconsts.S))
+        self.buttons = []
+        for cell in range(FILE_GRID_ROWS * MAX_ITEMS_BY_ROW):
+            button = ttk.Button(self.frame, command=partial(self._on_click, cell))
+            button.grid(column=cell % MAX_ITEMS_BY_ROW + 1, row=cell // MAX_ITEMS_BY_ROW + 1, sticky=ttkbconsts.W, padx=3, pady=3)
+            button.bind("<Button-3>", on_context_menu)
+            self.buttons.append(button)
+        for widget in [self.frame] + self.buttons:
+            for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"): # Windows/Mac, then Linux
+                widget.bind(sequence, self._on_mouse_wheel)
+
+    def set_items(self, items=(), read_page=None):
+        """Show `items`, then the pages given by `read_page(on_page)`, which calls `on_page(None)` after the last page"""
+        self.items, self.read_page, self.is_reading, self.first_row = list(items), read_page, False, 0
+        self.scroll_to(0)
+
+    def _get_row_count(self):
+        return -(-len(self.items) // MAX_ITEMS_BY_ROW)
+
+    def _read_rows(self, row_count):
+        """Ask the next page if less than `row_count` rows are read"""
+        if self.read_page is not None and not self.is_reading and self._get_row_count() < row_count:
+            self.is_reading = True
+            self.read_page(partial(self._on_page, self.read_page))
+
+    def _on_page(self, read_page, page):
+        if read_page is not self.read_page: # Page of the previous items
+            return
+        self.is_reading = False
+        if page is None:
+            self.read_page = None
+        else:
+            self.items += page
+        self.scroll_to(self.first_row)
+
+    def scroll_to(self, first_row):
+        self._read_rows(first_row + 2 * FILE_GRID_ROWS) # One screen ahead
+        self.first_row = max(0, min(first_row, self._get_row_count() - FILE_GRID_ROWS))
+
+        first_item = self.first_row * MAX_ITEMS_BY_ROW
+        for cell, button in enumerate(self.buttons):
+            if first_item + cell < len(self.items):
+                name, is_folder = self.items[first_item + cell][1]
+                button.configure(text=name[:MAX_FILENAME_LEN], bootstyle="solid secondary" if is_folder else "solid light")
+                button.grid()
+            else:
+                button.grid_remove()
+        row_count = max(self._get_row_count(), 1) # Read rows only: the scrollbar grows while pages are read
+        self.scrollbar.set(self.first_row / row_count, min(1, (self.first_row + FILE_GRID_ROWS) / row_count))
+
+    def _on_click(self, cell):
+        item_path, (_, is_folder) = self.items[self.first_row * MAX_ITEMS_BY_ROW + cell]
+        if is_folder:
+            self.on_select_folder(item_path)
+        else:
+            self.on_select_file(item_path)
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(value) * self._get_row_count()))
+        elif action == "scroll":
+            self.scroll_to(self.first_row + int(value) * (FILE_GRID_ROWS if unit == "pages" else 1))
+
+    def _on_mouse_wheel(self, event):
+        step = 3 if event.num == 5 or event.delta < 0 else -3
+        self.scroll_to(self.first_row + step)
+
+
 class GraphicalApp:
     def __init__(self):
         self.selector_frame = None
         self.filesystem_frame = None
+        self.file_grid = None
         self.fs_context_menu = None
         self.fs_rigth_menu_frame = None
         self.fs_right_menu_type = RightMenuType.UNSET
@@ -36,48 +222,55 @@ class GraphicalApp:
         self.selected_filesystem_folder_path:str = None
         self.selected_filesystem_file_path:str = None
         
-        self.core_app = App()
-        self.fs_reader = self.core_app.fs_reader
-
-        # Cache
-        self.my_collections = {}
-        self.my_tags = {} # Used to display anmes or when the collection is unknow (show file tags)
-        self.tags_by_collection = {}
-        data_collections = self._app_execute(command_args=["show", "collections"])
-        for d in data_collections:
-            self.my_collections[d[0]] = d[1]
-            # Init tags, creating empty dicts for each collection 
-            self.tags_by_collection[d[0]] = {}
-
-        data_tags = self._app_execute(command_args=["show", "tags"])
-        for tid, tname, tcollection in data_tags:
-            try:
-                self.my_tags[tid] = tname
-                self.tags_by_collection[tcollection][tid] = tname
-            except KeyError:
-                pass # Skip tag for undefined collection
+        self.core_app = App(use_cache=True) # Short commands, long ones run in the task runner with its own App
+        self.task_runner = None
+        self.status_label = None
+        self.tagged_files_pages = None # (search, pages iterator) read in the task runner thread
 
-        data_folders = self._app_execute(command_args=["show", "folders"])
-        self.my_tagged_folders = {d[0]: (Path(d[0]).name, True) for d in data_folders}
+    # Lookups are read through the cache of the core app, invalidated by its writes and by other processes commits
+    def _get_collections(self) -> dict:
+        return dict(self._app_execute("show collections") or [])
 
-        self.my_linked_folders = {}
-        data_link_folders = self._app_execute(command_args=["show", "linked-folders"])
-        for linked_folder in data_link_folders:
-            self.my_linked_folders[linked_folder[0]] = (linked_folder[1], linked_folder[2]) # Collection_id, default_tag
+    def _get_all_tags(self) -> dict:
+        """Names of all tags, used when the collection is unknown (show file tags)"""
+        return {tid: tname for tid, tname, _ in self._app_execute("show tags") or []}
 
     def _get_tags(self):
         if self.selected_collection is not None:
-            return self.tags_by_collection[self.selected_collection[0]]
+            return dict(self._app_execute("show collection tags", collection_name=self.selected_collection[1]) or [])
         return {}
 
-    def _app_execute(self, command_args:[]):
+    def _get_tagged_folders(self) -> dict:
+        """Topmost tagged folders, the count of tagged folders of their tree is shown when they hold more than one"""
+        return {folder_path: (Path(folder_path).name if count == 1 else f"{Path(folder_path).name} ({count})", True)
+            for folder_path, count in self._app_execute("show folder-tree") or []}
+
+    def _app_execute(self, command_name, **arguments):
+        """Run a command of COMMANDS_BY_NAME with its arguments by name, no command line is parsed"""
         try:
-            #print("DEBUG CMD: {}".format(" ".join(command_args)))
-            return self.core_app.execute(command_args, print_result=False)
+            return self.core_app.call(command_name, arguments)
         except Exception as e:
             messagebox.showerror(message=str(e))
             return
 
+    def _app_execute_in_background(self, command_name, arguments, on_done=None, group=None):
+        """Run a command in the task runner, `on_done(data)` is called when it is done"""
+        def _done(result):
+            data, info = result
+            self._show_status(info)
+            if on_done is not None:
+                on_done(data)
+
+        self._show_status("Running...")
+        self.task_runner.submit(lambda app: (app.call(command_name, arguments), app.info), _done, group)
+
+    def _show_status(self, message):
+        self.status_label.configure(text=message)
+
+    def _show_task_error(self, error):
+        self._show_status("")
+        messagebox.showerror(message=str(error))
+
     def launch_action(self, action_name, *args):
         # MAIN MENU ACTIONS
         if action_name == "HOME":
@@ -105,9 +298,12 @@ class GraphicalApp:
             self.action_tag_all_files()
         elif action_name == "SEARCH_UNTAGGED":
             self.selected_tags = []
-            untagged_files = self._app_execute(command_args=["search", "untagged-files", self.selected_filesystem_folder_path])
-            untagged_dict = {f"{self.selected_filesystem_folder_path}/{filename}": (filename, False) for filename in untagged_files}
-            self._load_filesystem_frame(data=untagged_dict)
+            folder_path = self.selected_filesystem_folder_path
+
+            def _show_untagged_files(untagged_files):
+                self._load_filesystem_frame(data={f"{folder_path}/{filename}": (filename, False) for filename in untagged_files})
+
+            self._app_execute_in_background("search untagged-files", {"folder_path": folder_path}, _show_untagged_files, group="FILES_VIEW")
         # MENU for FILES
         elif action_name == "OPEN_FILE":
             subprocess.Popen(["open", self.selected_filesystem_file_path])
@@ -121,8 +317,9 @@ class GraphicalApp:
         elif action_name == "REMOVE_TAGS":
             self.action_remove_tag_file()
         elif action_name == "SEE_TAGS":
-            tag_ids = self._app_execute(command_args=["show", "file", self.selected_filesystem_file_path, "tags"])
-            tag_names = [self.my_tags.get(tid) for tid in tag_ids if tid in self.my_tags]
+            tag_ids = self._app_execute("show file tags", file_path=self.selected_filesystem_file_path)
+            all_tags = self._get_all_tags()
+            tag_names = [all_tags.get(tid) for tid in tag_ids if tid in all_tags]
             if len(tag_names):
                 messagebox.showinfo(message="Tags: {}".format(", ".join(tag_names)))
             else:
@@ -131,27 +328,24 @@ class GraphicalApp:
         elif action_name == "MOVE_FILES":
             destination_directory = filedialog.askdirectory()
             if destination_directory is not None and len(destination_directory) > 1:
-                self._app_execute(command_args=["move", "tag", self.selected_tags[0], "files", destination_directory])
+                self._app_execute_in_background("move tag files", {"tag_name": self.selected_tags[0], "destination_path": destination_directory})
         elif action_name == "COPY_FILES":
             destination_directory = filedialog.askdirectory()
             if destination_directory is not None and len(destination_directory) > 1:
-                self._app_execute(command_args=["copy", "tag", self.selected_tags[0], "files", destination_directory])
+                self._app_execute_in_background("copy tag files", {"tag_name": self.selected_tags[0], "destination_path": destination_directory})
         elif action_name == "CHECK_NAME_CONTAINS":
             mandatory_word = simpledialog.askstring("Check filename contains word", "Word:")
             if mandatory_word is not None:
-                file_without_word = self._app_execute(command_args=["check", "tag", self.selected_tags[0], "files", "contains-word", mandatory_word])
-                fs_items = {f"{filepath}/{filename}": (filename, False) for filepath, filename in file_without_word}
-                self._load_filesystem_frame(data=fs_items)
+                def _show_files_without_word(file_without_word):
+                    self._load_filesystem_frame(data={f"{filepath}/{filename}": (filename, False) for filepath, filename in file_without_word})
+
+                self._app_execute_in_background("check tag files contains-word", {"tag_name": self.selected_tags[0], "word": mandatory_word},
+                    _show_files_without_word, group="FILES_VIEW")
 
     def action_create_collection(self):
         my_collection_name = simpledialog.askstring("Create new collection", "Collection name:")
         if my_collection_name is not None:
-            self._app_execute(command_args=["create", "collection", my_collection_name])
-
-            # For performance issue we add manually (avoid to re-read db-table)
-            new_collection_id = create_id_from_label(my_collection_name)
-            self.my_collections[new_collection_id] = my_collection_name
-            self.tags_by_collection[new_collection_id] = {}
+            self._app_execute("create collection", collection_name=my_collection_name)
             self._load_collections_frame()
 
     def action_create_tag(self):
@@ -162,10 +356,7 @@ class GraphicalApp:
         title = "Create new tag for {}".format(self.selected_collection[1])
         my_tag_name = simpledialog.askstring(title, "Tag name:")
         if my_tag_name is not None:
-            self._app_execute(command_args=["create", "tag", my_tag_name, self.selected_collection[1]]) # We add collection name, not id
-            tag_id = create_id_from_label(my_tag_name)
-            self.tags_by_collection[self.selected_collection[0]][tag_id] = my_tag_name
-            self.my_tags[tag_id] = my_tag_name
+            self._app_execute("create tag", tag_name=my_tag_name, collection_name=self.selected_collection[1]) # We add collection name, not id
             self._load_tags_frame()
 
     def action_tag_all_files(self):
@@ -182,15 +373,15 @@ class GraphicalApp:
         message = "Tag all files in this directory with the {} tags ?".format(len(tags_to_use))
         result = messagebox.askyesno(message=message, title="Tag all files")
         if result:
-            for tag_to_use in tags_to_use:
-                self._app_execute(command_args=["set", "folder", self.selected_filesystem_folder_path, "tag", tag_to_use])
+            self._app_execute_in_background("set folder tags", {"folder_path": self.selected_filesystem_folder_path, "tag_names": list(tags_to_use)})
     
     def action_tag_file(self, tag_name):
-        self._app_execute(command_args=["set", "file", self.selected_filesystem_file_path, "tag", tag_name])
+        self._app_execute("set file tag", file_path=self.selected_filesystem_file_path, tag_name=tag_name)
 
     def action_remove_tag_file(self):
-        tag_ids = self._app_execute(command_args=["show", "file", self.selected_filesystem_file_path, "tags"])
-        current_tags = [self.my_tags.get(tid) for tid in tag_ids if tid in self.my_tags]
+        tag_ids = self._app_execute("show file tags", file_path=self.selected_filesystem_file_path)
+        all_tags = self._get_all_tags()
+        current_tags = [all_tags.get(tid) for tid in tag_ids if tid in all_tags]
         
         tags_to_remove = []
         ctags = ",".join(current_tags)
@@ -200,11 +391,11 @@ class GraphicalApp:
                 if tag_name in current_tags:
                     tags_to_remove.append(tag_name)
         for tag in tags_to_remove:
-            self._app_execute(command_args=["unset", "file", self.selected_filesystem_file_path, "tag", tag_name])
+            self._app_execute("unset file tag", file_path=self.selected_filesystem_file_path, tag_name=tag)
 
     def _action_select_collection(self, selected_collection_id):
         is_first_selection = self.selected_collection is None
-        self.selected_collection = (selected_collection_id, self.my_collections[selected_collection_id])
+        self.selected_collection = (selected_collection_id, self._get_collections()[selected_collection_id])
         self._load_tags_frame(collection_id=selected_collection_id)
         if is_first_selection and self.fs_right_menu_type == RightMenuType.FILE:
             # Reload the Right Menu to display the TAG button
@@ -218,8 +409,14 @@ class GraphicalApp:
     def action_open_folder(self):
         self.selected_tags = []
         self._reload_selector_frame()
-        folder_content = self.fs_reader.get_files(self.selected_filesystem_folder_path)
-        self._load_filesystem_frame(data=folder_content)
+        folder_path = self.selected_filesystem_folder_path
+
+        def _show_folder_content(folder_content):
+            self._show_status("")
+            self._load_filesystem_frame(data=folder_content)
+
+        self._show_status("Reading folder...")
+        self.task_runner.submit(lambda app: app.fs_reader.get_files(folder_path), _show_folder_content, group="FILES_VIEW")
 
     def action_link_folder(self):
         if not self.selected_collection:
@@ -236,11 +433,8 @@ class GraphicalApp:
 
         result = messagebox.askyesno(message=f"Link folder to collection {self.selected_collection[1]}{default_tag_suffix}", title="Link folder")
         if result:
-            args = ["link", "folder", self.selected_filesystem_folder_path, "collection", self.selected_collection[1]]
-            if default_tag:
-                args.append("default-tag", default_tag)
-
-            self._app_execute(command_args=args) # We add collection name, not id
+            self._app_execute("link folder collection", folder_path=self.selected_filesystem_folder_path,
+                collection_name=self.selected_collection[1], default_tag=default_tag) # We add collection name, not id
 
     def _action_select_file(self, file_path):
         self.selected_filesystem_file_path = file_path
@@ -272,8 +466,9 @@ class GraphicalApp:
         # Create new collection button
         ttk.Button(self.selector_frame, bootstyle="outline", text="+", command=lambda:self.launch_action("CREATE_COLLECTION")).grid(column=1, row=1, sticky=ttkbconsts.W)
         
-        for column_position, collection_id in enumerate(self.my_collections.keys(), 2):
-            ttk.Button(self.selector_frame, bootstyle="outline", text=self.my_collections[collection_id], command=partial(self._action_select_collection,collection_id)).grid(column=column_position, row=1, sticky=ttkbconsts.W, padx=3, pady=3)
+        collections = self._get_collections()
+        for column_position, collection_id in enumerate(collections.keys(), 2):
+            ttk.Button(self.selector_frame, bootstyle="outline", text=collections[collection_id], command=partial(self._action_select_collection,collection_id)).grid(column=column_position, row=1, sticky=ttkbconsts.W, padx=3, pady=3)
 
     def _load_tags_frame(self, collection_id=None):
         # Delete existing elements 
@@ -286,44 +481,56 @@ class GraphicalApp:
         # Create new tag button  
         ttk.Button(self.selector_frame, bootstyle="outline info", text="+", command=partial(self.launch_action, "CREATE_TAG")).grid(column=2, row=1, sticky=ttkbconsts.W, padx=3, pady=3)
         
-        for column_position, tag_id in enumerate(self._get_tags().keys(), 3):
+        tags = self._get_tags()
+        tag_buttons = {}
+        for column_position, tag_id in enumerate(tags.keys(), 3):
             style = "solid info" if tag_id in self.selected_tags else "outline info"
 
-            ttk.Button(self.selector_frame, bootstyle=style, text=self._get_tags()[tag_id], command=partial(self._action_select_tag, tag_id)).grid(column=column_position, row=1, sticky=ttkbconsts.W, padx=3, pady=3)
-
-    def _load_filesystem_frame(self, data:dict=None):
+            tag_buttons[tag_id] = ttk.Button(self.selector_frame, bootstyle=style, text=tags[tag_id], command=partial(self._action_select_tag, tag_id))
+            tag_buttons[tag_id].grid(column=column_position, row=1, sticky=ttkbconsts.W, padx=3, pady=3)
+        self._load_tag_counts(tags, tag_buttons)
 
-        for child in self.filesystem_frame.winfo_children(): 
-            child.destroy()
+    def _load_tag_counts(self, tags, tag_buttons):
+        """Show counts on the tag buttons: files by tag, or files left if the tag is added to the selection"""
+        if self.selected_tags:
+            command_name, arguments = "search facets with", {"tag_names": list(self.selected_tags)}
+        else:
+            command_name, arguments = "show tag-counts", {"collection_name": self.selected_collection[1]}
+
+        def _show_counts(rows):
+            counts = {row[0]: row[-1] for row in rows or []}
+            for tag_id, button in tag_buttons.items():
+                if tag_id not in self.selected_tags and button.winfo_exists():
+                    button.configure(text=f"{tags[tag_id]} ({counts.get(tag_id, 0)})")
+
+        self.task_runner.submit(lambda app: app.call(command_name, arguments), _show_counts, group="TAG_COUNTS")
+
+    def _read_tagged_files_page(self, app, search, tag_names):
+        """Return the next page of the files with `tag_names`, in the task runner thread (which owns the pages cursor)"""
+        if self.tagged_files_pages is None or self.tagged_files_pages[0] is not search:
+            if self.tagged_files_pages is not None:
+                self.tagged_files_pages[1].close() # Previous search
+            self.tagged_files_pages = (search, app.iter_files_for_tags(tag_names, page_size=FILE_GRID_PAGE_SIZE))
+        page = next(self.tagged_files_pages[1], None)
+        if page is None:
+            return None
+        return [(f"{filepath}/{filename}", (filename, False)) for filepath, filename in page]
 
+    def _load_filesystem_frame(self, data:dict=None):
         if data is not None:
-            pass
+            self.file_grid.set_items(data.items())
         elif len(self.selected_tags) == 0:
-            if data is None:
-                # Default view: display tagged folders
-                data = self.my_tagged_folders
+            # Default view: display tagged folders
+            self.file_grid.set_items(self._get_tagged_folders().items())
         else:
-            if len(self.selected_tags) == 1:
-                args =["show", "tag", self.selected_tags[0], "files"]
-            else:
-                args = ["search", "file", "with"] + self.selected_tags
-            
-            tagged_files = self._app_execute(command_args=args) # format list:  [(path, nom), ...]
-            data = {f"{filepath}/{filename}": (filename, False) for filepath, filename in tagged_files}
-
-        row_position, col_position = (1, 1)
-        for item_pos_id, item_path in enumerate(data.keys(), 1):
-            action = self._action_select_folder if data[item_path][1] else self._action_select_file
-            style = "solid secondary" if data[item_path][1] else "solid light"
-            b = ttk.Button(self.filesystem_frame, bootstyle=style, text=data[item_path][0][:MAX_FILENAME_LEN], command=partial(action, item_path))
-            b.grid(column=col_position, row=row_position, sticky=ttkbconsts.W, padx=3, pady=3)
-            b.bind("<Button-3>", self.display_filesystem_context_menu)
-
-            if item_pos_id % (MAX_ITEMS_BY_ROW) == 0:
-                row_position += 1
-                col_position = 1
-            else:
-                col_position += 1
+            # Pages are read in background, a new selection cancels the reading of the previous one
+            search, tag_names = object(), list(self.selected_tags)
+
+            def _read_page(on_page):
+                self.task_runner.submit(partial(self._read_tagged_files_page, search=search, tag_names=tag_names),
+                    lambda page: (self._show_status(""), on_page(page)), group="FILES_VIEW")
+
+            self.file_grid.set_items(read_page=_read_page)
 
     def _load_filesystem_menu(self, menu_type:RightMenuType):
         if (self.fs_right_menu_type.value != menu_type.value):
@@ -384,11 +591,13 @@ class GraphicalApp:
         root = ttk.Window(themename="united")
 
         def _windows_closed():
+            self.task_runner.stop()
             self.core_app.quit()
             root.destroy()
 
         root.protocol("WM_DELETE_WINDOW", _windows_closed)
         root.title("Minimalist Tag Manager")
+        self.task_runner = TaskRunner(root, on_progress=self._show_status, on_error=self._show_task_error)
         appdisplay =  ttk.Frame(root, padding="5 5 5 5")
         appdisplay.grid(column=2, row=0, sticky=(ttkbconsts.N, ttkbconsts.W, ttkbconsts.E, ttkbconsts.S))
         root.columnconfigure(0, weight=10)
@@ -420,6 +629,16 @@ class GraphicalApp:
 
         self.filesystem_frame =  ttk.Frame(appdisplay, padding="5 5 5 5")
         self.filesystem_frame.grid(column=3, row=2, sticky=(ttkbconsts.N, ttkbconsts.W, ttkbconsts.E, ttkbconsts.S))
+        self.file_grid = FileGrid(self.filesystem_frame, on_select_file=self._action_select_file, on_select_folder=self._action_select_folder,
+            on_context_menu=self.display_filesystem_context_menu)
+        self.file_grid.frame.grid(column=1, row=1, sticky=(ttkbconsts.N, ttkbconsts.W, ttkbconsts.E, ttkbconsts.S))
+
+        # Status of background tasks
+        status_frame = ttk.Frame(appdisplay, padding="5 5 5 5")
+        status_frame.grid(column=3, row=3, sticky=(ttkbconsts.W, ttkbconsts.E))
+        self.status_label = ttk.Label(status_frame, text="")
+        self.status_label.grid(column=1, row=1, sticky=ttkbconsts.W, padx=3)
+        ttk.Button(status_frame, bootstyle=(ttkbconsts.SECONDARY, "outline"), text="Cancel", command=self.task_runner.cancel).grid(column=2, row=1, sticky=ttkbconsts.E, padx=3)
         self._load_filesystem_frame()
 
         ttk.Separator(appdisplay, orient=tk.VERTICAL).grid(column=4, row=0, rowspan=10, sticky=(ttkbconsts.N, ttkbconsts.W, ttkbconsts.E, ttkbconsts.S))       
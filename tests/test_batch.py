@@ -0,0 +1,36 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mtm import App # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+	app = App(db_path=str(tmp_path / "test.db"))
+	yield app
+	app.quit()
+
+
+def _run_batch(app, tmp_path, **options):
+	batch_path = tmp_path / "commands.txt"
+	batch_path.write_text("create tag a\ncreate tag a\ncreate tag b\n")
+	app.run_batch(str(batch_path), **options)
+	app.get_all_tags()
+	return [row[0] for row in app.data]
+
+
+@pytest.mark.parametrize("continue_on_error", [False, True])
+def test_atomic_batch_rolls_back_everything(app, tmp_path, continue_on_error):
+	assert _run_batch(app, tmp_path, atomic=True, continue_on_error=continue_on_error) == []
+	assert "all changes rolled back" in app.info
+
+
+def test_continue_on_error_keeps_other_commands(app, tmp_path):
+	assert _run_batch(app, tmp_path, continue_on_error=True) == ["a", "b"]
+
+
+def test_batch_stops_at_first_error(app, tmp_path):
+	assert _run_batch(app, tmp_path) == ["a"]
@@ -0,0 +1,54 @@
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import mtm # noqa: E402
+from mtm import App, get_client_request, get_socket_path # noqa: E402
+
+
+def test_path_arguments_are_sent_absolute(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	request = get_client_request(["set", "folder", ".", "tag", "paris", "--recursive"])
+	assert request == {"command": "set folder tag", "arguments": {"folder_path": str(tmp_path), "tag_name": "paris"},
+		"options": {"--recursive": True}}
+
+	request = get_client_request(["set", "files", "a.jpg", "sub/b.jpg", "tags", "paris"])
+	assert request["arguments"] == {"file_paths": [os.path.join(tmp_path, "a.jpg"), os.path.join(tmp_path, "sub", "b.jpg")],
+		"tag_names": ["paris"]}
+
+
+def test_unknown_command_is_sent_unchanged():
+	assert get_client_request(["show", "nothing"]) == ["show", "nothing"]
+
+
+def test_search_folder_scope_is_sent_absolute(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	request = get_client_request(["search", "file", "with", "t", "in-folder", "."])
+	assert request["arguments"] == {"tag_names": ["t", "in-folder", str(tmp_path)]}
+	request = get_client_request(["search", "file", "named", "*.jpg", "with", "t", "IN-FOLDER", "sub"])
+	assert request["arguments"] == {"pattern": "*.jpg", "words": ["with", "t", "IN-FOLDER", os.path.join(tmp_path, "sub")]}
+
+
+def test_stdin_path_is_kept(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	assert get_client_request(["set", "files", "-", "tags", "t"])["arguments"]["file_paths"] == ["-"]
+
+
+def test_command_line_stores_absolute_paths(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	(tmp_path / "photo.jpg").touch()
+	app = App(db_path=str(tmp_path / "test.db"))
+	try:
+		app.execute(["create", "tag", "t"])
+		app.execute(["set", "file", "photo.jpg", "tag", "t"])
+		assert app.execute(["search", "file", "with", "t", "in-folder", "."], print_result=False) == [(str(tmp_path), "photo.jpg")]
+	finally:
+		app.quit()
+
+
+def test_socket_path_follows_database(monkeypatch):
+	monkeypatch.setattr(mtm, "SOCKET_PATH", None)
+	assert get_socket_path("/data/other.db") == "/data/other.db.sock"
+	monkeypatch.setattr(mtm, "SOCKET_PATH", "/run/mtm.sock")
+	assert get_socket_path("/data/other.db") == "/run/mtm.sock"
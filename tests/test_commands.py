@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mtm import COMMANDS, Command, compile_commands, match_command # noqa: E402
+
+
+@pytest.mark.parametrize("words, name, arguments", [
+	(["show", "tags"], "show tags", {}),
+	(["SHOW", "Tags"], "show tags", {}), # Keywords are case-insensitive
+	(["create", "tag", "Paris"], "create tag", {"tag_name": "Paris"}), # Values keep their case
+	(["create", "tag", "paris", "places"], "create tag", {"tag_name": "paris", "collection_name": "places"}),
+	(["create", "tag", "tag"], "create tag", {"tag_name": "tag"}), # Keyword read as a value
+	(["show", "folders"], "show folders", {}), # Optional part left out
+	(["show", "folders", "under", "/photos"], "show folders", {"folder_path": "/photos"}),
+	(["show", "tag", "x", "files"], "show tag files", {"tag_name": "x"}),
+	(["show", "tag", "files", "files"], "show tag files", {"tag_name": "files"}),
+	(["show", "tag", "x", "files", "under", "/photos"], "show tag files under", {"tag_name": "x", "folder_path": "/photos"}),
+	(["show", "tag", "x", "files", "under"], "show tag files", {"tag_name": "x", "folder_path": "under"}), # Keyword fallback
+	(["set", "files", "a.jpg", "b.jpg", "tags", "x", "y"], "set files tags", {"file_paths": ["a.jpg", "b.jpg"], "tag_names": ["x", "y"]}),
+	(["set", "files", "a.jpg", "tags", "tags", "y"], "set files tags", {"file_paths": ["a.jpg"], "tag_names": ["tags", "y"]}),
+	(["set", "files", "tags", "tags", "y"], "set files tags", {"file_paths": ["tags"], "tag_names": ["y"]}),
+	(["search", "file", "with", "x", "AND", "NOT", "y"], "search file with", {"tag_names": ["x", "AND", "NOT", "y"]}),
+	(["search", "file", "with-id", "3"], "search file with-id", {"tag_ids": ["3"]}),
+	(["search", "file", "with", "with-id"], "search file with", {"tag_names": ["with-id"]}),
+	(["search", "file", "named", "*.jpg"], "search file named", {"pattern": "*.jpg"}),
+	(["search", "file", "named", "*.jpg", "with", "x"], "search file named", {"pattern": "*.jpg", "words": ["with", "x"]}),
+])
+def test_match_command(words, name, arguments):
+	command, matched_arguments = match_command(words)
+	assert (command.name, matched_arguments) == (name, arguments)
+
+
+@pytest.mark.parametrize("words", [[], ["show"], ["show", "nothing"], ["set", "files", "a.jpg", "tags"], ["create", "tag", "a", "b", "c"]])
+def test_unknown_command(words):
+	with pytest.raises(ValueError, match="Unknown command"):
+		match_command(words)
+
+
+def test_every_command_matches_its_usage():
+	for command in COMMANDS:
+		words = [word if kind == "keyword" else f"{word}-value" for kind, word, _ in command.parts]
+		assert match_command(words)[0].usage == command.usage
+
+
+def test_compile_rejects_ambiguous_commands():
+	with pytest.raises(ValueError, match="can not be told apart"):
+		compile_commands([Command("show <name>", None), Command("show <other_name>", None)])
+	with pytest.raises(ValueError, match="must end the command"):
+		compile_commands([Command("show [<name>] files", None)])
@@ -0,0 +1,75 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mtm import App # noqa: E402
+
+EXPORT_NAMES = ["export.ndjson", "export.csv", "export.mtmb"]
+
+
+def _snapshot(app):
+	"""Content of the database by slugs and paths, independent of the row ids"""
+	queries = {
+		"collections": "SELECT slug, collection_name FROM collection;",
+		"tags": "SELECT t.slug, t.tag_name, c.slug FROM tag t LEFT JOIN collection c USING(collection_id);",
+		"linked_folders": """SELECT f.folderpath, c.slug, t.slug FROM linkedfolder lf JOIN folder f USING(folder_id)
+			LEFT JOIN collection c USING(collection_id) LEFT JOIN tag t ON t.tag_id = lf.default_tag_id;""",
+		"file_tags": "SELECT f.folderpath, ft.filename, t.slug FROM filetag ft JOIN folder f USING(folder_id) JOIN tag t USING(tag_id);",
+		"tag_counts": "SELECT t.slug, ts.file_count FROM tagstat ts JOIN tag t USING(tag_id);",
+	}
+	snapshot = {}
+	for name, query in queries.items():
+		app.cursor.execute(query)
+		rows = app.cursor.fetchall()
+		assert len(rows) == len(set(rows)), f"Duplicated {name}"
+		snapshot[name] = set(rows)
+	return snapshot
+
+
+@pytest.fixture
+def app(tmp_path):
+	folder = tmp_path / "photos"
+	(folder / "sub").mkdir(parents=True)
+	app = App(db_path=str(tmp_path / "source.db"))
+	app.execute(["create", "collection", "places"])
+	app.execute(["create", "tag", "Paris", "places"])
+	app.execute(["create", "tag", "summer"])
+	app.execute(["link", "folder", str(folder), "collection", "places", "default-tag", "summer"])
+	app.execute(["set", "files", str(folder / "a.jpg"), str(folder / "sub" / "b, \"quoted\".jpg"), "tags", "Paris", "summer"])
+	app.execute(["set", "file", str(folder / "été à Paris.jpg"), "tag", "summer"])
+	yield app
+	app.quit()
+
+
+@pytest.mark.parametrize("export_name", EXPORT_NAMES)
+def test_export_import_round_trip(app, tmp_path, export_name):
+	app.execute(["export", str(tmp_path / export_name)])
+	imported = App(db_path=str(tmp_path / "imported.db"))
+	try:
+		imported.execute(["import", str(tmp_path / export_name)])
+		assert _snapshot(imported) == _snapshot(app)
+		with pytest.raises(ValueError, match="--merge"):
+			imported.execute(["import", str(tmp_path / export_name)])
+	finally:
+		imported.quit()
+
+
+@pytest.mark.parametrize("export_name", EXPORT_NAMES)
+def test_import_merge_keeps_existing_rows(app, tmp_path, export_name):
+	folder = tmp_path / "photos"
+	app.execute(["export", str(tmp_path / export_name)])
+	merged = App(db_path=str(tmp_path / "merged.db"))
+	try:
+		merged.execute(["create", "tag", "winter"])
+		merged.execute(["set", "files", str(folder / "a.jpg"), str(folder / "c.jpg"), "tags", "summer", "winter"])
+		merged.execute(["import", str(tmp_path / export_name), "--merge"])
+		expected = _snapshot(app)
+		snapshot = _snapshot(merged)
+		assert snapshot["file_tags"] == expected["file_tags"] | {(str(folder), "a.jpg", "winter"), (str(folder), "c.jpg", "summer"),
+			(str(folder), "c.jpg", "winter")}
+		assert snapshot["tag_counts"] == {("paris", 2), ("summer", 4), ("winter", 2)}
+		assert snapshot["linked_folders"] == expected["linked_folders"]
+	finally:
+		merged.quit()
@@ -0,0 +1,24 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import mtm # noqa: E402
+
+
+def test_rows_read_by_iterating_the_cursor_are_counted(tmp_path, monkeypatch):
+	metrics_path = tmp_path / "metrics.ndjson"
+	monkeypatch.setattr(mtm, "METRICS_PATH", str(metrics_path))
+	folder = tmp_path / "photos"
+	folder.mkdir()
+	for position in range(50):
+		(folder / f"{position}.jpg").touch()
+	app = mtm.App(db_path=str(tmp_path / "test.db"))
+	try:
+		app.assign_tags_to_folder(["photos"], str(folder))
+		app.db_connection.commit()
+		assert app.execute(["search", "untagged-files", str(folder)], print_result=False) == []
+	finally:
+		app.quit()
+	record = json.loads(metrics_path.read_text().splitlines()[-1])
+	assert record["rows_read"] >= 50
@@ -0,0 +1,35 @@
+import io
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import mtm # noqa: E402
+from mtm import App, write_formatted_result # noqa: E402
+
+
+def test_paths0_writes_file_rows():
+	output = io.StringIO()
+	write_formatted_result("", iter([("/media", "a.mkv"), "b.mkv"]), "paths0", output)
+	assert output.getvalue() == "/media/a.mkv\0b.mkv\0"
+
+
+@pytest.mark.parametrize("rows", [[("tag", "Tag", None)], [("tag", "Tag", 3)]])
+def test_paths0_rejects_other_rows(rows):
+	with pytest.raises(ValueError, match="paths0"):
+		write_formatted_result("", iter(rows), "paths0", io.StringIO())
+
+
+def test_batch_output_uses_batch_format(tmp_path, monkeypatch):
+	output = io.StringIO()
+	monkeypatch.setattr(mtm, "stdout", output)
+	batch_path = tmp_path / "commands.txt"
+	batch_path.write_text("create tag x\nshow tags\n")
+	app = App(db_path=str(tmp_path / "test.db"))
+	try:
+		app.execute(["batch", str(batch_path), "--format", "json"])
+	finally:
+		app.quit()
+	assert json.loads(output.getvalue()) == [["x", "x", None]]
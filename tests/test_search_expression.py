@@ -0,0 +1,51 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mtm import App, create_id_from_label, parse_tag_query # noqa: E402
+
+
+def test_operators_and_parentheses_are_separate_words():
+	assert parse_tag_query(["holidays", "AND", "(", "brussels", "OR", "paris", ")", "NOT", "vo"]) == ("AND", (
+		("TAG", "holidays"), ("OR", (("TAG", "brussels"), ("TAG", "paris"))), ("NOT", ("TAG", "vo"))))
+
+
+@pytest.mark.parametrize("tag_name", ["my tag", "a(b)", "holidays)", "(x", "AND more"])
+def test_tag_name_is_one_word(tag_name):
+	assert parse_tag_query([tag_name]) == ("TAG", create_id_from_label(tag_name))
+
+
+def test_search_tag_with_space(tmp_path):
+	app = App(db_path=str(tmp_path / "test.db"))
+	try:
+		app.create_new_tag("my tag")
+		app.assign_tag_to_file(str(tmp_path / "photo.jpg"), "my tag")
+		app.get_all_files_for_tags(["my tag"])
+		assert list(app.data) == [(str(tmp_path), "photo.jpg")]
+		app.get_all_files_for_tags(["my tag", "AND", "NOT", "other"])
+		assert list(app.data) == [(str(tmp_path), "photo.jpg")]
+	finally:
+		app.quit()
+
+
+@pytest.mark.parametrize("words", [["holidays AND (brussels OR paris) AND NOT vo"], ["holidays", "AND", "(brussels", "OR", "paris)"]])
+def test_quoted_expression_is_a_syntax_error(tmp_path, words):
+	app = App(db_path=str(tmp_path / "test.db"))
+	try:
+		app.create_new_tag("holidays")
+		with pytest.raises(ValueError, match="separate words"):
+			app.get_all_files_for_tags(words)
+	finally:
+		app.quit()
+
+
+def test_existing_tag_with_parentheses_is_searched(tmp_path):
+	app = App(db_path=str(tmp_path / "test.db"))
+	try:
+		app.assign_tag_to_file(str(tmp_path / "photo.jpg"), "a(b)")
+		app.get_all_files_for_tags(["a(b)"])
+		assert list(app.data) == [(str(tmp_path), "photo.jpg")]
+	finally:
+		app.quit()
@@ -0,0 +1,100 @@
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mtm import TagBitmap, TagIndex # noqa: E402
+
+
+def _random_values(seed):
+	"""Values spread over sparse chunks (sorted arrays) and dense chunks (bitsets)"""
+	rng = random.Random(seed)
+	values = set(rng.sample(range(0, 65536), 200)) # Sparse chunk
+	values.update(rng.sample(range(65536, 2 * 65536), 6000)) # Dense chunk
+	values.update(rng.sample(range(3 * 65536, 4 * 65536), rng.choice([10, 5000]))) # Sparse or dense
+	return values
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_bitmap_operations_match_sets(seed):
+	a_values, b_values = _random_values(seed), _random_values(seed + 100)
+	a, b = TagBitmap.from_sorted(sorted(a_values)), TagBitmap.from_sorted(sorted(b_values))
+
+	assert list(a) == sorted(a_values)
+	assert len(a) == len(a_values)
+	assert set(a & b) == a_values & b_values
+	assert set(a | b) == a_values | b_values
+	assert set(a - b) == a_values - b_values
+	assert set(b - a) == b_values - a_values
+	assert set(TagBitmap.from_json(a.to_json())) == a_values
+	for value in list(a_values)[:50] + [65535, 65536, 2 * 65536 + 1, 5 * 65536]:
+		assert (value in a) == (value in a_values)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_bitmap_updates_match_sets(seed):
+	rng = random.Random(seed)
+	values = _random_values(seed)
+	values.update(range(5 * 65536, 5 * 65536 + 100)) # Chunk missing from `other`
+	bitmap = TagBitmap.from_sorted(sorted(values))
+	other = TagBitmap.from_sorted(sorted(_random_values(seed + 100)))
+	union, difference = bitmap | other, bitmap - other
+	union_values, difference_values = set(union), set(difference)
+	for _ in range(3000):
+		value = rng.randrange(0, 6 * 65536)
+		if rng.random() < 0.5:
+			bitmap.add(value)
+			values.add(value)
+		else:
+			bitmap.discard(value)
+			values.discard(value)
+	assert list(bitmap) == sorted(values)
+	assert len(bitmap) == len(values)
+	assert set(union) == union_values # Results do not share containers with their operands
+	assert set(difference) == difference_values
+
+
+def _index(files_by_tag):
+	index = TagIndex("unused.tagidx")
+	index.files = sorted({key for keys in files_by_tag.values() for key in keys})
+	index.ordinals = {key: ordinal for ordinal, key in enumerate(index.files)}
+	index.bitmaps = {slug: TagBitmap.from_sorted(sorted(index.ordinals[key] for key in keys)) for slug, keys in files_by_tag.items()}
+	index.all_files = TagBitmap.from_sorted(range(len(index.files)))
+	index.generation = 0
+	return index
+
+
+def _files(index, bitmap):
+	return {index.files[ordinal] for ordinal in bitmap}
+
+
+def test_apply_pending_matches_sets():
+	rng = random.Random(1)
+	keys = [("/photos", f"{number}.jpg") for number in range(300)]
+	files_by_tag = {slug: set(rng.sample(keys, 100)) for slug in ("paris", "summer", "beach")}
+	index = _index(files_by_tag)
+	for _ in range(500):
+		slug, key, is_added = rng.choice(list(files_by_tag)), rng.choice(keys + [("/new", "x.jpg")]), rng.random() < 0.5
+		changed_rows = int((key not in files_by_tag[slug]) if is_added else (key in files_by_tag[slug]))
+		(files_by_tag[slug].add if is_added else files_by_tag[slug].discard)(key)
+		index.pending.append((is_added, slug, key, changed_rows))
+	index.apply_pending(sum(p[3] for p in index.pending), None)
+
+	for slug, slug_files in files_by_tag.items():
+		assert _files(index, index.search(("TAG", slug))) == slug_files
+	tagged_files = set().union(*files_by_tag.values())
+	assert _files(index, index.all_files) == tagged_files
+	assert _files(index, index.search(("AND", [("TAG", "paris"), ("NOT", ("TAG", "beach"))]))) == files_by_tag["paris"] - files_by_tag["beach"]
+	assert _files(index, index.search(("OR", [("TAG", "summer"), ("TAG", "beach")]))) == files_by_tag["summer"] | files_by_tag["beach"]
+	assert _files(index, index.search(("NOT", ("TAG", "paris")))) == tagged_files - files_by_tag["paris"]
+	assert _files(index, index.search(("TAG", "summer"), scope_tags=["beach"])) == files_by_tag["summer"] & files_by_tag["beach"]
+
+
+def test_apply_pending_drops_the_index_after_other_writes():
+	index = _index({"paris": {("/photos", "a.jpg")}})
+	index.pending.append((True, "paris", ("/photos", "b.jpg"), 1))
+	index.apply_pending(2, None) # One more change than recorded: written by another connection
+	assert index.generation is None
+	assert index.pending == []
@@ -0,0 +1,73 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mtm import App, TagIndex # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+	app = App(use_tag_index=True, db_path=str(tmp_path / "test.db"))
+	yield app
+	app.quit()
+
+
+def _search(app, expression):
+	return app.execute(["search", "file", "with", *expression.split()], print_result=False)
+
+
+def _forbid_rebuild(monkeypatch):
+	def _rebuild(*args):
+		raise AssertionError("The tag index was fully rebuilt")
+	monkeypatch.setattr(TagIndex, "rebuild", _rebuild)
+
+
+def test_bulk_writes_keep_the_index_in_sync(app, tmp_path, monkeypatch):
+	folder = tmp_path / "photos"
+	folder.mkdir()
+	for name in ("a.jpg", "b.jpg", "c.jpg"):
+		(folder / name).touch()
+	app.execute(["create", "tag", "old"])
+	app.execute(["set", "file", str(folder / "a.jpg"), "tag", "old"])
+	assert _search(app, "old") == [(str(folder), "a.jpg")]
+	_forbid_rebuild(monkeypatch)
+
+	app.execute(["set", "folder", str(folder), "tags", "paris", "summer"])
+	assert _search(app, "paris AND summer") == [(str(folder), name) for name in ("a.jpg", "b.jpg", "c.jpg")]
+
+	app.execute(["unset", "files", str(folder / "a.jpg"), str(folder / "b.jpg"), "tags", "paris", "old"])
+	assert _search(app, "paris") == [(str(folder), "c.jpg")]
+	assert _search(app, "NOT summer") == []
+	assert _search(app, "old") == []
+
+	app.execute(["set", "files", str(folder / "a.jpg"), "tags", "old"])
+	assert _search(app, "summer AND NOT paris") == [(str(folder), "a.jpg"), (str(folder), "b.jpg")]
+	assert _search(app, "old") == [(str(folder), "a.jpg")]
+
+
+def test_import_and_move_keep_the_index_in_sync(app, tmp_path, monkeypatch):
+	folder, destination = tmp_path / "photos", tmp_path / "destination"
+	folder.mkdir()
+	destination.mkdir()
+	(folder / "a.jpg").touch()
+	app.execute(["set", "file", str(folder / "a.jpg"), "tag", "paris"])
+	other = App(db_path=str(tmp_path / "other.db"))
+	try:
+		other.execute(["set", "file", str(folder / "b.jpg"), "tag", "summer"])
+		other.execute(["set", "file", str(folder / "a.jpg"), "tag", "summer"])
+		other.execute(["export", str(tmp_path / "other.ndjson")])
+	finally:
+		other.quit()
+	assert _search(app, "paris") == [(str(folder), "a.jpg")]
+	_forbid_rebuild(monkeypatch)
+
+	app.execute(["import", str(tmp_path / "other.ndjson"), "--merge"])
+	assert _search(app, "summer AND NOT paris") == [(str(folder), "b.jpg")]
+	assert _search(app, "paris OR summer") == [(str(folder), "a.jpg"), (str(folder), "b.jpg")]
+
+	app.move_tag_files("paris", str(destination))
+	app._app_commit()
+	assert _search(app, "paris") == [(str(destination), "a.jpg")]
+	assert _search(app, "summer") == [(str(destination), "a.jpg"), (str(folder), "b.jpg")]
@@ -0,0 +1,90 @@
+import sys
+from collections import Counter
+from itertools import permutations
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mtm import App # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+	app = App(db_path=str(tmp_path / "test.db"))
+	yield app
+	app.quit()
+
+
+def _assert_counts_match_file_tags(app):
+	"""tagstat and tagpair, kept by the triggers, must count the same as a count from filetag"""
+	app.cursor.execute("SELECT folder_id, filename, tag_id FROM filetag;")
+	tags_by_file = {}
+	for folder_id, filename, tag_id in app.cursor.fetchall():
+		tags_by_file.setdefault((folder_id, filename), set()).add(tag_id)
+	tag_counts = Counter(tag_id for tag_ids in tags_by_file.values() for tag_id in tag_ids)
+	pair_counts = Counter(pair for tag_ids in tags_by_file.values() for pair in permutations(tag_ids, 2))
+
+	app.cursor.execute("SELECT tag_id, file_count FROM tagstat WHERE file_count != 0;")
+	assert dict(app.cursor.fetchall()) == tag_counts
+	app.cursor.execute("SELECT tag_id, other_tag_id, file_count FROM tagpair WHERE file_count != 0;")
+	assert {(tag_id, other_tag_id): count for tag_id, other_tag_id, count in app.cursor.fetchall()} == pair_counts
+
+
+def _generation(app):
+	app.cursor.execute("SELECT value FROM mtm_meta WHERE key = 'filetag_generation';")
+	return app.cursor.fetchone()[0]
+
+
+def _file_key(app, file_path):
+	return app._get_folder_id(str(Path(file_path).parent), create=True), Path(file_path).name
+
+
+def test_counts_and_generation_follow_file_tag_changes(app, tmp_path):
+	a, b, c = (str(tmp_path / name) for name in ("a.jpg", "b.jpg", "c.jpg"))
+	generation = _generation(app)
+
+	app.execute(["set", "files", a, b, "tags", "paris", "summer", "beach"])
+	app.execute(["set", "file", c, "tag", "paris"])
+	_assert_counts_match_file_tags(app)
+	assert _generation(app) == generation + 7
+
+	app.execute(["set", "file", a, "tag", "paris"]) # Already tagged: nothing changes
+	assert _generation(app) == generation + 7
+
+	app.execute(["unset", "files", a, c, "tags", "paris"])
+	app.execute(["unset", "file", b, "tag", "beach"])
+	_assert_counts_match_file_tags(app)
+	assert _generation(app) == generation + 10
+
+	app._move_file_rows([(_file_key(app, a), _file_key(app, str(tmp_path / "moved" / "a.jpg")))])
+	app.db_connection.commit()
+	_assert_counts_match_file_tags(app)
+	assert _generation(app) == generation + 12 # Two rows moved
+
+	app._move_file_rows([(_file_key(app, b), _file_key(app, str(tmp_path / "moved" / "a.jpg")))]) # Onto a file sharing `summer`
+	app.db_connection.commit()
+	_assert_counts_match_file_tags(app)
+	assert _generation(app) == generation + 14 # `paris` moved, `summer` already there is deleted
+
+	app.execute(["delete", "tag", "summer"]) # File tags deleted by cascade
+	_assert_counts_match_file_tags(app)
+	assert _generation(app) == generation + 15
+
+
+def test_counts_match_a_rebuild(app, tmp_path):
+	for number in range(20):
+		tag_names = [tag_name for position, tag_name in enumerate(["paris", "summer", "beach", "night"]) if number % (position + 2) == 0]
+		if tag_names:
+			app.execute(["set", "files", str(tmp_path / f"{number}.jpg"), "tags", *tag_names])
+	app.execute(["unset", "files", *(str(tmp_path / f"{number}.jpg") for number in range(0, 20, 3)), "tags", "summer", "night"])
+	app.cursor.execute("SELECT * FROM tagstat WHERE file_count != 0 ORDER BY tag_id;")
+	tag_stats = app.cursor.fetchall()
+	app.cursor.execute("SELECT * FROM tagpair WHERE file_count != 0 ORDER BY tag_id, other_tag_id;")
+	tag_pairs = app.cursor.fetchall()
+
+	app._rebuild_tag_stats()
+	app.cursor.execute("SELECT * FROM tagstat ORDER BY tag_id;")
+	assert app.cursor.fetchall() == tag_stats
+	app.cursor.execute("SELECT * FROM tagpair ORDER BY tag_id, other_tag_id;")
+	assert app.cursor.fetchall() == tag_pairs
@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mtm import App # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+	app = App(db_path=str(tmp_path / "test.db"))
+	yield app
+	app.quit()
+
+
+def test_tagging_creates_missing_tag(app, tmp_path):
+	app.assign_tag_to_file(str(tmp_path / "a.jpg"), "To Read")
+	app.assign_tags([str(tmp_path / "b.jpg")], ["to read", "later"])
+	app.get_all_tags()
+	assert list(app.data) == [("later", "later", None), ("to_read", "To Read", None)]
+	app.get_all_files_for_tag("to read")
+	assert list(app.data) == [(str(tmp_path), "a.jpg"), (str(tmp_path), "b.jpg")]
+
+
+def test_untagging_does_not_create_tag(app, tmp_path):
+	with pytest.raises(ValueError, match="not found"):
+		app.remove_tags([str(tmp_path / "a.jpg")], ["unknown"])
+
+
+def test_check_files_contains_word_is_literal(app, tmp_path):
+	app.assign_tags([str(tmp_path / name) for name in ("Holiday.jpg", "holiday*.jpg", "work.jpg")], ["photos"])
+	app.check_tag_files_contains_word("photos", "holiday*")
+	assert list(app.data) == [(str(tmp_path), "Holiday.jpg"), (str(tmp_path), "work.jpg")]
@@ -0,0 +1,53 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mtm import App, FilesystemReader # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+	app = App(db_path=str(tmp_path / "test.db"))
+	yield app
+	app.quit()
+
+
+def _tag_same_named_files(app, tmp_path):
+	"""Tag `a/x.jpg` and `b/x.jpg` (same name, different content) and `a/y.jpg`, return the destination folder"""
+	for folder_name in ("a", "b"):
+		(tmp_path / folder_name).mkdir()
+		(tmp_path / folder_name / "x.jpg").write_text(folder_name)
+	(tmp_path / "a" / "y.jpg").write_text("y")
+	app.create_new_tag("photos")
+	for file_path in ("a/x.jpg", "b/x.jpg", "a/y.jpg"):
+		app.assign_tag_to_file(str(tmp_path / file_path), "photos")
+	app.db_connection.commit()
+	destination = tmp_path / "destination"
+	destination.mkdir()
+	return destination
+
+
+@pytest.mark.parametrize("command", ["move", "copy"])
+def test_same_named_files_are_not_transferred(app, tmp_path, command):
+	destination = _tag_same_named_files(app, tmp_path)
+	getattr(app, f"{command}_tag_files")("photos", str(destination), workers=2)
+
+	assert sorted(Path(source_path).relative_to(tmp_path).as_posix() for source_path, _ in app.data) == ["a/x.jpg", "b/x.jpg"]
+	assert (tmp_path / "a" / "x.jpg").read_text() == "a"
+	assert (tmp_path / "b" / "x.jpg").read_text() == "b"
+	assert sorted(os.listdir(destination)) == ["y.jpg"] # No temporary file left
+	assert (tmp_path / "a" / "y.jpg").exists() == (command == "copy")
+
+
+def test_move_does_not_replace_existing_file(tmp_path):
+	(tmp_path / "source.txt").write_text("source")
+	(tmp_path / "destination").mkdir()
+	(tmp_path / "destination" / "source.txt").write_text("existing")
+
+	with pytest.raises(FileExistsError):
+		FilesystemReader().transfer_file(tmp_path / "source.txt", str(tmp_path / "destination"), move=True)
+	assert (tmp_path / "source.txt").read_text() == "source"
+	assert (tmp_path / "destination" / "source.txt").read_text() == "existing"